@@ -17,6 +17,7 @@ from .models import User, OTP, LoginSession
 from .serializers import (UserSerializer, UserCreateSerializer, 
                          LoginSerializer, OTPSerializer, 
                          ChangePasswordSerializer, SessionSerializer)
+from monitoring.audit import audit_log
 from monitoring.models import UserActivity
 
 
@@ -63,7 +64,8 @@ class UserLoginView(APIView):
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             
             # Log activity
-            UserActivity.objects.create(
+            audit_log(
+                UserActivity,
                 user=user,
                 activity_type='LOGIN',
                 description='Login attempt initiated',
@@ -107,7 +109,8 @@ class VerifyOTPView(APIView):
             )
             
             # Log successful login
-            UserActivity.objects.create(
+            audit_log(
+                UserActivity,
                 user=user,
                 activity_type='LOGIN',
                 description='Successful login with OTP',
@@ -149,7 +152,8 @@ class UserLogoutView(APIView):
                 pass
         
         # Log activity
-        UserActivity.objects.create(
+        audit_log(
+            UserActivity,
             user=request.user,
             activity_type='LOGOUT',
             description='User logged out',
@@ -190,7 +194,8 @@ class ChangePasswordView(APIView):
             user.save()
             
             # Log activity
-            UserActivity.objects.create(
+            audit_log(
+                UserActivity,
                 user=user,
                 activity_type='PASSWORD_CHANGE',
                 description='Password changed successfully',
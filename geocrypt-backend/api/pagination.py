@@ -0,0 +1,93 @@
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on (field, id), newest first.
+
+    Each page continues strictly after the last row of the previous one,
+    using a WHERE clause the (field, id) indexes can seek to, so every page
+    costs the same however deep it is. The view names the ordering field
+    with `keyset_field` (default 'timestamp'); ties are broken by id, so
+    rows are never skipped or repeated. Page size comes from LOG_PAGE_SIZE
+    and can be changed per request with ?page_size= up to LOG_MAX_PAGE_SIZE.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    keyset_field = 'timestamp'
+
+    def get_page_size(self, request):
+        page_size = getattr(settings, 'LOG_PAGE_SIZE', 50)
+        max_page_size = getattr(settings, 'LOG_MAX_PAGE_SIZE', 500)
+        try:
+            requested = int(request.query_params.get(self.page_size_query_param, page_size))
+        except (TypeError, ValueError):
+            requested = page_size
+        return max(1, min(requested, max_page_size))
+
+    def encode_cursor(self, value, pk):
+        position = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value, pk])
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def decode_cursor(self, queryset, encoded):
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            field = queryset.model._meta.get_field(self.field)
+            value = field.to_python(value)
+            if value is None or isinstance(pk, bool):
+                raise ValueError('Invalid cursor')
+            return value, int(pk)
+        except (TypeError, ValueError, ValidationError):
+            raise ParseError('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.field = getattr(view, 'keyset_field', self.keyset_field)
+        self.page_size = self.get_page_size(request)
+        self.request = request
+
+        queryset = queryset.order_by(f'-{self.field}', '-id')
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            value, pk = self.decode_cursor(queryset, encoded)
+            # field <= value is the index range; the OR only trims the ties
+            queryset = queryset.filter(**{f'{self.field}__lte': value}).filter(
+                Q(**{f'{self.field}__lt': value}) | Q(id__lt=pk)
+            )
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        cursor = self.encode_cursor(getattr(self.last, self.field), self.last.pk)
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
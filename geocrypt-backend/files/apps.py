@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class FilesConfig(AppConfig):
     name = 'files'
+
+    def ready(self):
+        from . import signals  # noqa: F401
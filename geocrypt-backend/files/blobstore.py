@@ -0,0 +1,103 @@
+import os
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .keys import wrap_data_key
+from .models import EncryptedBlob, File, ReencryptionJob
+from .reencryption import TEMP_FILES_DIR
+from .upload_handlers import ENCRYPTED_FILES_DIR
+
+
+# Blobs are addressed by a keyed hash of their plaintext (see
+# keys.content_hasher), so identical uploads map to one EncryptedBlob row.
+# Blob files keep their unique upload names; deduplication happens on the
+# digest row, so concurrent uploads of the same content never overwrite each
+# other's ciphertext.
+
+
+def acquire_blob(uploaded_file):
+    """
+    Return the EncryptedBlob for an encrypted upload and take a reference.
+
+    If a blob with the same content already exists the upload's own
+    ciphertext is dropped once the surrounding transaction commits, so a
+    duplicate upload costs no extra disk. Must be called inside
+    `transaction.atomic()` together with saving the referencing File.
+    """
+    blob, created = EncryptedBlob.objects.select_for_update().get_or_create(
+        digest=uploaded_file.digest,
+        defaults={
+            'file_path': uploaded_file.encrypted_name,
+            'size': uploaded_file.size,
+            'encryption_key': wrap_data_key(uploaded_file.key),
+        }
+    )
+    EncryptedBlob.objects.filter(id=blob.id).update(ref_count=F('ref_count') + 1)
+    if not created:
+        transaction.on_commit(uploaded_file.discard)
+    return blob
+
+
+def release_blob(blob_id):
+    """Drop one reference to a blob; unreferenced blobs are removed by GC"""
+    EncryptedBlob.objects.filter(id=blob_id).update(ref_count=F('ref_count') - 1)
+
+
+def collect_garbage(grace_seconds=3600, dry_run=False):
+    """
+    Delete unreferenced blobs and orphaned ciphertext files.
+
+    A blob is removed once no File references it. Files under the encrypted
+    files directory that no File or blob row points at (left behind by a
+    crash or a rolled-back upload) are removed once they are older than
+    `grace_seconds`, so uploads still in flight are never touched. Partial
+    re-encryption output is only swept while no re-encryption job is running.
+    """
+    stats = {'blobs_deleted': 0, 'orphans_deleted': 0, 'bytes_freed': 0}
+
+    unreferenced = EncryptedBlob.objects.filter(ref_count__lte=0).exclude(
+        id__in=File.objects.filter(blob__isnull=False).values('blob_id')
+    )
+    for blob in unreferenced.iterator():
+        path = blob.file_path.path
+        with transaction.atomic():
+            locked = EncryptedBlob.objects.select_for_update().filter(id=blob.id, ref_count__lte=0).first()
+            if locked is None or File.objects.filter(blob_id=blob.id).exists():
+                continue
+            if not dry_run:
+                locked.delete()
+        stats['blobs_deleted'] += 1
+        if os.path.exists(path):
+            stats['bytes_freed'] += os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+
+    directory = os.path.join(settings.MEDIA_ROOT, ENCRYPTED_FILES_DIR)
+    if not os.path.isdir(directory):
+        return stats
+    referenced = set(File.objects.values_list('file_path', flat=True))
+    referenced.update(EncryptedBlob.objects.values_list('file_path', flat=True))
+    cutoff = time.time() - grace_seconds
+    for entry in os.scandir(directory):
+        name = f'{ENCRYPTED_FILES_DIR}/{entry.name}'
+        if not entry.is_file() or name in referenced or entry.stat().st_mtime > cutoff:
+            continue
+        _remove_orphan(entry, stats, dry_run)
+
+    temp_directory = os.path.join(settings.MEDIA_ROOT, TEMP_FILES_DIR)
+    if os.path.isdir(temp_directory) and not ReencryptionJob.objects.filter(status='RUNNING').exists():
+        for entry in os.scandir(temp_directory):
+            if entry.is_file() and entry.stat().st_mtime <= cutoff:
+                _remove_orphan(entry, stats, dry_run)
+
+    return stats
+
+
+def _remove_orphan(entry, stats, dry_run):
+    stats['orphans_deleted'] += 1
+    stats['bytes_freed'] += entry.stat().st_size
+    if not dry_run:
+        os.remove(entry.path)
@@ -0,0 +1,214 @@
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .utils import FileEncryptor
+
+
+# Wrapped data key format
+#
+#   magic (4) | version (1) | KEK id (8) | nonce (12) | wrapped key + GCM tag
+#
+# Each File row keeps its own data key (a Fernet key) wrapped by a master key
+# encryption key (KEK). Rotating the KEK only re-wraps these few bytes; file
+# payloads are never re-encrypted. Values without the magic are legacy raw
+# data keys stored before envelope encryption was introduced.
+WRAPPED_KEY_MAGIC = b'GCKW'
+WRAPPED_KEY_VERSION = 1
+WRAPPED_KEY_HEADER = struct.Struct('>4sB8s')
+KEK_ID_SIZE = 8
+NONCE_SIZE = 12
+
+
+def kek_id(kek):
+    """Short, stable identifier for a master key"""
+    return hashlib.sha256(kek).digest()[:KEK_ID_SIZE]
+
+
+def decode_master_key(value):
+    key = base64.urlsafe_b64decode(value.strip())
+    if len(key) != 32:
+        raise ValueError('Master keys must be 32 bytes, urlsafe-base64 encoded')
+    return key
+
+
+def load_keyfile(path):
+    """
+    Read the master key from a local keyfile.
+
+    A missing keyfile is only generated in DEBUG. Anywhere else a fresh key
+    would differ per host or container and leave files wrapped elsewhere
+    unreadable, so the key has to be provided.
+    """
+    if not os.path.exists(path):
+        if not settings.DEBUG:
+            raise ImproperlyConfigured(
+                f'No file master key: set FILE_MASTER_KEY or install the keyfile at {path}'
+            )
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(base64.urlsafe_b64encode(os.urandom(32)).decode('ascii'))
+    with open(path) as f:
+        return decode_master_key(f.read())
+
+
+class MasterKeyRing:
+    """The active KEK plus any retired KEKs still needed to unwrap old keys"""
+
+    def __init__(self, active_key, retired_keys=()):
+        self.active_key = active_key
+        self.active_id = kek_id(active_key)
+        self.keys = {kek_id(key): AESGCM(key) for key in retired_keys}
+        self.keys[self.active_id] = AESGCM(active_key)
+
+    @classmethod
+    def from_settings(cls):
+        if settings.FILE_MASTER_KEY:
+            active_key = decode_master_key(settings.FILE_MASTER_KEY)
+        else:
+            active_key = load_keyfile(settings.FILE_MASTER_KEYFILE)
+        retired_keys = [decode_master_key(value) for value in settings.FILE_RETIRED_MASTER_KEYS]
+        return cls(active_key, retired_keys)
+
+    def wrap(self, data_key):
+        header = WRAPPED_KEY_HEADER.pack(WRAPPED_KEY_MAGIC, WRAPPED_KEY_VERSION, self.active_id)
+        nonce = os.urandom(NONCE_SIZE)
+        return header + nonce + self.keys[self.active_id].encrypt(nonce, bytes(data_key), header)
+
+    def unwrap(self, wrapped_key):
+        wrapped_key = bytes(wrapped_key)
+        if not is_wrapped(wrapped_key):
+            return wrapped_key
+        header = wrapped_key[:WRAPPED_KEY_HEADER.size]
+        _, version, key_id = WRAPPED_KEY_HEADER.unpack(header)
+        if version != WRAPPED_KEY_VERSION:
+            raise ValueError(f'Unsupported wrapped key version {version}')
+        if key_id not in self.keys:
+            raise ValueError(f'Data key is wrapped by unknown master key {key_id.hex()}')
+        nonce = wrapped_key[WRAPPED_KEY_HEADER.size:WRAPPED_KEY_HEADER.size + NONCE_SIZE]
+        ciphertext = wrapped_key[WRAPPED_KEY_HEADER.size + NONCE_SIZE:]
+        try:
+            return self.keys[key_id].decrypt(nonce, ciphertext, header)
+        except InvalidTag:
+            raise ValueError('Data key failed to unwrap: master key mismatch or corrupt key')
+
+    def needs_rewrap(self, wrapped_key):
+        """Whether a stored key is legacy or wrapped by a retired master key"""
+        wrapped_key = bytes(wrapped_key)
+        if not is_wrapped(wrapped_key):
+            return True
+        _, _, key_id = WRAPPED_KEY_HEADER.unpack(wrapped_key[:WRAPPED_KEY_HEADER.size])
+        return key_id != self.active_id
+
+    def rewrap(self, wrapped_key):
+        """Re-wrap a stored data key under the active master key"""
+        return self.wrap(self.unwrap(wrapped_key))
+
+
+def is_wrapped(stored_key):
+    return bytes(stored_key[:len(WRAPPED_KEY_MAGIC)]) == WRAPPED_KEY_MAGIC
+
+
+class DataKeyCache:
+    """
+    Bounded, TTL-evicting cache of ready-to-use FileEncryptors keyed by the
+    stored (wrapped) key, so hot files skip the unwrap and key setup.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, stored_key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(stored_key)
+            if entry is None:
+                return None
+            encryptor, expires_at = entry
+            if expires_at <= now:
+                del self.entries[stored_key]
+                return None
+            self.entries.move_to_end(stored_key)
+            return encryptor
+
+    def put(self, stored_key, encryptor):
+        with self.lock:
+            self.entries[stored_key] = (encryptor, time.monotonic() + self.ttl)
+            self.entries.move_to_end(stored_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_key_ring = None
+_key_ring_lock = threading.Lock()
+_encryptor_cache = None
+
+
+def get_key_ring():
+    global _key_ring
+    if _key_ring is None:
+        with _key_ring_lock:
+            if _key_ring is None:
+                _key_ring = MasterKeyRing.from_settings()
+    return _key_ring
+
+
+def get_encryptor_cache():
+    global _encryptor_cache
+    if _encryptor_cache is None:
+        _encryptor_cache = DataKeyCache(settings.FILE_KEY_CACHE_SIZE, settings.FILE_KEY_CACHE_TTL)
+    return _encryptor_cache
+
+
+def reset_key_state():
+    """Forget the loaded master keys and cached data keys (e.g. after rotation)"""
+    global _key_ring, _encryptor_cache
+    with _key_ring_lock:
+        _key_ring = None
+        _encryptor_cache = None
+
+
+def content_hasher():
+    """
+    Return a fresh keyed hash (HMAC-SHA256) for addressing a plaintext blob.
+
+    The key is server-side, so stored digests reveal nothing about file
+    contents to anyone without it.
+    """
+    secret = settings.FILE_BLOB_ADDRESS_KEY or settings.SECRET_KEY
+    key = hashlib.sha256(b'geocrypt-blob-address:' + secret.encode('utf-8')).digest()
+    return hmac.new(key, digestmod=hashlib.sha256)
+
+
+def wrap_data_key(data_key):
+    """Wrap a raw data key under the active master key for storage"""
+    return get_key_ring().wrap(data_key)
+
+
+def get_file_encryptor(stored_key):
+    """Return a FileEncryptor for a File's stored (wrapped or legacy) key"""
+    stored_key = bytes(stored_key)
+    cache = get_encryptor_cache()
+    encryptor = cache.get(stored_key)
+    if encryptor is None:
+        encryptor = FileEncryptor(get_key_ring().unwrap(stored_key))
+        cache.put(stored_key, encryptor)
+    return encryptor
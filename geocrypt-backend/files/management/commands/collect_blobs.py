@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from files.blobstore import collect_garbage
+
+
+class Command(BaseCommand):
+    help = ('Delete encrypted blobs no file references any more, plus orphaned '
+            'ciphertext left behind by interrupted uploads.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-seconds', type=int, default=3600,
+                            help='Only remove orphaned files older than this')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be removed without deleting anything')
+
+    def handle(self, *args, **options):
+        stats = collect_garbage(grace_seconds=options['grace_seconds'], dry_run=options['dry_run'])
+        prefix = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {stats['blobs_deleted']} blobs and {stats['orphans_deleted']} orphaned files "
+            f"({stats['bytes_freed'] / (1024 * 1024):.1f} MB)"
+        ))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from files.keys import reset_key_state
+from files.reencryption import ReencryptionWorker, Throttle
+
+
+class Command(BaseCommand):
+    help = ('Re-wrap data keys or re-encrypt file payloads in resumable, throttled batches. '
+            'Re-running with the same --job name resumes from the last checkpoint.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', required=True, help='Checkpoint name used to resume this run')
+        parser.add_argument('--mode', choices=['rewrap', 'reencrypt'], default='reencrypt')
+        parser.add_argument('--legacy-only', action='store_true',
+                            help='Only re-encrypt files still in the legacy Fernet format')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-mbps', type=float, default=None,
+                            help='Cap payload throughput in MB/s')
+        parser.add_argument('--cpu-duty', type=float, default=1.0,
+                            help='Fraction of wall-clock time the job may be busy (0-1]')
+        parser.add_argument('--restart', action='store_true',
+                            help='Discard the existing checkpoint and start over')
+
+    def handle(self, *args, **options):
+        reset_key_state()
+        max_bytes = options['max_mbps'] * 1024 * 1024 if options['max_mbps'] else None
+        try:
+            worker = ReencryptionWorker.for_job(
+                options['job'],
+                options['mode'].upper(),
+                restart=options['restart'],
+                batch_size=options['batch_size'],
+                throttle=Throttle(max_bytes_per_second=max_bytes, cpu_duty_cycle=options['cpu_duty']),
+                legacy_only=options['legacy_only'],
+                stdout=self.stdout,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        try:
+            job = worker.run()
+        except KeyboardInterrupt:
+            worker.job.status = 'PAUSED'
+            worker.job.save()
+            self.stdout.write(self.style.WARNING(
+                f'Paused after file id {worker.job.last_file_id}; re-run to resume'
+            ))
+            return
+
+        if job.files_failed:
+            self.stdout.write(self.style.WARNING(
+                f'{job.files_failed} file(s) failed; last error: {job.last_error}'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Job {job.name} {job.status.lower()}'))
@@ -0,0 +1,22 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from files.keys import get_key_ring, reset_key_state
+
+
+class Command(BaseCommand):
+    help = ('Re-wrap every stored file data key under the active master key. '
+            'File payloads are not touched.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        reset_key_state()
+        call_command(
+            'reencrypt_files',
+            job=f'rewrap-{get_key_ring().active_id.hex()}',
+            mode='rewrap',
+            batch_size=options['batch_size'],
+            stdout=self.stdout,
+        )
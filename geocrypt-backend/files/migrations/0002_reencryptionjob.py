@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReencryptionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('mode', models.CharField(choices=[('REWRAP', 'Re-wrap data keys'), ('REENCRYPT', 'Re-encrypt payloads')], max_length=20)),
+                ('status', models.CharField(choices=[('RUNNING', 'Running'), ('PAUSED', 'Paused'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], default='RUNNING', max_length=20)),
+                ('last_file_id', models.BigIntegerField(default=0)),
+                ('files_processed', models.IntegerField(default=0)),
+                ('files_skipped', models.IntegerField(default=0)),
+                ('files_failed', models.IntegerField(default=0)),
+                ('bytes_processed', models.BigIntegerField(default=0)),
+                ('elapsed_seconds', models.FloatField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
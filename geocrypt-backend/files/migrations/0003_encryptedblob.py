@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0002_reencryptionjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EncryptedBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('file_path', models.FileField(upload_to='encrypted_files/')),
+                ('size', models.BigIntegerField()),
+                ('encryption_key', models.BinaryField()),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='files', to='files.encryptedblob'),
+        ),
+    ]
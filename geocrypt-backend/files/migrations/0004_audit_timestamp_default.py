@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0003_encryptedblob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fileaccesslog',
+            name='access_time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
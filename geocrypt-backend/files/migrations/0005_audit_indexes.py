@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0004_audit_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fileaccesslog',
+            index=models.Index(fields=['-access_time', '-id'], name='fileaccesslog_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fileaccesslog',
+            index=models.Index(fields=['user', '-access_time'], name='fileaccesslog_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fileaccesslog',
+            index=models.Index(fields=['file', '-access_time'], name='fileaccesslog_file_time_idx'),
+        ),
+    ]
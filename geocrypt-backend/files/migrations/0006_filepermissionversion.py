@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0005_audit_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilePermissionVersion',
+            fields=[
+                ('user_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
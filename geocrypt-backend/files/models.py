@@ -3,11 +3,25 @@
 # Create your models here.
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 import os
 from cryptography.fernet import Fernet
 import base64
 
 
+class EncryptedBlob(models.Model):
+    """Encrypted payload shared by every File with the same content"""
+    digest = models.CharField(max_length=64, unique=True)  # Keyed hash of the plaintext
+    file_path = models.FileField(upload_to='encrypted_files/')
+    size = models.BigIntegerField()
+    encryption_key = models.BinaryField()  # Wrapped data key
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.ref_count} refs)"
+
+
 class File(models.Model):
     name = models.CharField(max_length=255)
     original_name = models.CharField(max_length=255)
@@ -17,6 +31,11 @@ class File(models.Model):
     is_encrypted = models.BooleanField(default=True)
     encryption_key = models.BinaryField()  # Store encrypted key
     iv = models.BinaryField(null=True, blank=True)  # Initialization vector
+    blob = models.ForeignKey(EncryptedBlob,
+                             on_delete=models.PROTECT,
+                             null=True,
+                             blank=True,
+                             related_name='files')
     uploaded_by = models.ForeignKey(settings.AUTH_USER_MODEL, 
                                    on_delete=models.SET_NULL, 
                                    null=True, 
@@ -49,7 +68,7 @@ class FileAccessLog(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     file = models.ForeignKey(File, on_delete=models.CASCADE)
     access_type = models.CharField(max_length=20, choices=ACCESS_CHOICES)
-    access_time = models.DateTimeField(auto_now_add=True)
+    access_time = models.DateTimeField(default=timezone.now)
     ip_address = models.GenericIPAddressField()
     location = models.CharField(max_length=255, blank=True)
     wifi_ssid = models.CharField(max_length=100, blank=True)
@@ -62,6 +81,11 @@ class FileAccessLog(models.Model):
 
     class Meta:
         ordering = ['-access_time']
+        indexes = [
+            models.Index(fields=['-access_time', '-id'], name='fileaccesslog_time_idx'),
+            models.Index(fields=['user', '-access_time'], name='fileaccesslog_user_time_idx'),
+            models.Index(fields=['file', '-access_time'], name='fileaccesslog_file_time_idx'),
+        ]
 
 
 class FilePermission(models.Model):
@@ -85,6 +109,19 @@ class FilePermission(models.Model):
         unique_together = ['user', 'file']
 
 
+class FilePermissionVersion(models.Model):
+    """
+    Per-user generation of FilePermission rows, bumped in the same
+    transaction as every change to them.
+
+    Cached permission sets are keyed by it, so a change made in one worker
+    reaches the others without a shared cache. Not a foreign key: rows are
+    bumped while a user's permissions are being cascade-deleted.
+    """
+    user_id = models.BigIntegerField(primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+
 class RemoteAccessRequest(models.Model):
     STATUS_CHOICES = [
         ('PENDING', 'Pending'),
@@ -109,4 +146,41 @@ class RemoteAccessRequest(models.Model):
         return f"Remote access request from {self.user.email}"
 
     class Meta:
-        ordering = ['-requested_at']
\ No newline at end of file
+        ordering = ['-requested_at']
+
+class ReencryptionJob(models.Model):
+    """Progress checkpoint for a resumable key-rotation / re-encryption run"""
+    MODE_CHOICES = [
+        ('REWRAP', 'Re-wrap data keys'),
+        ('REENCRYPT', 'Re-encrypt payloads'),
+    ]
+
+    STATUS_CHOICES = [
+        ('RUNNING', 'Running'),
+        ('PAUSED', 'Paused'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100, unique=True)
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='RUNNING')
+    last_file_id = models.BigIntegerField(default=0)
+    files_processed = models.IntegerField(default=0)
+    files_skipped = models.IntegerField(default=0)
+    files_failed = models.IntegerField(default=0)
+    bytes_processed = models.BigIntegerField(default=0)
+    elapsed_seconds = models.FloatField(default=0)
+    last_error = models.TextField(blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.mode}, {self.status})"
+
+    @property
+    def throughput_mb_per_second(self):
+        if not self.elapsed_seconds:
+            return 0.0
+        return self.bytes_processed / (1024 * 1024) / self.elapsed_seconds
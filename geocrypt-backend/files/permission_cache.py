@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import FilePermission, FilePermissionVersion
+
+SET_KEY = 'files:permitted:{}:{}'
+
+
+def _version(user_id):
+    version = (FilePermissionVersion.objects.filter(user_id=user_id)
+               .values_list('version', flat=True).first())
+    return version or 0
+
+
+def permitted_file_ids(user):
+    """
+    Ids of the files a user may currently access, as a frozenset.
+
+    Only active, unexpired permissions count. The set is cached until the
+    nearest expires_at among them (at most FILE_PERMISSION_CACHE_TTL
+    seconds) under the user's FilePermissionVersion, so a hit costs one
+    primary key lookup and any change, made by any process, is seen at once.
+    """
+    if not user or not user.is_authenticated:
+        return frozenset()
+    version = _version(user.pk)
+    key = SET_KEY.format(user.pk, version)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    now = timezone.now()
+    rows = FilePermission.objects.filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=now),
+        user=user,
+        is_active=True,
+    ).values_list('file_id', 'expires_at')
+    file_ids = set()
+    ttl = getattr(settings, 'FILE_PERMISSION_CACHE_TTL', 300)
+    for file_id, expires_at in rows:
+        file_ids.add(file_id)
+        if expires_at is not None:
+            ttl = min(ttl, (expires_at - now).total_seconds())
+    file_ids = frozenset(file_ids)
+    # The version is read before the rows: a set built from rows read
+    # before a change lands under the old version and is never served again
+    if ttl >= 1:
+        cache.set(key, file_ids, int(ttl))
+    return file_ids
+
+
+def invalidate_permissions(user_id):
+    """
+    Drop the cached permission set of a user in every process. Call it in
+    the transaction that changes the permissions.
+    """
+    counter = FilePermissionVersion.objects.filter(user_id=user_id)
+    with transaction.atomic():
+        if not counter.update(version=F('version') + 1):
+            FilePermissionVersion.objects.get_or_create(user_id=user_id)
+            counter.update(version=F('version') + 1)
@@ -0,0 +1,242 @@
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .keys import get_file_encryptor, get_key_ring, wrap_data_key
+from .models import EncryptedBlob, File, ReencryptionJob
+from .upload_handlers import ENCRYPTED_FILES_DIR, encrypted_file_name
+from .utils import CONTAINER_MAGIC, FileEncryptor, choose_codec
+
+logger = logging.getLogger(__name__)
+
+# Partial output of in-flight re-encryptions, kept out of the encrypted files
+# directory so the orphan sweep of collect_garbage never sees it
+TEMP_FILES_DIR = f'{ENCRYPTED_FILES_DIR}/reencrypting'
+
+
+class Throttle:
+    """
+    Keep a background job from starving request traffic.
+
+    `max_bytes_per_second` caps I/O with a simple token bucket and
+    `cpu_duty_cycle` (0 < d <= 1) sleeps after each unit of work so the job
+    is busy for at most that fraction of wall-clock time.
+    """
+
+    def __init__(self, max_bytes_per_second=None, cpu_duty_cycle=1.0, sleep=time.sleep, clock=time.monotonic):
+        self.max_bytes_per_second = max_bytes_per_second
+        self.cpu_duty_cycle = min(max(cpu_duty_cycle, 0.01), 1.0)
+        self.sleep = sleep
+        self.clock = clock
+        self.allowance = 0.0
+        self.last_check = clock()
+
+    def consume(self, byte_count, busy_seconds):
+        pause = 0.0
+        if self.cpu_duty_cycle < 1.0:
+            pause = busy_seconds * (1 - self.cpu_duty_cycle) / self.cpu_duty_cycle
+
+        if self.max_bytes_per_second:
+            now = self.clock()
+            self.allowance = min(
+                self.allowance + (now - self.last_check) * self.max_bytes_per_second,
+                self.max_bytes_per_second
+            )
+            self.last_check = now
+            self.allowance -= byte_count
+            if self.allowance < 0:
+                pause = max(pause, -self.allowance / self.max_bytes_per_second)
+
+        if pause > 0:
+            self.sleep(pause)
+        return pause
+
+
+def is_legacy_blob(path):
+    with open(path, 'rb') as f:
+        return f.read(len(CONTAINER_MAGIC)) != CONTAINER_MAGIC
+
+
+class ReencryptionWorker:
+    """
+    Walk File rows in id order and re-wrap or re-encrypt each one.
+
+    Progress is checkpointed in a ReencryptionJob row after every batch, so
+    an interrupted run resumes from the last committed file id. Payload
+    re-encryption writes a temp file under TEMP_FILES_DIR, renames it into
+    place under a new name, switches the row over with a single UPDATE and
+    only then removes the old blob, so a crash never leaves a row pointing at a
+    partial or mismatched file. Files sharing a deduplicated blob are switched
+    over together the first time any of them is reached.
+    """
+
+    def __init__(self, job, batch_size=100, throttle=None, legacy_only=False, stdout=None):
+        self.job = job
+        self.batch_size = batch_size
+        self.throttle = throttle or Throttle()
+        self.legacy_only = legacy_only
+        self.stdout = stdout
+        self.stop_requested = threading.Event()
+        self.seen_blob_ids = set()
+        self.busy_since = time.monotonic()
+
+    @classmethod
+    def for_job(cls, name, mode, restart=False, **kwargs):
+        job, created = ReencryptionJob.objects.get_or_create(name=name, defaults={'mode': mode})
+        if job.mode != mode:
+            raise ValueError(f'Job "{name}" was started in {job.mode} mode')
+        if restart and not created:
+            ReencryptionJob.objects.filter(id=job.id).delete()
+            job = ReencryptionJob.objects.create(name=name, mode=mode)
+        return cls(job, **kwargs)
+
+    def run(self):
+        """Process files until done or stopped; returns the job row"""
+        job = self.job
+        job.status = 'RUNNING'
+        job.completed_at = None
+        job.save(update_fields=['status', 'completed_at', 'updated_at'])
+        key_ring = get_key_ring()
+
+        while True:
+            if self.stop_requested.is_set():
+                job.status = 'PAUSED'
+                break
+            batch = list(File.objects.filter(id__gt=job.last_file_id).order_by('id')[:self.batch_size])
+            if not batch:
+                job.status = 'COMPLETED'
+                job.completed_at = timezone.now()
+                break
+
+            batch_started = time.monotonic()
+            for file_obj in batch:
+                if self.stop_requested.is_set():
+                    break
+                self.busy_since = time.monotonic()
+                try:
+                    byte_count = self.process_file(file_obj, key_ring)
+                except Exception as e:
+                    logger.exception('Re-encryption of file %s failed', file_obj.id)
+                    job.files_failed += 1
+                    job.last_error = f'File {file_obj.id}: {e}'
+                    byte_count = 0
+                else:
+                    if byte_count is None:
+                        job.files_skipped += 1
+                        byte_count = 0
+                    else:
+                        job.files_processed += 1
+                        job.bytes_processed += byte_count
+                job.last_file_id = file_obj.id
+                # Payload bytes were throttled chunk by chunk; this covers
+                # the rest of the work on the file
+                self.throttle.consume(0, time.monotonic() - self.busy_since)
+
+            job.elapsed_seconds += time.monotonic() - batch_started
+            job.save()
+            self.report()
+
+        job.save()
+        self.report()
+        return job
+
+    def run_in_background(self):
+        """Run the job on a daemon thread; call `stop()` to pause it"""
+        def target():
+            try:
+                self.run()
+            except Exception as e:
+                logger.exception('Re-encryption job %s failed', self.job.name)
+                ReencryptionJob.objects.filter(id=self.job.id).update(status='FAILED', last_error=str(e))
+            finally:
+                close_old_connections()
+
+        thread = threading.Thread(target=target, name=f'reencrypt-{self.job.name}', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stop_requested.set()
+
+    def process_file(self, file_obj, key_ring):
+        """Handle one file; returns bytes processed, or None if skipped"""
+        if file_obj.blob_id:
+            if file_obj.blob_id in self.seen_blob_ids:
+                return None
+            self.seen_blob_ids.add(file_obj.blob_id)
+
+        if self.job.mode == 'REWRAP':
+            if not key_ring.needs_rewrap(file_obj.encryption_key):
+                return None
+            self.switch_over(file_obj, encryption_key=key_ring.rewrap(file_obj.encryption_key))
+            return 0
+
+        if not file_obj.is_encrypted:
+            return None
+        old_path = file_obj.file_path.path
+        if self.legacy_only and not is_legacy_blob(old_path):
+            return None
+        return self.reencrypt(file_obj, old_path)
+
+    def reencrypt(self, file_obj, old_path):
+        old_encryptor = get_file_encryptor(file_obj.encryption_key)
+        new_encryptor = FileEncryptor()
+        new_name = encrypted_file_name(file_obj.original_name)
+        new_path = os.path.join(settings.MEDIA_ROOT, new_name)
+        temp_path = os.path.join(settings.MEDIA_ROOT, TEMP_FILES_DIR, f'{os.path.basename(new_name)}.tmp')
+        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+
+        try:
+            with open(temp_path, 'xb') as destination:
+                writer = new_encryptor.writer(destination, choose_codec(file_obj.original_name, file_obj.mime_type))
+                for chunk in self.throttled(old_encryptor.iter_decrypted_file(old_path)):
+                    writer.write(chunk)
+                writer.close()
+                destination.flush()
+                os.fsync(destination.fileno())
+            os.replace(temp_path, new_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        try:
+            self.switch_over(file_obj, file_path=new_name, encryption_key=wrap_data_key(new_encryptor.key))
+        except Exception:
+            os.remove(new_path)
+            raise
+
+        os.remove(old_path)
+        return writer.size
+
+    def throttled(self, chunks):
+        """Yield chunks, charging each one to the throttle once it is written"""
+        for chunk in chunks:
+            yield chunk
+            self.throttle.consume(len(chunk), time.monotonic() - self.busy_since)
+            self.busy_since = time.monotonic()
+
+    def switch_over(self, file_obj, **fields):
+        """Point a file, or every file sharing its blob, at new key material"""
+        if not file_obj.blob_id:
+            File.objects.filter(id=file_obj.id).update(**fields)
+            return
+        with transaction.atomic():
+            EncryptedBlob.objects.filter(id=file_obj.blob_id).update(**fields)
+            File.objects.filter(blob_id=file_obj.blob_id).update(**fields)
+
+    def report(self):
+        if self.stdout is None:
+            return
+        job = self.job
+        self.stdout.write(
+            f'[{job.name}] {job.status}: {job.files_processed} processed, '
+            f'{job.files_skipped} skipped, {job.files_failed} failed, '
+            f'{job.bytes_processed / (1024 * 1024):.1f} MB at '
+            f'{job.throughput_mb_per_second:.1f} MB/s (last file id {job.last_file_id})'
+        )
@@ -1,8 +1,25 @@
 from rest_framework import serializers
 from .models import File, FileAccessLog, FilePermission, RemoteAccessRequest
+from .permission_cache import permitted_file_ids
 import os
 
 
+MAX_UPLOAD_SIZE = 100 * 1024 * 1024  # 100MB
+ALLOWED_EXTENSIONS = ['.pdf', '.doc', '.docx', '.txt', '.xlsx', '.xls', '.ppt', '.pptx']
+
+
+def validate_upload(name, size):
+    """Raise a ValidationError unless a file with this name and size may be uploaded"""
+    # Validate file size (max 100MB)
+    if size > MAX_UPLOAD_SIZE:
+        raise serializers.ValidationError(f'File size must be less than 100MB.')
+    
+    # Validate file extension
+    ext = os.path.splitext(name)[1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise serializers.ValidationError(f'File type not allowed. Allowed types: {ALLOWED_EXTENSIONS}')
+
+
 class FileSerializer(serializers.ModelSerializer):
     uploaded_by_name = serializers.CharField(source='uploaded_by.get_full_name', read_only=True)
     file_size_mb = serializers.SerializerMethodField()
@@ -20,9 +37,12 @@ class FileSerializer(serializers.ModelSerializer):
         return round(obj.file_size / (1024 * 1024), 2)
 
     def get_can_access(self, obj):
+        # List views annotate this for the files they return
+        if hasattr(obj, 'can_access'):
+            return obj.can_access
         request = self.context.get('request')
         if request and request.user:
-            return obj.filepermission_set.filter(user=request.user, is_active=True).exists()
+            return obj.id in permitted_file_ids(request.user)
         return False
 
 
@@ -32,17 +52,7 @@ class FileUploadSerializer(serializers.ModelSerializer):
         fields = ['name', 'file_path']
     
     def validate_file_path(self, value):
-        # Validate file size (max 100MB)
-        max_size = 100 * 1024 * 1024  # 100MB
-        if value.size > max_size:
-            raise serializers.ValidationError(f'File size must be less than 100MB.')
-        
-        # Validate file extension
-        allowed_extensions = ['.pdf', '.doc', '.docx', '.txt', '.xlsx', '.xls', '.ppt', '.pptx']
-        ext = os.path.splitext(value.name)[1].lower()
-        if ext not in allowed_extensions:
-            raise serializers.ValidationError(f'File type not allowed. Allowed types: {allowed_extensions}')
-        
+        validate_upload(value.name, value.size)
         return value
 
 
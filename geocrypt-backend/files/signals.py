@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .blobstore import release_blob
+from .models import File, FilePermission
+from .permission_cache import invalidate_permissions
+
+
+@receiver(post_delete, sender=File)
+def release_file_blob(sender, instance, **kwargs):
+    """Drop the deleted file's reference to its shared blob"""
+    if instance.blob_id:
+        release_blob(instance.blob_id)
+
+
+@receiver(post_save, sender=FilePermission)
+@receiver(post_delete, sender=FilePermission)
+def invalidate_file_permissions(sender, instance, **kwargs):
+    """Bump the user's permission version along with the change itself"""
+    invalidate_permissions(instance.user_id)
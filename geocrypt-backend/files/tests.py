@@ -1,3 +1,830 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
 
 # Create your tests here.
+import base64
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from geofencing.grants import mint_grant
+from geofencing.policy import reset_policy
+from .models import EncryptedBlob, File, FileAccessLog, FilePermission, ReencryptionJob, RemoteAccessRequest
+from .blobstore import collect_garbage
+from .keys import MasterKeyRing, get_file_encryptor, load_keyfile, reset_key_state, wrap_data_key
+from .permission_cache import permitted_file_ids
+from .reencryption import TEMP_FILES_DIR, ReencryptionWorker, Throttle
+from .upload_handlers import (ENCRYPTED_FILES_DIR, EncryptingUploadHandler, encrypt_to_blob,
+                              iter_archive_members)
+from .utils import (CONTAINER_MAGIC, FLAG_INDEXED, HEADER_SIZE, FileEncryptor, ZlibCodec,
+                    get_chunk_pool, parse_header, parse_range_header)
+
+
+class ListQueryCountTests(TestCase):
+    """List endpoints must cost the same number of queries however many rows they return"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pw',
+                                             employee_id='ADMIN', is_staff=True)
+        cls.users = [
+            User.objects.create_user(email=f'user{i}@example.com', password='pw',
+                                     employee_id=f'EMP{i}', first_name=f'User{i}')
+            for i in range(12)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def make_rows(self, count):
+        # Run the permission cache invalidation the signals defer to commit
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(count):
+                user = self.users[i % len(self.users)]
+                file_obj = File.objects.create(
+                    name=f'file{i}.pdf', original_name=f'file{i}.pdf', file_path=f'encrypted_files/{i}',
+                    file_size=1024, mime_type='application/pdf', encryption_key=b'key',
+                    uploaded_by=self.users[(i + 1) % len(self.users)]
+                )
+                FilePermission.objects.create(user=user, file=file_obj, permission_type='READ',
+                                              granted_by=self.admin)
+                FilePermission.objects.create(user=self.admin, file=file_obj, permission_type='READ',
+                                              granted_by=user)
+                FileAccessLog.objects.create(user=user, file=file_obj, access_type='DOWNLOAD',
+                                             ip_address='127.0.0.1', access_status='GRANTED')
+                RemoteAccessRequest.objects.create(user=user, reason='Travel', requested_from_ip='127.0.0.1',
+                                                   requested_location='Home', approved_by=self.admin)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, url):
+        self.make_rows(2)
+        few = self.count_queries(url)
+        self.make_rows(10)
+        self.assertEqual(self.count_queries(url), few)
+
+    def test_file_list(self):
+        self.assert_constant_queries(reverse('file-list'))
+
+    def test_file_list_can_access(self):
+        self.make_rows(3)
+        response = self.client.get(reverse('file-list'))
+        self.assertEqual(len(response.data), 3)
+        self.assertTrue(all(row['can_access'] for row in response.data))
+
+    def test_access_logs(self):
+        self.assert_constant_queries(reverse('access-logs'))
+
+    def test_permissions(self):
+        self.assert_constant_queries(reverse('file-permissions'))
+
+    def test_remote_requests(self):
+        self.assert_constant_queries(reverse('remote-requests'))
+
+
+class PermissionCacheTests(TestCase):
+    """The cached permission set must follow grants, revocations and expiry"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pw',
+                                             employee_id='ADMIN', is_staff=True)
+        cls.user = User.objects.create_user(email='user@example.com', password='pw',
+                                            employee_id='EMP1')
+        cls.files = [
+            File.objects.create(
+                name=f'file{i}.pdf', original_name=f'file{i}.pdf', file_path=f'encrypted_files/{i}',
+                file_size=1024, mime_type='application/pdf', encryption_key=b'key',
+                uploaded_by=cls.admin
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def grant(self, file_obj, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return FilePermission.objects.create(user=self.user, file=file_obj, permission_type='READ',
+                                                 granted_by=self.admin, **fields)
+
+    def test_expired_and_inactive_permissions_are_ignored(self):
+        now = timezone.now()
+        self.grant(self.files[0])
+        self.grant(self.files[1], expires_at=now - timedelta(minutes=1))
+        self.grant(self.files[2], is_active=False)
+        self.assertEqual(permitted_file_ids(self.user), {self.files[0].id})
+
+    def test_grant_and_revoke_invalidate(self):
+        self.assertEqual(permitted_file_ids(self.user), set())
+        permission = self.grant(self.files[0])
+        self.assertEqual(permitted_file_ids(self.user), {self.files[0].id})
+        permission.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            permission.save()
+        self.assertEqual(permitted_file_ids(self.user), set())
+        self.grant(self.files[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            permission.delete()
+        self.assertEqual(permitted_file_ids(self.user), {self.files[1].id})
+
+    def test_cached_until_nearest_expiry(self):
+        self.grant(self.files[0])
+        self.grant(self.files[1], expires_at=timezone.now() + timedelta(seconds=30))
+        with mock.patch('files.permission_cache.cache.set', wraps=cache.set) as cache_set:
+            permitted_file_ids(self.user)
+        self.assertLessEqual(cache_set.call_args[0][2], 30)
+        # A hit only reads the user's permission version
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(permitted_file_ids(self.user), {self.files[0].id, self.files[1].id})
+        self.assertEqual(len(queries), 1)
+
+    def test_change_reaches_other_workers(self):
+        # Another worker, with a process-local cache this one cannot clear
+        other_worker = LocMemCache('other-worker', {})
+        with mock.patch('files.permission_cache.cache', other_worker):
+            self.assertEqual(permitted_file_ids(self.user), set())
+        self.grant(self.files[0])
+        with mock.patch('files.permission_cache.cache', other_worker):
+            self.assertEqual(permitted_file_ids(self.user), {self.files[0].id})
+        FilePermission.objects.filter(user=self.user).delete()
+        with mock.patch('files.permission_cache.cache', other_worker):
+            self.assertEqual(permitted_file_ids(self.user), set())
+
+    def test_download_denied_without_permission(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse('file-download', args=[self.files[0].id]))
+        self.assertEqual(response.status_code, 403)
+
+
+class ChunkedContainerTests(SimpleTestCase):
+    """The chunked container must round-trip and reject tampered records"""
+
+    def encrypt(self, data, encryptor=None, codec=None):
+        encryptor = encryptor or FileEncryptor(chunk_size=16, workers=1)
+        encrypted = io.BytesIO()
+        encryptor.encrypt_stream(io.BytesIO(data), encrypted, codec)
+        return encryptor, encrypted.getvalue()
+
+    def decrypt(self, encryptor, encrypted):
+        return b''.join(encryptor.decrypt_stream(io.BytesIO(encrypted)))
+
+    def test_round_trip(self):
+        for data in (b'', b'x' * 16, os.urandom(100)):
+            encryptor, encrypted = self.encrypt(data)
+            self.assertEqual(self.decrypt(encryptor, encrypted), data)
+
+    def test_parallel_sealing_round_trips(self):
+        data = os.urandom(1000)
+        encryptor, encrypted = self.encrypt(data, FileEncryptor(chunk_size=16, workers=4))
+        self.assertEqual(self.decrypt(FileEncryptor(encryptor.key, workers=1), encrypted), data)
+
+    def test_shared_pool(self):
+        data = os.urandom(1000)
+        pool = get_chunk_pool()
+        with mock.patch.object(pool, 'submit', wraps=pool.submit) as submit:
+            encryptor, encrypted = self.encrypt(data, FileEncryptor(chunk_size=16, workers=4))
+            self.assertGreater(submit.call_count, 0)
+            decrypting = FileEncryptor(encryptor.key, workers=4).decrypt_stream(io.BytesIO(encrypted))
+            self.assertEqual(next(decrypting), data[:16])
+            # An abandoned download cancels its own records, not the pool
+            decrypting.close()
+            self.assertEqual(self.decrypt(FileEncryptor(encryptor.key, workers=4), encrypted), data)
+
+            # A file of one chunk is sealed and opened inline
+            submit.reset_mock()
+            encryptor, encrypted = self.encrypt(b'short', FileEncryptor(chunk_size=16, workers=4))
+            self.assertEqual(self.decrypt(encryptor, encrypted), b'short')
+            submit.assert_not_called()
+        self.assertIs(get_chunk_pool(), pool)
+
+    def test_wrong_key_fails(self):
+        _, encrypted = self.encrypt(b'secret')
+        with self.assertRaises(ValueError):
+            self.decrypt(FileEncryptor(workers=1), encrypted)
+
+    def test_reordered_records_fail(self):
+        encryptor, encrypted = self.encrypt(os.urandom(48))
+        record_size = (len(encrypted) - HEADER_SIZE) // 3
+        first = encrypted[HEADER_SIZE:HEADER_SIZE + record_size]
+        second = encrypted[HEADER_SIZE + record_size:HEADER_SIZE + 2 * record_size]
+        swapped = encrypted[:HEADER_SIZE] + second + first + encrypted[HEADER_SIZE + 2 * record_size:]
+        with self.assertRaises(ValueError):
+            self.decrypt(encryptor, swapped)
+
+    def test_truncated_file_fails(self):
+        encryptor, encrypted = self.encrypt(os.urandom(48))
+        record_size = (len(encrypted) - HEADER_SIZE) // 3
+        for truncated in (encrypted[:-record_size], encrypted[:-1], encrypted[:HEADER_SIZE]):
+            with self.assertRaises(ValueError):
+                self.decrypt(encryptor, truncated)
+
+    def test_legacy_fernet_file(self):
+        encryptor = FileEncryptor(workers=1)
+        token = encryptor.encrypt_data(b'legacy contents')
+        self.assertEqual(self.decrypt(encryptor, token), b'legacy contents')
+
+
+class RangeDecryptionTests(SimpleTestCase):
+    """Byte ranges of a chunked file decrypt to exactly the requested slice"""
+
+    def setUp(self):
+        self.data = os.urandom(1000) + b'a' * 1000
+        self.encryptor = FileEncryptor(chunk_size=64, workers=1)
+
+    def write_file(self, codec=None):
+        handle, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'wb') as destination:
+            self.encryptor.encrypt_stream(io.BytesIO(self.data), destination, codec)
+        return path
+
+    def test_ranges(self):
+        for codec in (None, ZlibCodec()):
+            path = self.write_file(codec)
+            self.assertTrue(self.encryptor.supports_ranges(path))
+            for start, end in ((0, 0), (0, 63), (63, 64), (100, 1500), (1999, 1999), (0, 1999)):
+                decrypted = b''.join(self.encryptor.iter_decrypted_range(path, start, end))
+                self.assertEqual(decrypted, self.data[start:end + 1], (codec, start, end))
+
+    def test_legacy_file_has_no_ranges(self):
+        handle, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'wb') as destination:
+            destination.write(self.encryptor.encrypt_data(self.data))
+        self.assertFalse(self.encryptor.supports_ranges(path))
+
+    def test_parse_range_header(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range_header('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=0-5000', 1000), (0, 999))
+        self.assertIsNone(parse_range_header('bytes=5-1', 1000))
+        self.assertIsNone(parse_range_header('items=0-1', 1000))
+        self.assertIsNone(parse_range_header('bytes=0-1,5-6', 1000))
+        with self.assertRaises(ValueError):
+            parse_range_header('bytes=1000-', 1000)
+        with self.assertRaises(ValueError):
+            parse_range_header('bytes=-0', 1000)
+
+
+ARCHIVE_CONTENTS = {f'doc{i}.txt': os.urandom(200) * (i + 1) for i in range(5)}
+
+
+def make_tar(mode, contents=ARCHIVE_CONTENTS):
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode=mode) as tar:
+        for name, data in contents.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return archive
+
+
+def make_zip(contents=ARCHIVE_CONTENTS):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in contents.items():
+            zip_file.writestr(name, data)
+        zip_file.writestr('__MACOSX/._doc0.txt', b'metadata')
+    return archive
+
+
+class ArchiveMemberTests(SimpleTestCase):
+    """Batch-uploaded archives are read safely and within their limits"""
+
+    contents = ARCHIVE_CONTENTS
+
+    def read_concurrently(self, archive):
+        members = list(iter_archive_members(archive))
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            data = pool.map(lambda member: b''.join(member.chunks(64)), members)
+        return {member.name: content for member, content in zip(members, data)}
+
+    def test_members_read_concurrently(self):
+        for archive in (make_zip(), make_tar('w'), make_tar('w:gz'),
+                        make_tar('w:bz2'), make_tar('w:xz')):
+            self.assertEqual(self.read_concurrently(archive), self.contents)
+
+    @override_settings(FILE_ARCHIVE_MAX_MEMBERS=4)
+    def test_member_count_limit(self):
+        for archive in (make_zip(), make_tar('w:gz')):
+            with self.assertRaisesMessage(ValueError, 'more than 4 files'):
+                list(iter_archive_members(archive))
+
+    @override_settings(FILE_ARCHIVE_MAX_SIZE=64 * 1024)
+    def test_decompressed_size_limit(self):
+        # Compresses to a few hundred bytes
+        contents = {'zeros.txt': bytes(1024 * 1024)}
+        for archive in (make_zip(contents), make_tar('w:gz', contents),
+                        make_tar('w', contents)):
+            with self.assertRaisesMessage(ValueError, 'too large'):
+                list(iter_archive_members(archive))
+
+    def test_corrupt_archive(self):
+        archive = make_tar('w:gz')
+        corrupt = io.BytesIO(archive.getvalue()[:40])
+        with self.assertRaises(ValueError):
+            list(iter_archive_members(corrupt))
+        with self.assertRaises(ValueError):
+            list(iter_archive_members(io.BytesIO(b'not an archive')))
+
+
+class EncryptedStorageMixin:
+    """A temporary MEDIA_ROOT and master key, and an authenticated admin"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        master_key = base64.urlsafe_b64encode(os.urandom(32)).decode()
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, FILE_MASTER_KEY=master_key,
+                                              AUDIT_LOG_ASYNC=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_key_state()
+        self.addCleanup(reset_key_state)
+
+        self.admin = User.objects.create_user(email='admin@example.com', password='pw',
+                                              employee_id='ADMIN', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def stored_files(self):
+        directory = os.path.join(self.media_root, ENCRYPTED_FILES_DIR)
+        return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+    def decrypt(self, file_obj):
+        encryptor = get_file_encryptor(file_obj.encryption_key)
+        return b''.join(encryptor.iter_decrypted_file(file_obj.file_path.path))
+
+
+class UploadTests(EncryptedStorageMixin, TestCase):
+    """Uploads are encrypted as the request body streams in"""
+
+    def upload(self, name, data):
+        return self.client.post(reverse('file-upload'), {
+            'name': name, 'file_path': SimpleUploadedFile(name, data, content_type='text/plain'),
+        }, format='multipart')
+
+    def test_upload_round_trip(self):
+        data = b''.join(os.urandom(16) * 4 for _ in range(20000))
+        with mock.patch('files.views.encrypt_uploaded_file') as fallback:
+            response = self.upload('report.txt', data)
+        self.assertEqual(response.status_code, 201, response.data)
+        fallback.assert_not_called()
+
+        file_obj = File.objects.get(id=response.data['id'])
+        self.assertEqual(file_obj.file_size, len(data))
+        with open(file_obj.file_path.path, 'rb') as f:
+            ciphertext = f.read()
+        self.assertTrue(ciphertext.startswith(CONTAINER_MAGIC))
+        self.assertNotIn(data[:64], ciphertext)
+        self.assertEqual(self.decrypt(file_obj), data)
+        self.assertEqual(self.stored_files(), [os.path.basename(file_obj.file_path.name)])
+
+    def test_rejected_upload_leaves_nothing_behind(self):
+        with mock.patch('files.serializers.MAX_UPLOAD_SIZE', 1000):
+            response = self.upload('big.txt', os.urandom(2000))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file_path', response.data)
+        response = self.upload('script.exe', b'MZ')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_upload_interrupted(self):
+        handler = EncryptingUploadHandler()
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file('file_path', 'report.txt', 'text/plain', None)
+        handler.receive_data_chunk(os.urandom(1000), 0)
+        self.assertEqual(len(self.stored_files()), 1)
+        handler.upload_interrupted()
+        self.assertEqual(self.stored_files(), [])
+
+
+class BatchUploadTests(EncryptedStorageMixin, TestCase):
+    """Every archive member becomes its own encrypted file"""
+
+    contents = ARCHIVE_CONTENTS
+
+    def upload_archive(self, archive, name='docs.tar.gz'):
+        archive.seek(0)
+        return self.client.post(reverse('file-batch-upload'), {
+            'archive': SimpleUploadedFile(name, archive.read(), content_type='application/octet-stream'),
+        }, format='multipart')
+
+    def test_archive_members_are_stored(self):
+        for archive, name in ((make_tar('w:gz'), 'docs.tar.gz'),
+                              (make_zip(), 'docs.zip')):
+            File.objects.all().delete()
+            response = self.upload_archive(archive, name)
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(response.data['created'], len(self.contents))
+            files = {file_obj.original_name: file_obj for file_obj in File.objects.all()}
+            self.assertEqual(set(files), set(self.contents))
+            for member_name, data in self.contents.items():
+                self.assertEqual(self.decrypt(files[member_name]), data)
+
+    def test_files_and_rejected_members(self):
+        contents = {'notes.txt': b'notes', 'tool.exe': b'MZ'}
+        response = self.client.post(reverse('file-batch-upload'), {
+            'files': [SimpleUploadedFile('plain.txt', b'plain text', content_type='text/plain')],
+            'archive': SimpleUploadedFile('mixed.zip', make_zip(contents).getvalue()),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 207, response.data)
+        statuses = {result['file']: result['status'] for result in response.data['results']}
+        self.assertEqual(statuses, {'plain.txt': 'created', 'notes.txt': 'created', 'tool.exe': 'rejected'})
+        self.assertEqual(self.decrypt(File.objects.get(original_name='plain.txt')), b'plain text')
+
+    def test_corrupt_archive(self):
+        archive = make_tar('w:gz')
+        response = self.upload_archive(io.BytesIO(archive.getvalue()[:40]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['results'][0]['status'], 'rejected')
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    @override_settings(FILE_ARCHIVE_MAX_MEMBERS=4)
+    def test_archive_over_limit(self):
+        response = self.upload_archive(make_tar('w:gz'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('more than 4 files', response.data['results'][0]['errors'][0])
+        self.assertFalse(File.objects.exists())
+
+
+class BlobDeduplicationTests(EncryptedStorageMixin, TestCase):
+    """Identical uploads share one blob, which is removed with its last file"""
+
+    def upload(self, name, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('file-upload'), {
+                'name': name, 'file_path': SimpleUploadedFile(name, data, content_type='text/plain'),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        return File.objects.get(id=response.data['id'])
+
+    def test_identical_uploads_share_a_blob(self):
+        data = os.urandom(5000)
+        first = self.upload('first.txt', data)
+        second = self.upload('second.txt', data)
+        other = self.upload('other.txt', os.urandom(5000))
+
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertNotEqual(first.blob_id, other.blob_id)
+        self.assertEqual(second.file_path.name, first.file_path.name)
+        self.assertEqual(EncryptedBlob.objects.get(id=first.blob_id).ref_count, 2)
+        # The second upload's own ciphertext was dropped
+        self.assertEqual(len(self.stored_files()), 2)
+        self.assertEqual(self.decrypt(second), data)
+
+    def test_blob_removed_after_last_reference(self):
+        data = os.urandom(5000)
+        first = self.upload('first.txt', data)
+        second = self.upload('second.txt', data)
+        blob = EncryptedBlob.objects.get(id=first.blob_id)
+        path = blob.file_path.path
+
+        first.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertEqual(collect_garbage(grace_seconds=0)['blobs_deleted'], 0)
+        self.assertEqual(self.decrypt(second), data)
+
+        second.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 0)
+        self.assertEqual(collect_garbage(grace_seconds=0)['blobs_deleted'], 1)
+        self.assertFalse(EncryptedBlob.objects.filter(id=blob.id).exists())
+        self.assertFalse(os.path.exists(path))
+
+
+class MasterKeyTests(SimpleTestCase):
+    """Data keys are wrapped by the master key and survive its rotation"""
+
+    def setUp(self):
+        self.old_key, self.new_key = os.urandom(32), os.urandom(32)
+        self.data_key = FileEncryptor().key
+
+    def test_wrap_round_trip(self):
+        ring = MasterKeyRing(self.old_key)
+        wrapped = ring.wrap(self.data_key)
+        self.assertNotIn(self.data_key, wrapped)
+        self.assertEqual(ring.unwrap(wrapped), self.data_key)
+        self.assertFalse(ring.needs_rewrap(wrapped))
+
+    def test_rotation(self):
+        wrapped = MasterKeyRing(self.old_key).wrap(self.data_key)
+        ring = MasterKeyRing(self.new_key, retired_keys=[self.old_key])
+        self.assertEqual(ring.unwrap(wrapped), self.data_key)
+        self.assertTrue(ring.needs_rewrap(wrapped))
+        rewrapped = ring.rewrap(wrapped)
+        self.assertFalse(ring.needs_rewrap(rewrapped))
+        self.assertEqual(MasterKeyRing(self.new_key).unwrap(rewrapped), self.data_key)
+
+    def test_unknown_or_tampered_master_key(self):
+        wrapped = MasterKeyRing(self.old_key).wrap(self.data_key)
+        with self.assertRaisesMessage(ValueError, 'unknown master key'):
+            MasterKeyRing(self.new_key).unwrap(wrapped)
+        tampered = wrapped[:-1] + bytes([wrapped[-1] ^ 1])
+        with self.assertRaisesMessage(ValueError, 'failed to unwrap'):
+            MasterKeyRing(self.old_key).unwrap(tampered)
+
+    def test_legacy_raw_key(self):
+        ring = MasterKeyRing(self.old_key)
+        self.assertEqual(ring.unwrap(self.data_key), self.data_key)
+        self.assertTrue(ring.needs_rewrap(self.data_key))
+
+    def test_settings_key(self):
+        master_key = base64.urlsafe_b64encode(self.old_key).decode()
+        with override_settings(FILE_MASTER_KEY=master_key):
+            reset_key_state()
+            self.addCleanup(reset_key_state)
+            wrapped = wrap_data_key(self.data_key)
+            self.assertEqual(get_file_encryptor(wrapped).key, self.data_key)
+
+    def test_keyfile_is_only_generated_in_debug(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'keys', 'master.key')
+        with override_settings(DEBUG=False):
+            with self.assertRaises(ImproperlyConfigured):
+                load_keyfile(path)
+            self.assertFalse(os.path.exists(path))
+        with override_settings(DEBUG=True):
+            key = load_keyfile(path)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        with override_settings(DEBUG=False):
+            self.assertEqual(load_keyfile(path), key)
+
+
+class DownloadReencryptionTests(TestCase):
+    """A download racing a re-encryption switch-over must not lose the new key"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        master_key = base64.urlsafe_b64encode(os.urandom(32)).decode()
+        settings_override = override_settings(MEDIA_ROOT=media_root, FILE_MASTER_KEY=master_key,
+                                              AUDIT_LOG_ASYNC=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_key_state()
+        self.addCleanup(reset_key_state)
+        cache.clear()
+
+        self.data = os.urandom(300000)
+        self.user = User.objects.create_user(email='user@example.com', password='pw', employee_id='EMP1')
+        uploaded = encrypt_to_blob([self.data], 'report.txt', 'text/plain', len(self.data))
+        self.file = File.objects.create(
+            name='report.txt', original_name='report.txt', file_path=uploaded.encrypted_name,
+            file_size=len(self.data), mime_type='text/plain', encryption_key=wrap_data_key(uploaded.key),
+            uploaded_by=self.user
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            FilePermission.objects.create(user=self.user, file=self.file, permission_type='READ')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def reencrypt_then_allow(self, *args, **kwargs):
+        # Runs while the download view holds its stale copy of the row
+        job = ReencryptionJob.objects.create(name='rotate', mode='REENCRYPT')
+        file_obj = File.objects.get(id=self.file.id)
+        ReencryptionWorker(job).reencrypt(file_obj, file_obj.file_path.path)
+        return {'overall_access': True, 'reasons': [], 'checks': {}}
+
+    def test_download_across_switch_over(self):
+        old_path = self.file.file_path.name
+        with mock.patch('files.views.validate_access_conditions', side_effect=self.reencrypt_then_allow):
+            response = self.client.get(reverse('file-download', args=[self.file.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+
+        file_obj = File.objects.get(id=self.file.id)
+        self.assertNotEqual(file_obj.file_path.name, old_path)
+        self.assertEqual(file_obj.access_count, 1)
+        self.assertIsNotNone(file_obj.last_accessed)
+        encryptor = get_file_encryptor(file_obj.encryption_key)
+        self.assertEqual(b''.join(encryptor.iter_decrypted_file(file_obj.file_path.path)), self.data)
+
+
+class DownloadGrantTests(EncryptedStorageMixin, TestCase):
+    """A signed access grant stands in for the access checks, from the header only"""
+
+    def setUp(self):
+        super().setUp()
+        reset_policy()
+        self.addCleanup(reset_policy)
+        cache.clear()
+        self.data = os.urandom(1000)
+        self.user = User.objects.create_user(email='user@example.com', password='pw', employee_id='EMP1')
+        uploaded = encrypt_to_blob([self.data], 'report.txt', 'text/plain', len(self.data))
+        self.file = File.objects.create(
+            name='report.txt', original_name='report.txt', file_path=uploaded.encrypted_name,
+            file_size=len(self.data), mime_type='text/plain', encryption_key=wrap_data_key(uploaded.key),
+            uploaded_by=self.admin
+        )
+        FilePermission.objects.create(user=self.user, file=self.file, permission_type='READ')
+        self.client.force_authenticate(self.user)
+        self.url = reverse('file-download', args=[self.file.id])
+        result = {'overall_access': True, 'checks': {'location': {'allowed': True}}}
+        self.grant, _ = mint_grant(self.user, result, '127.0.0.1')
+
+    def test_grant_header(self):
+        # No coordinates, so without a grant the location check fails
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        response = self.client.get(self.url, headers={'X-Access-Grant': self.grant})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+
+    def test_grant_query_parameter_is_ignored(self):
+        response = self.client.get(self.url, {'grant': self.grant})
+        self.assertEqual(response.status_code, 403)
+
+
+class ReencryptionThrottleTests(TestCase):
+    """Re-encryption must be rate limited while a file streams, not after it"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        master_key = base64.urlsafe_b64encode(os.urandom(32)).decode()
+        settings_override = override_settings(MEDIA_ROOT=media_root, FILE_MASTER_KEY=master_key)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_key_state()
+        self.addCleanup(reset_key_state)
+
+    def test_throttled_per_chunk(self):
+        data = os.urandom(300000)
+        uploaded = encrypt_to_blob([data], 'big.bin', 'application/octet-stream', len(data))
+        file_obj = File.objects.create(
+            name='big.bin', original_name='big.bin', file_path=uploaded.encrypted_name,
+            file_size=len(data), mime_type='application/octet-stream', encryption_key=wrap_data_key(uploaded.key)
+        )
+        # A clock that only moves while the throttle sleeps
+        now = [0.0]
+        pauses = []
+
+        def sleep(seconds):
+            pauses.append(seconds)
+            now[0] += seconds
+
+        throttle = Throttle(max_bytes_per_second=100000, sleep=sleep, clock=lambda: now[0])
+        job = ReencryptionJob.objects.create(name='rotate', mode='REENCRYPT')
+        worker = ReencryptionWorker(job, throttle=throttle)
+        with mock.patch.object(throttle, 'consume', wraps=throttle.consume) as consume:
+            worker.run()
+
+        charged = [call.args[0] for call in consume.call_args_list]
+        self.assertEqual(charged[:-1], [64 * 1024] * 4 + [len(data) - 4 * 64 * 1024])
+        self.assertEqual(charged[-1], 0)
+        self.assertAlmostEqual(sum(pauses), len(data) / 100000)
+        file_obj.refresh_from_db()
+        encryptor = get_file_encryptor(file_obj.encryption_key)
+        self.assertEqual(b''.join(encryptor.iter_decrypted_file(file_obj.file_path.path)), data)
+
+
+@override_settings(FILE_MASTER_KEY=base64.urlsafe_b64encode(bytes(32)).decode())
+class GarbageCollectionTests(TestCase):
+    """The orphan sweep must leave in-flight re-encryption output alone"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_key_state()
+        self.addCleanup(reset_key_state)
+
+    def make_stale(self, directory, name):
+        path = os.path.join(self.media_root, directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'ciphertext')
+        os.utime(path, (0, 0))
+        return path
+
+    def test_orphans_are_swept(self):
+        orphan = self.make_stale(ENCRYPTED_FILES_DIR, 'encrypted_orphan.enc')
+        data = os.urandom(1000)
+        uploaded = encrypt_to_blob([data], 'kept.txt', 'text/plain', len(data))
+        File.objects.create(name='kept.txt', original_name='kept.txt', file_path=uploaded.encrypted_name,
+                            file_size=len(data), mime_type='text/plain',
+                            encryption_key=wrap_data_key(uploaded.key))
+        os.utime(uploaded.encrypted_path, (0, 0))
+        stats = collect_garbage(grace_seconds=60)
+        self.assertEqual(stats['orphans_deleted'], 1)
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(uploaded.encrypted_path))
+
+    def test_running_reencryption_output_is_kept(self):
+        job = ReencryptionJob.objects.create(name='rotate', mode='REENCRYPT', status='RUNNING')
+        partial = self.make_stale(TEMP_FILES_DIR, 'encrypted_new.enc.tmp')
+        collect_garbage(grace_seconds=60)
+        self.assertTrue(os.path.exists(partial))
+        # Left behind by a crashed run once nothing is running any more
+        ReencryptionJob.objects.filter(id=job.id).update(status='PAUSED')
+        collect_garbage(grace_seconds=60)
+        self.assertFalse(os.path.exists(partial))
+
+
+class SeekCountingFile:
+    """Wrap a file to count the seeks made through it"""
+
+    def __init__(self, f):
+        self.f = f
+        self.seeks = 0
+
+    def seek(self, *args):
+        self.seeks += 1
+        return self.f.seek(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+class RecordIndexTests(SimpleTestCase):
+    """Compressed containers locate records through their index"""
+
+    def setUp(self):
+        # Compressible but not trivially so, so records differ in size
+        self.data = b''.join(os.urandom(8) * (i % 7 + 1) for i in range(3000))
+        self.encryptor = FileEncryptor(chunk_size=256, workers=1)
+
+    def write_file(self):
+        handle, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'wb') as destination:
+            writer = self.encryptor.writer(destination, ZlibCodec())
+            writer.write(self.data)
+            writer.close()
+        return path
+
+    def read_range(self, path, start, end):
+        return b''.join(self.encryptor.iter_decrypted_range(path, start, end))
+
+    def test_range_costs_constant_seeks(self):
+        path = self.write_file()
+        with open(path, 'rb') as f:
+            _, flags, chunk_size = parse_header(f.read(HEADER_SIZE))
+            self.assertTrue(flags & FLAG_INDEXED)
+            src = SeekCountingFile(f)
+            last = (len(self.data) - 1) // chunk_size
+            record_count, offsets = self.encryptor._record_offsets(src, flags, ZlibCodec(), chunk_size,
+                                                                   last - 1, last)
+        self.assertEqual(record_count, last + 1)
+        self.assertEqual(len(offsets), 2)
+        self.assertLessEqual(src.seeks, 2)
+        for start, end in ((0, 10), (len(self.data) - 300, len(self.data) - 1), (1000, 5000)):
+            self.assertEqual(self.read_range(path, start, end), self.data[start:end + 1])
+        with open(path, 'rb') as f:
+            self.assertEqual(b''.join(self.encryptor.decrypt_stream(f)), self.data)
+
+    def test_compressed_without_index_is_rejected(self):
+        path = self.write_file()
+        with open(path, 'r+b') as f:
+            _, flags, _ = parse_header(f.read(HEADER_SIZE))
+            f.seek(HEADER_SIZE - 5)
+            f.write(bytes([flags & ~FLAG_INDEXED]))
+        with self.assertRaises(ValueError), open(path, 'rb') as f:
+            b''.join(self.encryptor.decrypt_stream(f))
+        with self.assertRaises(ValueError):
+            self.read_range(path, 1000, 5000)
+
+    def test_truncated_or_corrupt_index(self):
+        path = self.write_file()
+        with open(path, 'rb') as f:
+            encrypted = f.read()
+        with open(path, 'wb') as f:
+            f.write(encrypted[:-3])
+        with self.assertRaises(ValueError):
+            self.read_range(path, 0, 10)
+        with open(path, 'wb') as f:
+            f.write(encrypted[:len(encrypted) // 2])
+        with self.assertRaises(ValueError), open(path, 'rb') as f:
+            b''.join(self.encryptor.decrypt_stream(f))
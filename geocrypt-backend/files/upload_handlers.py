@@ -0,0 +1,299 @@
+import bz2
+import gzip
+import lzma
+import mimetypes
+import os
+import tarfile
+import tempfile
+import threading
+import uuid
+import zipfile
+import zlib
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.utils.text import get_valid_filename
+
+from .keys import content_hasher
+from .utils import DEFAULT_CHUNK_SIZE, FileEncryptor, choose_codec
+
+
+ENCRYPTED_FILES_DIR = 'encrypted_files'
+
+
+def encrypted_file_name(original_name):
+    """Storage name (relative to MEDIA_ROOT) for a newly encrypted upload"""
+    return f'{ENCRYPTED_FILES_DIR}/encrypted_{uuid.uuid4().hex}_{get_valid_filename(original_name)}.enc'
+
+
+def open_encrypted_destination(encrypted_name):
+    """Open the final on-disk location of an encrypted upload for writing"""
+    path = os.path.join(settings.MEDIA_ROOT, encrypted_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, 'xb')
+
+
+class EncryptedUploadedFile(UploadedFile):
+    """
+    An upload whose content was encrypted to its final location while the
+    request body was parsed. Only metadata is kept; there is no plaintext to
+    read back.
+    """
+
+    def __init__(self, encrypted_name, key, digest, name, content_type, size,
+                 charset=None, content_type_extra=None):
+        super().__init__(None, name, content_type, size, charset, content_type_extra)
+        self.encrypted_name = encrypted_name
+        self.key = key
+        self.digest = digest
+
+    @property
+    def encrypted_path(self):
+        return os.path.join(settings.MEDIA_ROOT, self.encrypted_name)
+
+    def discard(self):
+        """Remove the encrypted blob of an upload that was rejected"""
+        if os.path.exists(self.encrypted_path):
+            os.remove(self.encrypted_path)
+
+
+class EncryptingUploadHandler(FileUploadHandler):
+    """
+    Encrypt uploaded files chunk by chunk as they come off the wire.
+
+    Each chunk goes through a chunked-container writer straight into the
+    final encrypted path, so the upload is a single pass over the data and
+    plaintext is never written to disk. The same pass compresses chunks of
+    compressible formats and computes the keyed content hash used to
+    deduplicate blobs.
+    """
+
+    def __init__(self, request=None, passthrough_fields=()):
+        super().__init__(request)
+        self.passthrough_fields = set(passthrough_fields)
+        self.destination = None
+        self.writer = None
+        self.active = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        # Leave fields that need their plaintext (e.g. archives) to the
+        # handlers further down the chain
+        self.active = self.field_name not in self.passthrough_fields
+        if not self.active:
+            return
+        self.encryptor = FileEncryptor()
+        self.hasher = content_hasher()
+        self.encrypted_name = encrypted_file_name(self.file_name)
+        self.destination = open_encrypted_destination(self.encrypted_name)
+        self.writer = self.encryptor.writer(self.destination, choose_codec(self.file_name, self.content_type))
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.hasher.update(raw_data)
+        self.writer.write(raw_data)
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.writer.close()
+        self.destination.close()
+        self.destination = None
+        return EncryptedUploadedFile(
+            encrypted_name=self.encrypted_name,
+            key=self.encryptor.key,
+            digest=self.hasher.hexdigest(),
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        if self.destination is not None:
+            self.destination.close()
+            os.remove(self.destination.name)
+            self.destination = None
+
+
+def encrypt_to_blob(chunks, name, content_type, size, workers=None):
+    """Encrypt an iterable of plaintext chunks into a new encrypted blob"""
+    encryptor = FileEncryptor(workers=workers)
+    hasher = content_hasher()
+    encrypted_name = encrypted_file_name(name)
+    with open_encrypted_destination(encrypted_name) as destination:
+        try:
+            writer = encryptor.writer(destination, choose_codec(name, content_type))
+            for chunk in chunks:
+                hasher.update(chunk)
+                writer.write(chunk)
+            writer.close()
+        except Exception:
+            os.remove(destination.name)
+            raise
+    return EncryptedUploadedFile(
+        encrypted_name=encrypted_name,
+        key=encryptor.key,
+        digest=hasher.hexdigest(),
+        name=name,
+        content_type=content_type,
+        size=size,
+    )
+
+
+def encrypt_uploaded_file(uploaded_file):
+    """
+    Encrypt an already-parsed upload into its final location.
+
+    Used when the body was consumed before the encrypting handler could be
+    installed (e.g. by a CSRF check reading request.POST).
+    """
+    return encrypt_to_blob(
+        uploaded_file.chunks(DEFAULT_CHUNK_SIZE),
+        uploaded_file.name,
+        uploaded_file.content_type,
+        uploaded_file.size,
+    )
+
+
+def discard_encrypted_uploads(files):
+    """Remove the blobs of every encrypted upload in a FILES mapping"""
+    for field_name, uploaded_files in files.lists():
+        for uploaded_file in uploaded_files:
+            if isinstance(uploaded_file, EncryptedUploadedFile):
+                uploaded_file.discard()
+
+
+class ArchiveMember:
+    """A regular file inside an uploaded zip or tar archive"""
+
+    def __init__(self, name, size, open_member):
+        self.name = name
+        self.size = size
+        self.content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.open_member = open_member
+
+    def chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        stream = self.open_member()
+        try:
+            for block in iter(lambda: stream.read(chunk_size), b''):
+                yield block
+        finally:
+            stream.close()
+
+
+class LockedReader:
+    """Serialise reads of tar members that share one underlying file object"""
+
+    def __init__(self, stream, lock):
+        self.stream = stream
+        self.lock = lock
+
+    def read(self, size=-1):
+        with self.lock:
+            return self.stream.read(size)
+
+    def close(self):
+        self.stream.close()
+
+
+# Leading bytes of the compression formats tarfile understands
+COMPRESSED_TAR_OPENERS = (
+    (b'\x1f\x8b', lambda f: gzip.GzipFile(fileobj=f)),
+    (b'BZh', bz2.BZ2File),
+    (b'\xfd7zXZ\x00', lzma.LZMAFile),
+)
+
+
+def spool_decompressed_tar(archive_file, max_size):
+    """
+    Decompress a compressed tar into a temporary file in one sequential pass.
+
+    Members of a compressed tar cannot be read out of order without
+    restarting decompression at every backward seek, so they are read from
+    the spooled plain tar instead. Returns None for an uncompressed archive.
+    """
+    archive_file.seek(0)
+    magic = archive_file.read(6)
+    archive_file.seek(0)
+    for prefix, opener in COMPRESSED_TAR_OPENERS:
+        if magic.startswith(prefix):
+            break
+    else:
+        return None
+
+    spool = tempfile.TemporaryFile()
+    try:
+        with opener(archive_file) as source:
+            for block in iter(lambda: source.read(DEFAULT_CHUNK_SIZE), b''):
+                spool.write(block)
+                if spool.tell() > max_size:
+                    raise ValueError('Archive is too large once decompressed.')
+    except (OSError, EOFError, zlib.error, lzma.LZMAError):
+        spool.close()
+        raise ValueError('Archive could not be decompressed.')
+    except ValueError:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def check_archive_limits(members):
+    """Enforce FILE_ARCHIVE_MAX_MEMBERS and FILE_ARCHIVE_MAX_SIZE on an archive's files"""
+    max_members = getattr(settings, 'FILE_ARCHIVE_MAX_MEMBERS', 500)
+    max_size = getattr(settings, 'FILE_ARCHIVE_MAX_SIZE', 1024 ** 3)
+    if len(members) > max_members:
+        raise ValueError(f'Archive holds more than {max_members} files.')
+    if sum(member.size for member in members) > max_size:
+        raise ValueError('Archive is too large once decompressed.')
+
+
+def iter_archive_members(archive_file):
+    """
+    Yield an ArchiveMember for every regular file in a zip or tar upload.
+
+    Members can be read concurrently from different threads. Directories,
+    links and hidden entries (e.g. __MACOSX metadata) are skipped. Raises
+    ValueError for unsupported archives and for archives holding too many
+    files or too much data (FILE_ARCHIVE_MAX_MEMBERS, FILE_ARCHIVE_MAX_SIZE).
+    """
+    archive_file.seek(0)
+    if zipfile.is_zipfile(archive_file):
+        archive_file.seek(0)
+        archive = zipfile.ZipFile(archive_file)
+        members = []
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or not name or name.startswith('.') or '__MACOSX' in info.filename:
+                continue
+            members.append(ArchiveMember(name, info.file_size, lambda info=info: archive.open(info)))
+        check_archive_limits(members)
+        yield from members
+        return
+
+    spool = spool_decompressed_tar(archive_file, getattr(settings, 'FILE_ARCHIVE_MAX_SIZE', 1024 ** 3))
+    try:
+        archive = tarfile.open(fileobj=spool or archive_file, mode='r:')
+    except tarfile.TarError:
+        if spool is not None:
+            spool.close()
+        raise ValueError('Unsupported archive format. Upload a zip or tar file.')
+    lock = threading.Lock()
+
+    def open_tar_member(member):
+        with lock:
+            return LockedReader(archive.extractfile(member), lock)
+
+    members = []
+    for member in archive.getmembers():
+        name = os.path.basename(member.name)
+        if not member.isfile() or not name or name.startswith('.'):
+            continue
+        members.append(ArchiveMember(name, member.size, lambda member=member: open_tar_member(member)))
+    check_archive_limits(members)
+    yield from members
@@ -5,6 +5,7 @@ urlpatterns = [
     # File operations
     path('files/', views.FileListView.as_view(), name='file-list'),
     path('files/upload/', views.FileUploadView.as_view(), name='file-upload'),
+    path('files/upload/batch/', views.FileBatchUploadView.as_view(), name='file-batch-upload'),
     path('files/<int:file_id>/download/', views.FileDownloadView.as_view(), name='file-download'),
     
     # File permissions
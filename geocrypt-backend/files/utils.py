@@ -1,45 +1,581 @@
 import os
-from cryptography.fernet import Fernet
+import re
+import struct
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.backends import default_backend
 import base64
 
+try:
+    import zstandard
+except ImportError:  # optional, zlib is used when it is not installed
+    zstandard = None
+
+
+# Chunked container format
+#
+#   header : magic (4) | format version (1) | flags (1) | chunk size (4)
+#   record : ciphertext length (4) | nonce (12) | ciphertext + GCM tag
+#
+# Each record holds at most `chunk size` plaintext bytes sealed with
+# AES-256-GCM under its own random nonce. The header, the record index and a
+# final-record marker are bound in as associated data, so records cannot be
+# reordered, dropped or truncated without failing authentication.
+# Blobs that do not start with the magic are legacy single-token Fernet files;
+# they have no header, so the only format version is FORMAT_CHUNKED.
+#
+# When the flags name a compression codec, each chunk is compressed on its own
+# before sealing and the record plaintext becomes marker (1) | payload, where
+# the marker says whether that chunk was compressed or stored as-is (for
+# chunks that would not shrink). Chunks still cover `chunk size` plaintext
+# bytes each, so plaintext offsets map to record indexes exactly as before.
+#
+# Compressed records vary in size, so compressed containers also set the
+# index flag and end with a record index after the final record:
+#
+#   index  : end marker (4, zero) | record offsets (8 each) | record count (4) | index magic (4)
+#
+# A zero length can never start a record, so sequential readers stop at the
+# marker, while range reads find any record's offset with one seek. The
+# index is not authenticated itself; a record found through a forged offset
+# fails authentication like any other tampered record. Compressed containers
+# without the index flag are rejected.
+CONTAINER_MAGIC = b'GCRY'
+FORMAT_CHUNKED = 2
+
+HEADER_STRUCT = struct.Struct('>4sBBI')
+RECORD_LENGTH_STRUCT = struct.Struct('>I')
+HEADER_SIZE = HEADER_STRUCT.size
+NONCE_SIZE = 12
+TAG_SIZE = 16
+RECORD_OVERHEAD = RECORD_LENGTH_STRUCT.size + NONCE_SIZE + TAG_SIZE
+INDEX_MAGIC = b'GIDX'
+INDEX_END_MARKER = RECORD_LENGTH_STRUCT.pack(0)
+INDEX_OFFSET_STRUCT = struct.Struct('>Q')
+INDEX_TRAILER_STRUCT = struct.Struct('>I4s')
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+
+FLAG_ZLIB = 0x01
+FLAG_ZSTD = 0x02
+COMPRESSION_FLAGS = FLAG_ZLIB | FLAG_ZSTD
+FLAG_INDEXED = 0x04
+CHUNK_STORED = 0
+CHUNK_COMPRESSED = 1
+
+# Formats that are already compressed (OOXML and other zip containers, PDF,
+# media), which compression would only slow down
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.docx', '.xlsx', '.pptx', '.pdf', '.zip', '.gz', '.tgz', '.bz2', '.xz',
+    '.7z', '.rar', '.zst', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3',
+    '.mp4', '.mov',
+}
+INCOMPRESSIBLE_CONTENT_TYPES = (
+    'image/', 'audio/', 'video/', 'application/pdf', 'application/zip',
+    'application/gzip', 'application/x-7z-compressed',
+    'application/vnd.openxmlformats-officedocument.',
+)
+
+RANGE_HEADER_RE = re.compile(r'\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*', re.IGNORECASE)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_chunk_pool():
+    """
+    The thread pool chunks are sealed and opened on, shared by every
+    upload and download in the process and bounded by
+    FILE_ENCRYPTION_WORKERS. Created on first use, and again in a forked
+    worker, whose copy of the parent's pool has no threads.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                workers = max(int(getattr(settings, 'FILE_ENCRYPTION_WORKERS', 1)), 1)
+                _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='file-crypto')
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def derive_chunk_key(key):
+    """Derive the AES-256-GCM key for chunked records from a Fernet key"""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b'geocrypt-chunked-container-v2',
+    ).derive(base64.urlsafe_b64decode(key))
+
+
+def read_exactly(stream, size):
+    """Read `size` bytes from a stream, failing on a short read"""
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError('Decryption failed: encrypted file is truncated')
+    return data
+
+
+def parse_header(header):
+    """Return (version, flags, chunk_size) for a chunked container header"""
+    magic, version, flags, chunk_size = HEADER_STRUCT.unpack(header)
+    if magic != CONTAINER_MAGIC:
+        raise ValueError('Decryption failed: not a chunked container')
+    if version != FORMAT_CHUNKED:
+        raise ValueError(f'Decryption failed: unsupported format version {version}')
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f'Decryption failed: invalid chunk size {chunk_size}')
+    return version, flags, chunk_size
+
+
+class ZlibCodec:
+    flag = FLAG_ZLIB
+
+    def __init__(self, level=1):
+        self.level = level
+
+    def compress(self, chunk):
+        return zlib.compress(chunk, self.level)
+
+    def decompress(self, data, max_size):
+        decompressor = zlib.decompressobj()
+        chunk = decompressor.decompress(data, max_size)
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ValueError('Decryption failed: corrupt compressed chunk')
+        return chunk
+
+
+class ZstdCodec:
+    flag = FLAG_ZSTD
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def compress(self, chunk):
+        # Compressor objects are not thread-safe; chunks are sealed on a pool
+        return zstandard.ZstdCompressor(level=self.level).compress(chunk)
+
+    def decompress(self, data, max_size):
+        try:
+            return zstandard.ZstdDecompressor().decompress(data, max_output_size=max_size)
+        except zstandard.ZstdError:
+            raise ValueError('Decryption failed: corrupt compressed chunk')
+
+
+def codec_for_flags(flags):
+    """Return the compression codec named by container flags, if any"""
+    if bool(flags & COMPRESSION_FLAGS) != bool(flags & FLAG_INDEXED):
+        raise ValueError('Decryption failed: compressed container without a record index')
+    flags &= COMPRESSION_FLAGS
+    if not flags:
+        return None
+    if flags == FLAG_ZLIB:
+        return ZlibCodec()
+    if flags == FLAG_ZSTD:
+        if zstandard is None:
+            raise ValueError('Decryption failed: file is zstd-compressed but zstandard is not installed')
+        return ZstdCodec()
+    raise ValueError(f'Decryption failed: unknown compression flags {flags:#x}')
+
+
+def choose_codec(name='', content_type=''):
+    """
+    Pick the compression codec for a new upload from its name and MIME type.
+
+    Returns None (store uncompressed) for formats that are already compressed
+    or when FILE_COMPRESSION is 'none'. 'auto' prefers zstd when installed.
+    """
+    setting = getattr(settings, 'FILE_COMPRESSION', 'auto')
+    if setting == 'none':
+        return None
+    if os.path.splitext(name or '')[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return None
+    if (content_type or '').lower().startswith(INCOMPRESSIBLE_CONTENT_TYPES):
+        return None
+    level = getattr(settings, 'FILE_COMPRESSION_LEVEL', 0)
+    if setting == 'zstd' or (setting == 'auto' and zstandard is not None):
+        if zstandard is None:
+            raise ValueError('FILE_COMPRESSION is "zstd" but zstandard is not installed')
+        return ZstdCodec(level) if level else ZstdCodec()
+    return ZlibCodec(level) if level else ZlibCodec()
+
+
+def parse_range_header(header, size):
+    """
+    Parse a single-range `Range: bytes=...` header against a resource size.
+
+    Returns an inclusive (start, end) tuple, or None when the header should be
+    ignored (malformed, another unit, or multiple ranges) and the whole
+    resource served. Raises ValueError when the range is unsatisfiable.
+    """
+    match = RANGE_HEADER_RE.fullmatch(header)
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = int(last) if last else size - 1
+        if last and end < start:
+            return None
+    else:
+        suffix_length = int(last)
+        if suffix_length == 0:
+            raise ValueError('Range not satisfiable')
+        start, end = max(size - suffix_length, 0), size - 1
+    if start >= size:
+        raise ValueError('Range not satisfiable')
+    return start, min(end, size - 1)
+
+
+def primed(chunks):
+    """
+    Advance a chunk generator to its first chunk and return an equivalent
+    iterator.
+
+    Errors such as a wrong key or a corrupt header then surface before any
+    output has been sent, while the rest is still produced lazily. Closing
+    the returned iterator (e.g. on client disconnect) closes the generator.
+    """
+    first = next(chunks, b'')
+    
+    def generate():
+        try:
+            yield first
+            yield from chunks
+        finally:
+            chunks.close()
+    
+    return generate()
+
+
+class ChunkedEncryptingWriter:
+    """File-like sink that encrypts everything written to it into `dst`
+
+    Plaintext is buffered only up to one chunk, so memory stays bounded no
+    matter how much data passes through. One chunk is always held back until
+    `close()` so the final record can be marked as such.
+
+    With more than one worker, chunks are compressed and sealed on the shared
+    chunk pool (zlib and AES-GCM release the GIL) while records are still
+    written in order; at most two chunks per worker are in flight at any
+    time. A file that fits in one chunk never touches the pool. Compressed
+    output ends with the record index, written by `close()`.
+    """
+
+    def __init__(self, encryptor, dst, codec=None):
+        self.encryptor = encryptor
+        self.dst = dst
+        self.codec = codec
+        self.chunk_size = encryptor.chunk_size
+        flags = codec.flag | FLAG_INDEXED if codec is not None else 0
+        self.header = HEADER_STRUCT.pack(CONTAINER_MAGIC, FORMAT_CHUNKED,
+                                         flags, self.chunk_size)
+        self.buffer = bytearray()
+        self.index = 0
+        self.offset = HEADER_SIZE
+        self.record_offsets = [] if codec is not None else None
+        self.size = 0
+        self.closed = False
+        self.pending = deque()
+        dst.write(self.header)
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed encrypting writer')
+        self.buffer += data
+        self.size += len(data)
+
+        offset = 0
+        while len(self.buffer) - offset > self.chunk_size:
+            chunk = bytes(self.buffer[offset:offset + self.chunk_size])
+            self._emit(chunk, final=False)
+            offset += self.chunk_size
+        if offset:
+            del self.buffer[:offset]
+        return len(data)
+
+    def close(self):
+        """Seal the buffered remainder as the final record"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._emit(bytes(self.buffer), final=True)
+            while self.pending:
+                self._write_record(self.pending.popleft().result())
+            if self.record_offsets is not None:
+                self.dst.write(INDEX_END_MARKER)
+                self.dst.write(struct.pack(f'>{len(self.record_offsets)}Q', *self.record_offsets))
+                self.dst.write(INDEX_TRAILER_STRUCT.pack(len(self.record_offsets), INDEX_MAGIC))
+        finally:
+            self.buffer = bytearray()
+            # The pool is shared: drop only this writer's unfinished chunks
+            while self.pending:
+                self.pending.popleft().cancel()
+
+    def _emit(self, chunk, final):
+        if self.encryptor.workers == 1 or (final and not self.pending):
+            self._write_record(self._seal(self.index, final, chunk))
+        else:
+            self.pending.append(get_chunk_pool().submit(self._seal, self.index, final, chunk))
+            while len(self.pending) > 2 * self.encryptor.workers:
+                self._write_record(self.pending.popleft().result())
+        self.index += 1
+
+    def _write_record(self, record):
+        if self.record_offsets is not None:
+            self.record_offsets.append(self.offset)
+        self.dst.write(record)
+        self.offset += len(record)
+
+    def _seal(self, index, final, chunk):
+        if self.codec is not None:
+            compressed = self.codec.compress(chunk)
+            if len(compressed) < len(chunk):
+                chunk = bytes([CHUNK_COMPRESSED]) + compressed
+            else:
+                chunk = bytes([CHUNK_STORED]) + chunk
+        return self.encryptor.seal_chunk(self.header, index, final, chunk)
+
 
 class FileEncryptor:
-    def __init__(self, key=None):
+    def __init__(self, key=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=None):
         if key:
-            self.key = key
+            self.key = bytes(key)
         else:
             self.key = Fernet.generate_key()
         self.fernet = Fernet(self.key)
+        self.aead = AESGCM(derive_chunk_key(self.key))
+        self.chunk_size = chunk_size
+        if workers is None:
+            workers = getattr(settings, 'FILE_ENCRYPTION_WORKERS', 1)
+        self.workers = max(int(workers), 1)
     
     def encrypt_file(self, input_path, output_path):
-        """Encrypt a file using Fernet symmetric encryption"""
-        with open(input_path, 'rb') as f:
-            data = f.read()
-        
-        encrypted_data = self.fernet.encrypt(data)
-        
-        with open(output_path, 'wb') as f:
-            f.write(encrypted_data)
+        """Encrypt a file into the chunked container format"""
+        with open(input_path, 'rb') as src, open(output_path, 'wb') as dst:
+            self.encrypt_stream(src, dst)
         
         return True
     
     def decrypt_file(self, input_path, output_path):
-        """Decrypt a file"""
-        with open(input_path, 'rb') as f:
-            encrypted_data = f.read()
+        """Decrypt a chunked container or legacy Fernet file"""
+        with open(input_path, 'rb') as src, open(output_path, 'wb') as dst:
+            for chunk in self.decrypt_stream(src):
+                dst.write(chunk)
         
-        try:
-            decrypted_data = self.fernet.decrypt(encrypted_data)
-        except Exception as e:
-            raise ValueError(f"Decryption failed: {str(e)}")
+        return True
+    
+    def iter_decrypted_file(self, input_path):
+        """Return an iterator of decrypted chunks for an encrypted file"""
+        return primed(self._decrypt_path(input_path))
+    
+    def _decrypt_path(self, input_path):
+        with open(input_path, 'rb') as src:
+            yield from self.decrypt_stream(src)
+    
+    def supports_ranges(self, input_path):
+        """Whether byte ranges of this file can be decrypted independently"""
+        with open(input_path, 'rb') as src:
+            header = src.read(HEADER_SIZE)
+        return len(header) == HEADER_SIZE and header.startswith(CONTAINER_MAGIC)
+    
+    def iter_decrypted_range(self, input_path, start, end):
+        """
+        Return an iterator of plaintext bytes `start`..`end` (inclusive) of a
+        chunked file.
+
+        Only the records covering the range are located, read and decrypted:
+        uncompressed records have a fixed size on disk, and compressed ones
+        are found through the record index at the end of the file.
+        """
+        return primed(self._decrypt_range(input_path, start, end))
+    
+    def _decrypt_range(self, input_path, start, end):
+        with open(input_path, 'rb') as src:
+            header = read_exactly(src, HEADER_SIZE)
+            _, flags, chunk_size = parse_header(header)
+            codec = codec_for_flags(flags)
+            first, last = start // chunk_size, end // chunk_size
+            record_count, offsets = self._record_offsets(src, flags, codec, chunk_size, first, last)
+            
+            for index in range(first, last + 1):
+                if index >= record_count:
+                    raise ValueError('Decryption failed: encrypted file is truncated')
+                src.seek(offsets[index - first])
+                record = self._read_record(src, self._max_record_length(codec, chunk_size), flags)
+                chunk = self._open_record(header, codec, chunk_size, index,
+                                          index == record_count - 1, record)
+                
+                chunk_start = index * chunk_size
+                yield chunk[max(start - chunk_start, 0):end - chunk_start + 1]
+    
+    def _record_offsets(self, src, flags, codec, chunk_size, first, last):
+        """
+        Return (record count, file offsets of records `first`..`last`) for a
+        chunked container; offsets past the last record are left out
+        """
+        file_size = os.fstat(src.fileno()).st_size
+        if codec is None:
+            record_size = chunk_size + RECORD_OVERHEAD
+            record_count = -(-(file_size - HEADER_SIZE) // record_size)
+            last = min(last, record_count - 1)
+            return record_count, range(HEADER_SIZE + first * record_size,
+                                       HEADER_SIZE + (last + 1) * record_size, record_size)
         
-        with open(output_path, 'wb') as f:
-            f.write(decrypted_data)
+        # Compressed: look the offsets up in the index at the end
+        if file_size < HEADER_SIZE + INDEX_TRAILER_STRUCT.size:
+            raise ValueError('Decryption failed: encrypted file is truncated')
+        src.seek(file_size - INDEX_TRAILER_STRUCT.size)
+        record_count, magic = INDEX_TRAILER_STRUCT.unpack(read_exactly(src, INDEX_TRAILER_STRUCT.size))
+        index_start = file_size - INDEX_TRAILER_STRUCT.size - record_count * INDEX_OFFSET_STRUCT.size
+        if magic != INDEX_MAGIC or index_start < HEADER_SIZE:
+            raise ValueError('Decryption failed: corrupt record index')
+        last = min(last, record_count - 1)
+        if last < first:
+            return record_count, []
+        src.seek(index_start + first * INDEX_OFFSET_STRUCT.size)
+        count = last - first + 1
+        return record_count, struct.unpack(f'>{count}Q', read_exactly(src, count * INDEX_OFFSET_STRUCT.size))
+    
+    def encrypt_stream(self, src, dst, codec=None):
+        """Encrypt a readable binary stream into `dst` chunk by chunk"""
+        writer = self.writer(dst, codec)
+        for block in iter(lambda: src.read(self.chunk_size), b''):
+            writer.write(block)
+        writer.close()
+        return writer.size
+    
+    def writer(self, dst, codec=None):
+        """
+        Return a file-like object that encrypts whatever is written to it,
+        compressing each chunk first when a codec is given.
+        """
+        return ChunkedEncryptingWriter(self, dst, codec)
+    
+    def decrypt_stream(self, src):
+        """Yield decrypted plaintext chunks from an encrypted binary stream"""
+        header = src.read(HEADER_SIZE)
+        if not header.startswith(CONTAINER_MAGIC):
+            # Legacy Fernet token: it can only be authenticated as a whole
+            yield self._decrypt_fernet(header + src.read())
+            return
         
-        return True
+        _, flags, chunk_size = parse_header(header)
+        codec = codec_for_flags(flags)
+        records = self._iter_records(src, self._max_record_length(codec, chunk_size), flags)
+        if self.workers == 1:
+            for index, final, record in records:
+                yield self._open_record(header, codec, chunk_size, index, final, record)
+            return
+        
+        # Open records on the shared chunk pool, yielding them in order; a
+        # single-record file is opened inline
+        pending = deque()
+        try:
+            for index, final, record in records:
+                if final and not pending:
+                    yield self._open_record(header, codec, chunk_size, index, final, record)
+                    continue
+                pending.append(get_chunk_pool().submit(self._open_record, header, codec, chunk_size,
+                                                       index, final, record))
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # An abandoned download must not leave its records queued
+            for future in pending:
+                future.cancel()
+    
+    def _iter_records(self, src, max_length, flags=0):
+        """Yield (index, final, record) for each record, reading one ahead"""
+        record = self._read_record(src, max_length, flags)
+        if record is None:
+            raise ValueError('Decryption failed: encrypted file is truncated')
+        index = 0
+        while record is not None:
+            following = self._read_record(src, max_length, flags)
+            yield index, following is None, record
+            record = following
+            index += 1
+    
+    def seal_chunk(self, header, index, final, chunk):
+        """Encrypt one chunk into a length-prefixed record"""
+        nonce = os.urandom(NONCE_SIZE)
+        ciphertext = self.aead.encrypt(nonce, chunk, self._associated_data(header, index, final))
+        return RECORD_LENGTH_STRUCT.pack(len(ciphertext)) + nonce + ciphertext
+    
+    def open_chunk(self, header, index, final, record):
+        """Decrypt one (nonce, ciphertext) record"""
+        nonce, ciphertext = record
+        try:
+            return self.aead.decrypt(nonce, ciphertext, self._associated_data(header, index, final))
+        except InvalidTag:
+            raise ValueError(f'Decryption failed: chunk {index} failed authentication')
+    
+    def _open_record(self, header, codec, chunk_size, index, final, record):
+        """Decrypt a record and undo its compression, if any"""
+        chunk = self.open_chunk(header, index, final, record)
+        if codec is None:
+            return chunk
+        if not chunk:
+            raise ValueError(f'Decryption failed: chunk {index} is missing its marker')
+        if chunk[0] == CHUNK_STORED:
+            return chunk[1:]
+        if chunk[0] == CHUNK_COMPRESSED:
+            return codec.decompress(chunk[1:], chunk_size)
+        raise ValueError(f'Decryption failed: chunk {index} has an unknown marker')
+    
+    @staticmethod
+    def _max_record_length(codec, chunk_size):
+        """Largest plaintext a record can hold (one marker byte if compressed)"""
+        return chunk_size + (1 if codec is not None else 0)
+    
+    def _read_record(self, src, max_length, flags=0):
+        """
+        The next (nonce, ciphertext) record, or None after the last one:
+        at end of file, or at the index end marker of a compressed file
+        """
+        indexed = flags & FLAG_INDEXED
+        prefix = src.read(RECORD_LENGTH_STRUCT.size)
+        if not prefix:
+            if indexed:
+                raise ValueError('Decryption failed: encrypted file is truncated')
+            return None
+        if indexed and prefix == INDEX_END_MARKER:
+            return None
+        if len(prefix) != RECORD_LENGTH_STRUCT.size:
+            raise ValueError('Decryption failed: encrypted file is truncated')
+        (length,) = RECORD_LENGTH_STRUCT.unpack(prefix)
+        if not TAG_SIZE <= length <= max_length + TAG_SIZE:
+            raise ValueError('Decryption failed: corrupt record length')
+        nonce = read_exactly(src, NONCE_SIZE)
+        return nonce, read_exactly(src, length)
+    
+    @staticmethod
+    def _associated_data(header, index, final):
+        return header + struct.pack('>QB', index, 1 if final else 0)
+    
+    def _decrypt_fernet(self, token):
+        try:
+            return self.fernet.decrypt(token)
+        except InvalidToken as e:
+            raise ValueError(f"Decryption failed: {str(e) or 'invalid token'}")
     
     def encrypt_data(self, data):
         """Encrypt binary data"""
@@ -2,24 +2,40 @@ from django.shortcuts import render
 
 # Create your views here.
 import os
+import tarfile
+import zipfile
 from datetime import timedelta
 from django.conf import settings
 from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import load_handler
 from django.core.mail import send_mail
-from django.http import FileResponse, HttpResponse
+from django.db import transaction
+from django.db.models import F, Value
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe
 from rest_framework import generics, status, permissions
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
 from .models import File, FileAccessLog, FilePermission, RemoteAccessRequest
+from .blobstore import acquire_blob
+from .keys import get_file_encryptor
+from .permission_cache import permitted_file_ids
 from .serializers import (FileSerializer, FileUploadSerializer, 
                          FileAccessLogSerializer, FilePermissionSerializer,
-                         RemoteAccessRequestSerializer)
-from .utils import FileEncryptor
+                         RemoteAccessRequestSerializer, validate_upload)
+from .upload_handlers import (EncryptingUploadHandler, EncryptedUploadedFile,
+                              discard_encrypted_uploads, encrypt_to_blob,
+                              encrypt_uploaded_file, iter_archive_members)
+from .utils import get_chunk_pool, parse_range_header
+from api.pagination import KeysetPagination
+from geofencing.grants import verify_grant
 from geofencing.location_utils import validate_access_conditions
+from monitoring.audit import audit_log
 from monitoring.models import UserActivity, SuspiciousActivity
 
 
@@ -29,14 +45,12 @@ class FileListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
         # Get files that user has permission to access
-        permitted_files = FilePermission.objects.filter(
-            user=user,
-            is_active=True
-        ).values_list('file_id', flat=True)
+        file_ids = permitted_file_ids(self.request.user)
         
-        return File.objects.filter(id__in=permitted_files)
+        return (File.objects.filter(id__in=file_ids)
+                .select_related('uploaded_by')
+                .annotate(can_access=Value(True)))
 
 
 class FileUploadView(APIView):
@@ -45,12 +59,17 @@ class FileUploadView(APIView):
     permission_classes = [IsAdminUser]
 
     def post(self, request, *args, **kwargs):
+        # Encrypt uploads while the multipart body is being parsed
+        request.upload_handlers = [EncryptingUploadHandler(request)]
         file_serializer = FileUploadSerializer(data=request.data)
         
         if file_serializer.is_valid():
             uploaded_file = request.FILES['file_path']
+            if not isinstance(uploaded_file, EncryptedUploadedFile):
+                # Body was parsed before the encrypting handler was installed
+                uploaded_file = encrypt_uploaded_file(uploaded_file)
             
-            # Create file record
+            # Create file record pointing at the encrypted blob
             file_obj = File(
                 name=file_serializer.validated_data['name'],
                 original_name=uploaded_file.name,
@@ -58,30 +77,21 @@ class FileUploadView(APIView):
                 mime_type=uploaded_file.content_type,
                 uploaded_by=request.user
             )
-            
-            # Save original file temporarily
-            temp_path = default_storage.save(f'temp/{uploaded_file.name}', uploaded_file)
-            temp_full_path = os.path.join(settings.MEDIA_ROOT, temp_path)
-            
-            # Encrypt the file
-            encryptor = FileEncryptor()
-            encrypted_filename = f"encrypted_{uploaded_file.name}.enc"
-            encrypted_path = os.path.join(settings.MEDIA_ROOT, 'encrypted_files', encrypted_filename)
-            
-            os.makedirs(os.path.dirname(encrypted_path), exist_ok=True)
-            
-            encryptor.encrypt_file(temp_full_path, encrypted_path)
-            
-            # Save file record with encrypted key
-            file_obj.file_path.name = f'encrypted_files/{encrypted_filename}'
-            file_obj.encryption_key = encryptor.key
-            file_obj.save()
-            
-            # Clean up temp file
-            os.remove(temp_full_path)
+            try:
+                with transaction.atomic():
+                    # Identical content shares one stored blob
+                    blob = acquire_blob(uploaded_file)
+                    file_obj.blob = blob
+                    file_obj.file_path.name = blob.file_path.name
+                    file_obj.encryption_key = blob.encryption_key
+                    file_obj.save(force_insert=True)
+            except Exception:
+                uploaded_file.discard()
+                raise
             
             # Log activity
-            UserActivity.objects.create(
+            audit_log(
+                UserActivity,
                 user=request.user,
                 activity_type='FILE_UPLOAD',
                 description=f'Uploaded and encrypted file: {uploaded_file.name}',
@@ -95,9 +105,130 @@ class FileUploadView(APIView):
                 status=status.HTTP_201_CREATED
             )
         
+        discard_encrypted_uploads(request.FILES)
         return Response(file_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class FileBatchUploadView(APIView):
+    """Upload and encrypt many files, or a zip/tar archive, in one request"""
+    parser_classes = (MultiPartParser, FormParser)
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        # Encrypt plain uploads while parsing; archives are spooled as usual
+        # because their members have to be read back out
+        request.upload_handlers = [
+            EncryptingUploadHandler(request, passthrough_fields=['archive'])
+        ] + [load_handler(handler, request) for handler in settings.FILE_UPLOAD_HANDLERS]
+        
+        uploads = request.FILES.getlist('files')
+        archives = request.FILES.getlist('archive')
+        if not uploads and not archives:
+            return Response(
+                {'error': 'No files provided. Send one or more "files" or an "archive".'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        results = []
+        accepted = []
+        
+        for uploaded_file in uploads:
+            if not isinstance(uploaded_file, EncryptedUploadedFile):
+                uploaded_file = encrypt_uploaded_file(uploaded_file)
+            try:
+                validate_upload(uploaded_file.name, uploaded_file.size)
+            except ValidationError as e:
+                uploaded_file.discard()
+                results.append({'file': uploaded_file.name, 'status': 'rejected', 'errors': e.detail})
+                continue
+            results.append({'file': uploaded_file.name, 'status': 'created'})
+            accepted.append((len(results) - 1, uploaded_file))
+        
+        for archive in archives:
+            try:
+                members = list(iter_archive_members(archive))
+            except (ValueError, zipfile.BadZipFile, tarfile.TarError) as e:
+                results.append({'file': archive.name, 'status': 'rejected', 'errors': [str(e)]})
+                continue
+            
+            valid_members = []
+            for member in members:
+                try:
+                    validate_upload(member.name, member.size)
+                except ValidationError as e:
+                    results.append({'file': member.name, 'status': 'rejected', 'errors': e.detail})
+                    continue
+                results.append({'file': member.name, 'status': 'created'})
+                valid_members.append((len(results) - 1, member))
+            
+            # Encrypt archive members concurrently, one file per worker
+            pool = get_chunk_pool()
+            futures = [
+                (index, pool.submit(encrypt_to_blob, member.chunks(), member.name,
+                                    member.content_type, member.size, workers=1))
+                for index, member in valid_members
+            ]
+            for index, future in futures:
+                try:
+                    accepted.append((index, future.result()))
+                except Exception as e:
+                    results[index].update({'status': 'rejected', 'errors': [str(e)]})
+        
+        ip_address = request.META.get('REMOTE_ADDR', '')
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
+        try:
+            with transaction.atomic():
+                blobs = [acquire_blob(uploaded_file) for _, uploaded_file in accepted]
+                file_objs = File.objects.bulk_create([
+                    File(
+                        name=uploaded_file.name,
+                        original_name=uploaded_file.name,
+                        file_path=blob.file_path.name,
+                        file_size=uploaded_file.size,
+                        mime_type=uploaded_file.content_type,
+                        encryption_key=blob.encryption_key,
+                        blob=blob,
+                        uploaded_by=request.user
+                    )
+                    for (_, uploaded_file), blob in zip(accepted, blobs)
+                ])
+                
+                # Log activity
+                UserActivity.objects.bulk_create([
+                    UserActivity(
+                        user=request.user,
+                        activity_type='FILE_UPLOAD',
+                        description=f'Uploaded and encrypted file: {file_obj.original_name}',
+                        ip_address=ip_address,
+                        user_agent=user_agent,
+                        metadata={'file_id': file_obj.id, 'file_name': file_obj.original_name,
+                                  'batch': True}
+                    )
+                    for file_obj in file_objs
+                ])
+        except Exception:
+            for _, uploaded_file in accepted:
+                uploaded_file.discard()
+            raise
+        
+        for (index, _), file_obj in zip(accepted, file_objs):
+            results[index]['data'] = FileSerializer(file_obj, context={'request': request}).data
+        
+        created = len(file_objs)
+        if created == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        
+        return Response({
+            'created': created,
+            'rejected': len(results) - created,
+            'results': results
+        }, status=response_status)
+
+
 class FileDownloadView(APIView):
     """Download a file (with access control)"""
     permission_classes = [IsAuthenticated]
@@ -107,13 +238,7 @@ class FileDownloadView(APIView):
             file_obj = File.objects.get(id=file_id)
             
             # Check permission
-            has_permission = FilePermission.objects.filter(
-                user=request.user,
-                file=file_obj,
-                is_active=True
-            ).exists()
-            
-            if not has_permission:
+            if file_obj.id not in permitted_file_ids(request.user):
                 return Response(
                     {'error': 'You do not have permission to access this file'},
                     status=status.HTTP_403_FORBIDDEN
@@ -123,18 +248,28 @@ class FileDownloadView(APIView):
             latitude = request.query_params.get('latitude')
             longitude = request.query_params.get('longitude')
             wifi_ssid = request.query_params.get('wifi_ssid')
+            wifi_bssid = request.query_params.get('wifi_bssid')
             
-            # Validate access conditions
-            access_check = validate_access_conditions(
-                request.user,
-                latitude=latitude,
-                longitude=longitude,
-                wifi_ssid=wifi_ssid
-            )
+            # A valid signed grant from validate-access stands in for
+            # re-running the access conditions. Header only: in the query
+            # string it would end up in access logs and Referer headers
+            grant = request.META.get('HTTP_X_ACCESS_GRANT')
+            if verify_grant(grant, request.user, request.META.get('REMOTE_ADDR', '')):
+                access_check = {'overall_access': True, 'reasons': [], 'checks': {}}
+            else:
+                # Validate access conditions
+                access_check = validate_access_conditions(
+                    request.user,
+                    latitude=latitude,
+                    longitude=longitude,
+                    wifi_ssid=wifi_ssid,
+                    wifi_bssid=wifi_bssid
+                )
             
             if not access_check['overall_access'] and not request.user.is_remote_access_enabled:
                 # Log denied access
-                FileAccessLog.objects.create(
+                audit_log(
+                    FileAccessLog,
                     user=request.user,
                     file=file_obj,
                     access_type='DOWNLOAD',
@@ -152,13 +287,16 @@ class FileDownloadView(APIView):
                     'checks': access_check['checks']
                 }, status=status.HTTP_403_FORBIDDEN)
             
-            # Update file access info
-            file_obj.last_accessed = timezone.now()
-            file_obj.access_count += 1
-            file_obj.save()
+            # Update file access info; never a full save, which could write
+            # back key material a concurrent re-encryption has just replaced
+            File.objects.filter(id=file_obj.id).update(
+                last_accessed=timezone.now(),
+                access_count=F('access_count') + 1
+            )
             
             # Log successful access
-            FileAccessLog.objects.create(
+            audit_log(
+                FileAccessLog,
                 user=request.user,
                 file=file_obj,
                 access_type='DOWNLOAD',
@@ -170,7 +308,8 @@ class FileDownloadView(APIView):
             )
             
             # Log user activity
-            UserActivity.objects.create(
+            audit_log(
+                UserActivity,
                 user=request.user,
                 activity_type='FILE_DOWNLOAD',
                 description=f'Downloaded file: {file_obj.name}',
@@ -181,21 +320,13 @@ class FileDownloadView(APIView):
             
             # Decrypt file for download
             if file_obj.is_encrypted:
-                # Decrypt the file
-                encryptor = FileEncryptor(file_obj.encryption_key)
-                encrypted_path = file_obj.file_path.path
-                decrypted_path = encrypted_path.replace('.enc', '.dec')
-                
-                encryptor.decrypt_file(encrypted_path, decrypted_path)
-                
-                # Serve decrypted file
-                response = FileResponse(open(decrypted_path, 'rb'))
-                response['Content-Disposition'] = f'attachment; filename="{file_obj.original_name}"'
-                
-                # Clean up decrypted file after sending
-                response._resource_closers.append(lambda: os.remove(decrypted_path))
-                
-                return response
+                try:
+                    return self._decrypted_response(request, file_obj)
+                except FileNotFoundError:
+                    # Re-encryption moved the blob since the row was read;
+                    # its old ciphertext is gone, so use the new one
+                    file_obj.refresh_from_db(fields=['file_path', 'encryption_key'])
+                    return self._decrypted_response(request, file_obj)
             else:
                 # Serve unencrypted file
                 response = FileResponse(file_obj.file_path)
@@ -213,14 +344,69 @@ class FileDownloadView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def _decrypted_response(self, request, file_obj):
+        """Stream a file's plaintext, or the requested byte range of it"""
+        # Decrypt chunk by chunk straight into the response
+        encryptor = get_file_encryptor(file_obj.encryption_key)
+        encrypted_path = file_obj.file_path.path
+        size = file_obj.file_size
+        etag = f'"{file_obj.id}-{int(file_obj.uploaded_at.timestamp())}-{size}"'
+        supports_ranges = encryptor.supports_ranges(encrypted_path)
+        
+        byte_range = None
+        range_header = request.META.get('HTTP_RANGE')
+        if (range_header and supports_ranges
+                and self._if_range_matches(request, etag, file_obj.uploaded_at)):
+            try:
+                byte_range = parse_range_header(range_header, size)
+            except ValueError:
+                response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+        
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                encryptor.iter_decrypted_range(encrypted_path, start, end),
+                status=status.HTTP_206_PARTIAL_CONTENT,
+                content_type=file_obj.mime_type or 'application/octet-stream'
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            response = StreamingHttpResponse(
+                encryptor.iter_decrypted_file(encrypted_path),
+                content_type=file_obj.mime_type or 'application/octet-stream'
+            )
+            response['Content-Length'] = str(size)
+        
+        response['Accept-Ranges'] = 'bytes' if supports_ranges else 'none'
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(file_obj.uploaded_at.timestamp())
+        response['Content-Disposition'] = f'attachment; filename="{file_obj.original_name}"'
+        return response
+
+    @staticmethod
+    def _if_range_matches(request, etag, last_modified):
+        """A Range applies unless If-Range names a different representation"""
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            return if_range == etag
+        if_range_date = parse_http_date_safe(if_range)
+        return if_range_date is not None and if_range_date == int(last_modified.timestamp())
+
 
 class FileAccessLogView(generics.ListAPIView):
     """View file access logs"""
     serializer_class = FileAccessLogSerializer
     permission_classes = [IsAdminUser]
+    pagination_class = KeysetPagination
+    keyset_field = 'access_time'
     
     def get_queryset(self):
-        return FileAccessLog.objects.all().order_by('-access_time')
+        return FileAccessLog.objects.select_related('user', 'file').order_by('-access_time')
 
 
 class FilePermissionView(generics.ListCreateAPIView):
@@ -229,7 +415,8 @@ class FilePermissionView(generics.ListCreateAPIView):
     permission_classes = [IsAdminUser]
     
     def get_queryset(self):
-        return FilePermission.objects.all().order_by('-granted_at')
+        return (FilePermission.objects.select_related('user', 'file', 'granted_by')
+                .order_by('-granted_at'))
     
     def perform_create(self, serializer):
         serializer.save(granted_by=self.request.user)
@@ -241,9 +428,10 @@ class RemoteAccessRequestView(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
+        queryset = RemoteAccessRequest.objects.select_related('user', 'approved_by')
         if self.request.user.is_staff:
-            return RemoteAccessRequest.objects.all().order_by('-requested_at')
-        return RemoteAccessRequest.objects.filter(user=self.request.user).order_by('-requested_at')
+            return queryset.order_by('-requested_at')
+        return queryset.filter(user=self.request.user).order_by('-requested_at')
     
     def perform_create(self, serializer):
         serializer.save(
@@ -253,7 +441,8 @@ class RemoteAccessRequestView(generics.ListCreateAPIView):
         )
         
         # Log activity
-        UserActivity.objects.create(
+        audit_log(
+            UserActivity,
             user=self.request.user,
             activity_type='REMOTE_REQUEST',
             description='Submitted remote access request',
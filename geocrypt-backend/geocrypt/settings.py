@@ -53,6 +53,7 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'x-access-grant',
 ]
 
 # CSRF Settings for React
@@ -158,6 +159,14 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Batch uploads send many files in one request
+DATA_UPLOAD_MAX_NUMBER_FILES = 500
+
+# Limits on a batch-uploaded zip/tar archive: files it may hold, and total
+# bytes once decompressed (compressed tars are spooled to disk up to this)
+FILE_ARCHIVE_MAX_MEMBERS = 500
+FILE_ARCHIVE_MAX_SIZE = 1024 * 1024 * 1024
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -182,6 +191,11 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Page size of the log and activity list endpoints (keyset pagination;
+# clients may ask for up to LOG_MAX_PAGE_SIZE rows with ?page_size=)
+LOG_PAGE_SIZE = config('LOG_PAGE_SIZE', default=50, cast=int)
+LOG_MAX_PAGE_SIZE = 500
+
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=30),
@@ -190,6 +204,21 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
 }
 
+# Audit log rows (UserActivity, FileAccessLog, UserAccessLog) are queued and
+# written in batches by a background thread, every AUDIT_FLUSH_SECONDS or
+# AUDIT_BATCH_SIZE rows. When the queue is full, requests wait up to
+# AUDIT_ENQUEUE_TIMEOUT seconds and then append to AUDIT_SPILL_PATH, which is
+# replayed once the database keeps up again; worker processes may share it.
+# Rows still queued in memory are lost if a worker is killed outright
+# (SIGKILL, OOM). Set AUDIT_LOG_ASYNC=False to write each row inside the
+# request instead.
+AUDIT_LOG_ASYNC = config('AUDIT_LOG_ASYNC', default=True, cast=bool)
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_SECONDS = 1.0
+AUDIT_QUEUE_SIZE = 10000
+AUDIT_ENQUEUE_TIMEOUT = 0.05
+AUDIT_SPILL_PATH = config('AUDIT_SPILL_PATH', default=str(BASE_DIR / 'audit-spill.jsonl'))
+
 # Email Configuration
 EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = config('EMAIL_HOST', default='smtp.gmail.com')
@@ -210,9 +239,61 @@ ALLOWED_LOCATIONS = [
     }
 ]
 
+# Geohash precision of the geofence index buckets (5 = cells of ~4.9 km)
+GEOFENCE_GEOHASH_PRECISION = 5
+
 WORK_HOURS_START = 6  # 6 AM
 WORK_HOURS_END = 23   # 11 PM
 
+# Active rows in the AllowedLocation/AllowedWifi/WorkHours/AccessRule tables
+# take precedence over ALLOWED_LOCATIONS and WORK_HOURS_*. Each process keeps
+# a compiled snapshot of them and checks the shared policy version (a row in
+# the database) at most this often, in seconds.
+GEOFENCE_POLICY_REFRESH_SECONDS = 5
+
+# Access decisions are cached per user, geohash cell (precision 7 = ~150 m)
+# and network for up to this many seconds, never past a work-hours boundary
+# or the user's remote access expiry
+GEOFENCE_DECISION_TTL = 60
+GEOFENCE_DECISION_GEOHASH_PRECISION = 7
+GEOFENCE_DECISION_CACHE_SIZE = 10000
+
+# Lifetime of the signed access grants handed out by validate-access, in
+# seconds. Grants are also cut short at work-hours boundaries and remote
+# access expiry, and are void once any geofencing rule changes.
+GEOFENCE_GRANT_TTL = 300
+
+# Largest number of attempts accepted by the batch access validation endpoint
+GEOFENCE_BATCH_MAX_ATTEMPTS = 1000
+
 # File encryption settings
 ENCRYPTION_ALGORITHM = 'AES256'
-KEY_SIZE = 32  # 256 bits
\ No newline at end of file
+KEY_SIZE = 32  # 256 bits
+FILE_ENCRYPTION_WORKERS = config('FILE_ENCRYPTION_WORKERS', default=min(os.cpu_count() or 1, 4), cast=int)
+
+# Compress compressible uploads before encryption: 'auto' (zstd if installed,
+# else zlib), 'zstd', 'zlib' or 'none'. A level of 0 uses the codec default.
+FILE_COMPRESSION = config('FILE_COMPRESSION', default='auto')
+FILE_COMPRESSION_LEVEL = config('FILE_COMPRESSION_LEVEL', default=0, cast=int)
+
+# Envelope encryption: per-file data keys are wrapped by this master key.
+# Set FILE_MASTER_KEY (urlsafe-base64, 32 bytes) or keep it in a local keyfile;
+# every host must use the same key. The keyfile is only generated when DEBUG
+# is on. Generate a key with:
+#   python -c "import base64, os; print(base64.urlsafe_b64encode(os.urandom(32)).decode())"
+# When rotating, move the old key to FILE_RETIRED_MASTER_KEYS and run
+# `python manage.py rewrap_file_keys`.
+FILE_MASTER_KEY = config('FILE_MASTER_KEY', default='')
+FILE_MASTER_KEYFILE = config('FILE_MASTER_KEYFILE', default=os.path.join(BASE_DIR, 'keys', 'master.key'))
+FILE_RETIRED_MASTER_KEYS = config('FILE_RETIRED_MASTER_KEYS', default='', cast=lambda v: [k for k in v.split(',') if k.strip()])
+FILE_KEY_CACHE_SIZE = config('FILE_KEY_CACHE_SIZE', default=1024, cast=int)
+FILE_KEY_CACHE_TTL = config('FILE_KEY_CACHE_TTL', default=300, cast=int)  # seconds
+
+# Key for the keyed hash that deduplicates identical uploads (defaults to SECRET_KEY)
+FILE_BLOB_ADDRESS_KEY = config('FILE_BLOB_ADDRESS_KEY', default='')
+
+# Longest time a user's set of permitted file ids is cached. It is keyed by
+# the user's FilePermissionVersion row, which every FilePermission change
+# bumps, so workers with their own local cache never serve a stale set; it
+# also never outlives the nearest expires_at.
+FILE_PERMISSION_CACHE_TTL = config('FILE_PERMISSION_CACHE_TTL', default=300, cast=int)  # seconds
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class GeofencingConfig(AppConfig):
     name = 'geofencing'
+
+    def ready(self):
+        from . import signals  # noqa: F401
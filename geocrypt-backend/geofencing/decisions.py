@@ -0,0 +1,131 @@
+import copy
+import threading
+import time as monotonic_time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .spatial import geohash_cell
+
+
+class DecisionCache:
+    """
+    Bounded LRU of access decisions, each with its own expiry.
+
+    Keys carry everything a decision depends on (user state, location cell,
+    network and policy generation), so entries never need to be invalidated;
+    stale ones simply stop being looked up and age out.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        now = monotonic_time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            result, expires_at = entry
+            if expires_at <= now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return result
+
+    def put(self, key, result, ttl):
+        with self.lock:
+            self.entries[key] = (result, monotonic_time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_decision_cache = None
+
+
+def get_decision_cache():
+    global _decision_cache
+    if _decision_cache is None:
+        _decision_cache = DecisionCache(getattr(settings, 'GEOFENCE_DECISION_CACHE_SIZE', 10000))
+    return _decision_cache
+
+
+def decision_key(policy, user, latitude, longitude, wifi_ssid, wifi_bssid):
+    """
+    Cache key for a decision, or None if it must not be cached.
+
+    Locations are quantized to a geohash cell, which is only safe when no
+    fence edge runs through the cell; points in boundary cells are always
+    evaluated exactly.
+    """
+    cell = None
+    if policy.require_location and latitude and longitude:
+        precision = getattr(settings, 'GEOFENCE_DECISION_GEOHASH_PRECISION', 7)
+        row, column = geohash_cell(float(latitude), float(longitude), precision)
+        if not policy.fences.cell_is_uniform(row, column, precision):
+            return None
+        cell = (row, column)
+    expiry = user.remote_access_expiry.timestamp() if user.remote_access_expiry else None
+    return (
+        user.pk, user.is_remote_access_enabled, expiry,
+        cell, bool(latitude and longitude), wifi_ssid or '', wifi_bssid or '',
+        policy.cache_key,
+    )
+
+
+def decision_ttl(policy, user, result, now, ttl=None):
+    """
+    Seconds a decision stays valid: at most `ttl` (GEOFENCE_DECISION_TTL by
+    default), and never past the next work-hours boundary or the user's
+    remote access expiry
+    """
+    if ttl is None:
+        ttl = getattr(settings, 'GEOFENCE_DECISION_TTL', 60)
+    if user.is_remote_access_enabled and user.remote_access_expiry:
+        ttl = min(ttl, (user.remote_access_expiry - now).total_seconds())
+    if policy.require_time and 'remote_access' not in result['checks']:
+        location_name = result['checks']['location'].get('location_name')
+        change = policy.seconds_until_change(now, location_name)
+        if change is not None:
+            ttl = min(ttl, change)
+    return ttl
+
+
+def cached_decision(policy, key, now, latitude=None, longitude=None):
+    """
+    Return a copy of a cached decision with the fields that depend on the
+    exact point and clock refreshed
+    """
+    if key is None:
+        return None
+    result = get_decision_cache().get(key)
+    if result is None:
+        return None
+    result = copy.deepcopy(result)
+    location_check = result['checks'].get('location', {})
+    if 'distance_km' in location_check:
+        # Same fence across the cell, but the distance is this point's own
+        fence, distance = policy.fences.locate(float(latitude), float(longitude))
+        if fence is None or fence.name != location_check.get('location_name'):
+            return None
+        location_check['distance_km'] = distance
+    time_check = result['checks'].get('time')
+    if time_check and 'current_time' in time_check:
+        location_name = result['checks'].get('location', {}).get('location_name')
+        time_check['current_time'] = policy.local_time(now, location_name).strftime('%H:%M:%S')
+    return result
+
+
+def remember_decision(policy, key, user, result, now):
+    if key is None:
+        return
+    ttl = decision_ttl(policy, user, result, now)
+    if ttl > 0:
+        get_decision_cache().put(key, copy.deepcopy(result), ttl)
@@ -0,0 +1,94 @@
+import numpy as np
+from geopy.distance import geodesic
+
+from .spatial import EARTH_RADIUS_KM, HAVERSINE_MARGIN
+
+# Rows of the (points x fences) distance matrix computed at a time, so
+# memory stays bounded for millions of points
+BLOCK_SIZE = 65536
+
+
+def haversine_matrix(latitudes, longitudes, fence_latitudes, fence_longitudes):
+    """
+    Great-circle distances in km from every point to every fence centre.
+
+    Takes 1-D arrays of point and fence coordinates in degrees and returns
+    an array of shape (points, fences).
+    """
+    lat1 = np.radians(np.asarray(latitudes, dtype=np.float64))[:, None]
+    lon1 = np.radians(np.asarray(longitudes, dtype=np.float64))[:, None]
+    lat2 = np.radians(np.asarray(fence_latitudes, dtype=np.float64))[None, :]
+    lon2 = np.radians(np.asarray(fence_longitudes, dtype=np.float64))[None, :]
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class FenceArrays:
+    """
+    Fence centres and radii laid out as arrays for the vectorized kernel.
+
+    Polygon fences get a radius of -1 so the circle test never matches
+    them; their columns are filled in by a point-in-polygon pass instead.
+    """
+
+    def __init__(self, fences):
+        self.fences = list(fences)
+        self.latitudes = np.array([fence.latitude for fence in self.fences], dtype=np.float64)
+        self.longitudes = np.array([fence.longitude for fence in self.fences], dtype=np.float64)
+        self.radii = np.array([
+            -1.0 if fence.radius_km is None else fence.radius_km for fence in self.fences
+        ], dtype=np.float64)
+        self.polygon_columns = [
+            (column, fence) for column, fence in enumerate(self.fences) if fence.radius_km is None
+        ]
+
+    def __len__(self):
+        return len(self.fences)
+
+
+def locate_many(latitudes, longitudes, fence_arrays, exact=True):
+    """
+    Find the first fence (in configured order) containing each point.
+
+    Returns (fence_indexes, distances_km): -1 and NaN where no fence
+    matches. Distances are to the fence centre (or a polygon's reference
+    point). Haversine distances decide every pair outside the spherical
+    error margin of a fence edge; with `exact`, the remaining pairs are
+    re-checked against the WGS-84 geodesic, matching check_location_access.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    count = len(latitudes)
+    indexes = np.full(count, -1, dtype=np.int64)
+    distances = np.full(count, np.nan)
+    if not len(fence_arrays) or not count:
+        return indexes, distances
+
+    radii = fence_arrays.radii[None, :]
+    for start in range(0, count, BLOCK_SIZE):
+        stop = min(start + BLOCK_SIZE, count)
+        block = haversine_matrix(latitudes[start:stop], longitudes[start:stop],
+                                 fence_arrays.latitudes, fence_arrays.longitudes)
+        inside = block < radii * (1 - HAVERSINE_MARGIN)
+        if exact:
+            boundary = ~inside & (block <= radii * (1 + HAVERSINE_MARGIN))
+            for row, column in zip(*np.nonzero(boundary)):
+                point = (latitudes[start + row], longitudes[start + row])
+                centre = (fence_arrays.latitudes[column], fence_arrays.longitudes[column])
+                exact_km = geodesic(point, centre).kilometers
+                if exact_km <= fence_arrays.radii[column]:
+                    inside[row, column] = True
+                    block[row, column] = exact_km
+        else:
+            inside |= block <= radii
+        for column, fence in fence_arrays.polygon_columns:
+            for polygon in fence.polygons:
+                inside[:, column] |= polygon.contains_many(latitudes[start:stop], longitudes[start:stop])
+
+        matched = inside.any(axis=1)
+        first = np.argmax(inside, axis=1)
+        rows = np.nonzero(matched)[0]
+        indexes[start + rows] = first[rows]
+        distances[start + rows] = block[rows, first[rows]]
+    return indexes, distances
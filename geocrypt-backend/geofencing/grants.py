@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+from .decisions import decision_ttl
+from .policy import get_policy
+
+GRANT_SALT = 'geofencing.access-grant'
+
+
+def mint_grant(user, result, ip_address='', now=None, policy=None):
+    """
+    Sign a short-lived grant for a passed access check.
+
+    The grant records which checks passed and expires after at most
+    GEOFENCE_GRANT_TTL seconds, never past the next work-hours boundary or
+    the user's remote access expiry. Returns (token, expires_at), or
+    (None, None) if access was not granted.
+    """
+    if not result['overall_access']:
+        return None, None
+    now = now or timezone.now()
+    policy = policy or get_policy()
+    ttl = decision_ttl(policy, user, result, now, ttl=getattr(settings, 'GEOFENCE_GRANT_TTL', 300))
+    if ttl <= 0:
+        return None, None
+    expires_at = now + timedelta(seconds=ttl)
+    claims = {
+        'u': user.pk,
+        'exp': int(expires_at.timestamp()),
+        'ip': ip_address,
+        'v': [policy.version, policy.wifi.version],
+        'checks': sorted(name for name, check in result['checks'].items() if check.get('allowed')),
+        'remote': 'remote_access' in result['checks'],
+    }
+    return signing.dumps(claims, salt=GRANT_SALT, compress=True), expires_at
+
+
+def verify_grant(token, user, ip_address=''):
+    """
+    Return the claims of a valid grant for this user and client, else None.
+
+    Only the signature, the expiry, the shared policy versions and the
+    user's remote access flag are checked, so no database query is needed
+    unless the grant names policy versions this process has not seen.
+    """
+    if not token:
+        return None
+    try:
+        claims = signing.loads(token, salt=GRANT_SALT)
+    except signing.BadSignature:
+        return None
+    if claims.get('u') != user.pk or claims.get('ip') != ip_address:
+        return None
+    if claims.get('exp', 0) <= timezone.now().timestamp():
+        return None
+    policy = get_policy()
+    if claims.get('v') != [policy.version, policy.wifi.version]:
+        # Another process may have seen a change this one has not polled yet
+        policy = get_policy(refresh=True)
+    if claims.get('v') != [policy.version, policy.wifi.version]:
+        # Geofencing changed since the grant was issued
+        return None
+    if claims.get('remote') and not user.is_remote_access_enabled:
+        return None
+    return claims
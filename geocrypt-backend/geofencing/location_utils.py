@@ -1,27 +1,53 @@
-from geopy.distance import geodesic
-from datetime import datetime, time
 from django.utils import timezone
-from django.conf import settings
 
+from .decisions import cached_decision, decision_key, remember_decision
+from .distance import locate_many
+from .policy import aget_policy, get_policy
 
-def check_location_access(latitude, longitude):
+# Batches with at least this many distinct points use the NumPy kernel;
+# smaller ones are faster through the geohash index
+VECTORIZE_MIN_POINTS = 32
+
+
+def check_location_access_many(points, policy=None):
     """
-    Check if the given coordinates are within any allowed location
+    Check many (latitude, longitude) points at once with the vectorized
+    distance kernel; returns one check_location_access result per point
     """
-    allowed_locations = settings.ALLOWED_LOCATIONS
-    
-    for location in allowed_locations:
-        point1 = (float(latitude), float(longitude))
-        point2 = (location['latitude'], location['longitude'])
-        
-        distance = geodesic(point1, point2).kilometers
-        
-        if distance <= location['radius_km']:
-            return {
+    policy = policy or get_policy()
+    latitudes = [point[0] for point in points]
+    longitudes = [point[1] for point in points]
+    indexes, distances = locate_many(latitudes, longitudes, policy.fence_arrays)
+    fences = policy.fence_arrays.fences
+    results = []
+    for index, distance in zip(indexes.tolist(), distances.tolist()):
+        if index < 0:
+            results.append({
+                'allowed': False,
+                'reason': 'Location not within allowed areas'
+            })
+        else:
+            results.append({
                 'allowed': True,
-                'location_name': location['name'],
+                'location_name': fences[index].name,
                 'distance_km': distance
-            }
+            })
+    return results
+
+
+def check_location_access(latitude, longitude, policy=None):
+    """
+    Check if the given coordinates are within any allowed location
+    """
+    policy = policy or get_policy()
+    fence, distance = policy.fences.locate(float(latitude), float(longitude))
+    
+    if fence is not None:
+        return {
+            'allowed': True,
+            'location_name': fence.name,
+            'distance_km': distance
+        }
     
     return {
         'allowed': False,
@@ -29,29 +55,25 @@ def check_location_access(latitude, longitude):
     }
 
 
-def check_wifi_access(wifi_ssid, location_name=None):
+def check_wifi_access(wifi_ssid, location_name=None, wifi_bssid=None, policy=None):
     """
-    Check if the WiFi SSID is allowed
+    Check if the WiFi SSID (and access point BSSID, if known) is allowed
     """
-    allowed_locations = settings.ALLOWED_LOCATIONS
+    policy = policy or get_policy()
+    location_names = policy.wifi.locations_for(wifi_ssid, wifi_bssid)
     
     if location_name:
         # Check for specific location
-        for location in allowed_locations:
-            if location['name'] == location_name:
-                if wifi_ssid in location['allowed_wifi_ssids']:
-                    return {
-                        'allowed': True,
-                        'location_name': location_name
-                    }
-    else:
-        # Check all locations
-        for location in allowed_locations:
-            if wifi_ssid in location['allowed_wifi_ssids']:
-                return {
-                    'allowed': True,
-                    'location_name': location['name']
-                }
+        if location_name in location_names:
+            return {
+                'allowed': True,
+                'location_name': location_name
+            }
+    elif location_names:
+        return {
+            'allowed': True,
+            'location_name': location_names[0]
+        }
     
     return {
         'allowed': False,
@@ -59,85 +81,174 @@ def check_wifi_access(wifi_ssid, location_name=None):
     }
 
 
-def check_time_access():
+def check_time_access(now=None, policy=None, location_name=None):
     """
-    Check if current time is within work hours
+    Check if current time is within work hours at the given location
     """
-    now = timezone.now()
+    policy = policy or get_policy()
+    now = policy.local_time(now or timezone.now(), location_name)
     current_time = now.time()
-    current_hour = current_time.hour
-    
-    # Default work hours from settings
-    work_start = getattr(settings, 'WORK_HOURS_START', 9)
-    work_end = getattr(settings, 'WORK_HOURS_END', 17)
     
-    if work_start <= current_hour < work_end:
-        return {
+    if policy.schedule.is_open(now):
+        result = {
             'allowed': True,
             'current_time': current_time.strftime('%H:%M:%S')
         }
+        window_end = policy.schedule.window_end(now)
+        if window_end is not None:
+            result['window_end'] = window_end.isoformat()
+        return result
     
+    windows = policy.schedule.windows_for(now.weekday())
+    if windows:
+        allowed = ', '.join(f'{start:%H:%M} and {end:%H:%M}' for start, end in windows)
+        reason = f'Access allowed only between {allowed}'
+    else:
+        reason = f'No work hours on {now:%A}'
     return {
         'allowed': False,
-        'reason': f'Access allowed only between {work_start}:00 and {work_end}:00',
+        'reason': reason,
         'current_time': current_time.strftime('%H:%M:%S')
     }
 
 
-def validate_access_conditions(user, latitude=None, longitude=None, wifi_ssid=None):
+def validate_access_conditions(user, latitude=None, longitude=None, wifi_ssid=None, wifi_bssid=None,
+                               policy=None):
     """
     Validate all access conditions for a user
-    """
-    results = {
-        'overall_access': True,
-        'checks': {},
-        'reasons': []
-    }
     
-    # Check if remote access is enabled
-    if user.is_remote_access_enabled and user.remote_access_expiry:
-        if timezone.now() < user.remote_access_expiry:
-            results['checks']['remote_access'] = {
-                'allowed': True,
-                'reason': 'Remote access granted'
-            }
-            return results
+    Repeat checks from the same user, place and network are answered from
+    a short-lived decision cache (see decisions.py).
+    """
+    now = timezone.now()
+    policy = policy or get_policy()
+    key = decision_key(policy, user, latitude, longitude, wifi_ssid, wifi_bssid)
+    result = cached_decision(policy, key, now, latitude, longitude)
+    if result is None:
+        result = validate_access_conditions_many(
+            [(user, latitude, longitude, wifi_ssid, wifi_bssid)], policy=policy, now=now
+        )[0]
+        remember_decision(policy, key, user, result, now)
+    return result
+
+
+async def avalidate_access_conditions(user, latitude=None, longitude=None, wifi_ssid=None,
+                                      wifi_bssid=None):
+    """
+    Async validate_access_conditions for ASGI views.
+
+    Once the policy snapshot is loaded every check runs from memory, so
+    the event loop is only left when the snapshot needs a refresh.
+    """
+    policy = await aget_policy()
+    return validate_access_conditions(user, latitude, longitude, wifi_ssid, wifi_bssid, policy=policy)
+
+
+def validate_access_conditions_many(attempts, policy=None, now=None):
+    """
+    Validate many (user, latitude, longitude, wifi_ssid[, wifi_bssid])
+    attempts in one pass.
+
+    The policy snapshot is resolved once for the whole batch, the time
+    check once per location time zone, identical points and networks are only looked up once, and large
+    batches compute all distances in one vectorized pass. Returns one result
+    per attempt, in order.
+    """
+    now = now or timezone.now()
+    policy = policy or get_policy()
+    time_checks = {}
+    location_checks = {}
+    wifi_checks = {}
+    results = []
     
-    # Check location
-    if latitude and longitude:
-        location_check = check_location_access(latitude, longitude)
-        results['checks']['location'] = location_check
-        if not location_check['allowed']:
-            results['overall_access'] = False
-            results['reasons'].append(location_check['reason'])
-    else:
-        results['checks']['location'] = {
-            'allowed': False,
-            'reason': 'Location data not provided'
-        }
-        results['overall_access'] = False
-        results['reasons'].append('Location data not provided')
+    attempts = list(attempts)
+    if policy.require_location:
+        points = list({
+            (float(attempt[1]), float(attempt[2]))
+            for attempt in attempts if attempt[1] and attempt[2]
+        })
+        if len(points) >= VECTORIZE_MIN_POINTS:
+            location_checks = dict(zip(points, check_location_access_many(points, policy)))
     
-    # Check WiFi
-    if wifi_ssid:
-        wifi_check = check_wifi_access(wifi_ssid)
-        results['checks']['wifi'] = wifi_check
-        if not wifi_check['allowed']:
-            results['overall_access'] = False
-            results['reasons'].append(wifi_check['reason'])
-    else:
-        results['checks']['wifi'] = {
-            'allowed': False,
-            'reason': 'WiFi data not provided'
+    for attempt in attempts:
+        user, latitude, longitude, wifi_ssid = attempt[:4]
+        wifi_bssid = attempt[4] if len(attempt) > 4 else None
+        result = {
+            'overall_access': True,
+            'checks': {},
+            'reasons': []
         }
-        results['overall_access'] = False
-        results['reasons'].append('WiFi data not provided')
-    
-    # Check time
-    time_check = check_time_access()
-    results['checks']['time'] = time_check
-    if not time_check['allowed']:
-        results['overall_access'] = False
-        results['reasons'].append(time_check['reason'])
+        results.append(result)
+        
+        # Check if remote access is enabled
+        if user.is_remote_access_enabled and user.remote_access_expiry:
+            if now < user.remote_access_expiry:
+                result['checks']['remote_access'] = {
+                    'allowed': True,
+                    'reason': 'Remote access granted'
+                }
+                continue
+        
+        # Check location
+        if not policy.require_location:
+            result['checks']['location'] = {
+                'allowed': True,
+                'reason': 'Location not required'
+            }
+        elif latitude and longitude:
+            point = (float(latitude), float(longitude))
+            if point not in location_checks:
+                location_checks[point] = check_location_access(*point, policy=policy)
+            location_check = dict(location_checks[point])
+            result['checks']['location'] = location_check
+            if not location_check['allowed']:
+                result['overall_access'] = False
+                result['reasons'].append(location_check['reason'])
+        else:
+            result['checks']['location'] = {
+                'allowed': False,
+                'reason': 'Location data not provided'
+            }
+            result['overall_access'] = False
+            result['reasons'].append('Location data not provided')
+        
+        # Check WiFi
+        if not policy.require_wifi:
+            result['checks']['wifi'] = {
+                'allowed': True,
+                'reason': 'WiFi not required'
+            }
+        elif wifi_ssid:
+            network = (wifi_ssid, wifi_bssid)
+            if network not in wifi_checks:
+                wifi_checks[network] = check_wifi_access(wifi_ssid, wifi_bssid=wifi_bssid, policy=policy)
+            wifi_check = dict(wifi_checks[network])
+            result['checks']['wifi'] = wifi_check
+            if not wifi_check['allowed']:
+                result['overall_access'] = False
+                result['reasons'].append(wifi_check['reason'])
+        else:
+            result['checks']['wifi'] = {
+                'allowed': False,
+                'reason': 'WiFi data not provided'
+            }
+            result['overall_access'] = False
+            result['reasons'].append('WiFi data not provided')
+        
+        # Check time
+        if policy.require_time:
+            location_name = result['checks']['location'].get('location_name')
+            if location_name not in time_checks:
+                time_checks[location_name] = check_time_access(now, policy, location_name)
+            time_check = time_checks[location_name]
+            result['checks']['time'] = dict(time_check)
+            if not time_check['allowed']:
+                result['overall_access'] = False
+                result['reasons'].append(time_check['reason'])
+        else:
+            result['checks']['time'] = {
+                'allowed': True,
+                'reason': 'Work hours not required'
+            }
     
-    return results
\ No newline at end of file
+    return results
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geofencing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='allowedlocation',
+            name='boundary',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geofencing', '0002_allowedlocation_boundary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='allowedlocation',
+            name='time_zone',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geofencing', '0004_audit_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='useraccesslog',
+            index=models.Index(fields=['-access_time', '-id'], name='useraccesslog_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useraccesslog',
+            index=models.Index(fields=['user', '-access_time'], name='useraccesslog_user_time_idx'),
+        ),
+    ]
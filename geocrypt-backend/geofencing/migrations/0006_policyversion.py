@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:37
+
+from django.db import migrations, models
+
+
+def create_version_row(apps, schema_editor):
+    PolicyVersion = apps.get_model('geofencing', 'PolicyVersion')
+    PolicyVersion.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geofencing', '0005_audit_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PolicyVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+                ('wifi_version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_version_row, migrations.RunPython.noop),
+    ]
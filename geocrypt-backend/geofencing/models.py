@@ -3,6 +3,7 @@ from django.db import models
 # Create your models here.
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 
 class AllowedLocation(models.Model):
@@ -10,6 +11,10 @@ class AllowedLocation(models.Model):
     latitude = models.DecimalField(max_digits=9, decimal_places=6)
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
     radius_km = models.DecimalField(max_digits=5, decimal_places=2, default=0.1)
+    # GeoJSON Polygon/MultiPolygon; when set it replaces the radius_km circle
+    boundary = models.JSONField(null=True, blank=True)
+    # IANA time zone work hours are evaluated in here; blank means TIME_ZONE
+    time_zone = models.CharField(max_length=64, blank=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -45,6 +50,7 @@ class WorkHours(models.Model):
 
     day = models.IntegerField(choices=DAY_CHOICES)
     start_time = models.TimeField()
+    # An end_time at or before start_time is an overnight shift ending the next day
     end_time = models.TimeField()
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -67,9 +73,20 @@ class AccessRule(models.Model):
         return self.name
 
 
+class PolicyVersion(models.Model):
+    """
+    Shared version counters of the geofencing policy (a single row).
+
+    Every process compares them with its compiled snapshot, so a change made
+    in one worker reaches the others without a shared cache.
+    """
+    version = models.BigIntegerField(default=0)
+    wifi_version = models.BigIntegerField(default=0)
+
+
 class UserAccessLog(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    access_time = models.DateTimeField(auto_now_add=True)
+    access_time = models.DateTimeField(default=timezone.now)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     ip_address = models.GenericIPAddressField()
@@ -80,4 +97,8 @@ class UserAccessLog(models.Model):
     is_suspicious = models.BooleanField(default=False)
 
     class Meta:
-        ordering = ['-access_time']
\ No newline at end of file
+        ordering = ['-access_time']
+        indexes = [
+            models.Index(fields=['-access_time', '-id'], name='useraccesslog_time_idx'),
+            models.Index(fields=['user', '-access_time'], name='useraccesslog_user_time_idx'),
+        ]
\ No newline at end of file
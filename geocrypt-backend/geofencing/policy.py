@@ -0,0 +1,244 @@
+import itertools
+import threading
+import time as monotonic_time
+from datetime import time
+from zoneinfo import ZoneInfo
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import AccessRule, AllowedLocation, AllowedWifi, PolicyVersion, WorkHours
+from .distance import FenceArrays
+from .schedule import WeeklySchedule
+from .spatial import DEFAULT_GEOHASH_PRECISION, GeofenceIndex
+from .wifi import WifiIndex
+
+
+# The shared counters live in the single PolicyVersion row
+POLICY_VERSION_ID = 1
+
+# Distinguishes snapshots built in this process, even with an unchanged
+# shared version (e.g. after reset_policy)
+_generations = itertools.count(1)
+
+
+class PolicySnapshot:
+    """
+    Compiled, read-only view of the geofencing tables.
+
+    Built in a handful of queries and then answers every check from memory:
+    a geohash index over the fences, an SSID/BSSID hash index and a
+    compiled weekly work-hours schedule. Work hours are local to the time
+    zone of the location the user is at (TIME_ZONE by default). Tables with no active rows fall back to the
+    ALLOWED_LOCATIONS and WORK_HOURS_START/END settings.
+
+    WiFi rows change far more often than the rest, so the WiFi index carries
+    its own version and is reloaded or patched on its own.
+    """
+
+    def __init__(self, version, locations, schedule, rule, wifi, from_settings=False):
+        self.version = version
+        self.generation = next(_generations)
+        self.locations = locations
+        self.from_settings = from_settings
+        precision = getattr(settings, 'GEOFENCE_GEOHASH_PRECISION', DEFAULT_GEOHASH_PRECISION)
+        self.fences = GeofenceIndex(locations, precision)
+        self.fence_arrays = FenceArrays(self.fences.fences)
+        self.wifi = wifi
+        self.schedule = schedule
+        self.time_zones = {
+            location['name']: ZoneInfo(location['time_zone'])
+            for location in locations if location.get('time_zone')
+        }
+        self.require_location = rule.require_location if rule else True
+        self.require_wifi = rule.require_wifi if rule else True
+        self.require_time = rule.require_time if rule else True
+
+    @classmethod
+    def load(cls, version, wifi_version):
+        locations = [
+            {
+                'name': location.name,
+                'latitude': float(location.latitude),
+                'longitude': float(location.longitude),
+                'radius_km': float(location.radius_km),
+                'boundary': location.boundary,
+                'time_zone': location.time_zone,
+            }
+            for location in AllowedLocation.objects.filter(is_active=True).order_by('name', 'id')
+        ]
+        from_settings = not locations
+        if from_settings:
+            locations = settings.ALLOWED_LOCATIONS
+        wifi = load_wifi_index(wifi_version, locations if from_settings else None)
+
+        windows = list(
+            WorkHours.objects.filter(is_active=True).values_list('day', 'start_time', 'end_time')
+        )
+        if not windows:
+            work_start = getattr(settings, 'WORK_HOURS_START', 9)
+            work_end = getattr(settings, 'WORK_HOURS_END', 17)
+            end = time(work_end) if work_end < 24 else time.max
+            windows = [(day, time(work_start), end) for day in range(7)]
+
+        rule = AccessRule.objects.filter(is_default=True).order_by('-created_at').first()
+        return cls(version, locations, WeeklySchedule(windows), rule, wifi, from_settings)
+
+    def time_zone_for(self, location_name=None):
+        """Time zone work hours are evaluated in at a location"""
+        return self.time_zones.get(location_name) or timezone.get_default_timezone()
+
+    def local_time(self, now, location_name=None):
+        return timezone.localtime(now, self.time_zone_for(location_name))
+
+    @property
+    def cache_key(self):
+        """Changes whenever any part of this process's policy changes"""
+        return (self.generation, self.wifi.version)
+
+    def seconds_until_change(self, now, location_name=None):
+        """
+        Seconds until the work-hours answer at a location can change, or
+        None if it never does
+        """
+        return self.schedule.seconds_until_change(self.local_time(now, location_name))
+
+
+def wifi_row_key(wifi):
+    return ('db', wifi.pk)
+
+
+def load_wifi_index(version, settings_locations=None):
+    """Build the WiFi index from the AllowedWifi table (or the settings fallback)"""
+    if settings_locations is not None:
+        return WifiIndex.from_locations(settings_locations, version)
+    index = WifiIndex(version)
+    rows = AllowedWifi.objects.filter(is_active=True, location__is_active=True).select_related('location')
+    for wifi in rows:
+        index.add(wifi_row_key(wifi), wifi.ssid, wifi.bssid, wifi.location.name)
+    return index
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_checked_at = None
+_local_changes = 0
+
+
+def get_policy_versions():
+    """
+    Shared (policy version, WiFi version); bumped whenever a geofencing
+    table changes
+    """
+    versions = (PolicyVersion.objects.filter(pk=POLICY_VERSION_ID)
+                .values_list('version', 'wifi_version').first())
+    return versions or (0, 0)
+
+
+def _incr_version(field):
+    """Atomically bump one of the shared counters and return its new value"""
+    counter = PolicyVersion.objects.filter(pk=POLICY_VERSION_ID)
+    with transaction.atomic():
+        if not counter.update(**{field: F(field) + 1}):
+            PolicyVersion.objects.get_or_create(pk=POLICY_VERSION_ID)
+            counter.update(**{field: F(field) + 1})
+        return counter.values_list(field, flat=True).get()
+
+
+def bump_policy_version():
+    """Invalidate compiled policy snapshots in this and every other process"""
+    global _checked_at, _local_changes
+    _incr_version('version')
+    # Make the next check in this process re-read the version
+    _local_changes += 1
+    _checked_at = None
+
+
+def apply_wifi_change(key, row=None):
+    """
+    Patch a committed AllowedWifi change into this process's WiFi index and
+    tell other processes to reload theirs.
+
+    `row` is the new (ssid, bssid, location name), or None when the row was
+    deleted or deactivated. Only that one entry is touched here; if this
+    process had missed an earlier change it reloads the WiFi table instead.
+    """
+    global _checked_at, _local_changes
+    version = _incr_version('wifi_version')
+    _local_changes += 1
+    with _snapshot_lock:
+        snapshot = _snapshot
+        if snapshot is None or snapshot.from_settings or snapshot.wifi.version != version - 1:
+            _checked_at = None
+            return
+        if row is None:
+            snapshot.wifi.remove(key)
+        else:
+            snapshot.wifi.add(key, *row)
+        snapshot.wifi.version = version
+
+
+def _fresh_snapshot():
+    """The snapshot if it was checked recently enough to use without I/O"""
+    snapshot = _snapshot
+    checked_at = _checked_at
+    refresh = getattr(settings, 'GEOFENCE_POLICY_REFRESH_SECONDS', 5)
+    if (snapshot is not None and checked_at is not None
+            and monotonic_time.monotonic() - checked_at < refresh):
+        return snapshot
+    return None
+
+
+def get_policy(refresh=False):
+    """
+    Return the current PolicySnapshot.
+
+    The shared versions in the PolicyVersion row are polled at most every
+    GEOFENCE_POLICY_REFRESH_SECONDS, so the hot path normally costs no
+    database round trip. Changes made in this process are picked up on the
+    next check and other processes see them within the refresh interval.
+    `refresh` polls the versions now.
+    """
+    global _snapshot, _checked_at
+    snapshot = None if refresh else _fresh_snapshot()
+    if snapshot is not None:
+        return snapshot
+
+    snapshot = _snapshot
+    now = monotonic_time.monotonic()
+    changes = _local_changes
+    version, wifi_version = get_policy_versions()
+    if snapshot is None or snapshot.version != version or snapshot.wifi.version != wifi_version:
+        with _snapshot_lock:
+            if _snapshot is None or _snapshot.version != version:
+                _snapshot = PolicySnapshot.load(version, wifi_version)
+            elif _snapshot.wifi.version != wifi_version:
+                settings_locations = _snapshot.locations if _snapshot.from_settings else None
+                _snapshot.wifi = load_wifi_index(wifi_version, settings_locations)
+            snapshot = _snapshot
+    if changes == _local_changes:
+        # Otherwise a change landed while loading; re-check next time
+        _checked_at = now
+    return snapshot
+
+
+async def aget_policy():
+    """
+    Async get_policy: answered in memory on the hot path, and only hands
+    the database check to a worker thread when a refresh is due
+    """
+    snapshot = _fresh_snapshot()
+    if snapshot is None:
+        snapshot = await sync_to_async(get_policy)()
+    return snapshot
+
+
+def reset_policy():
+    """Drop the compiled snapshot so the next check rebuilds it"""
+    global _snapshot, _checked_at
+    with _snapshot_lock:
+        _snapshot = None
+        _checked_at = None
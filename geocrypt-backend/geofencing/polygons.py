@@ -0,0 +1,155 @@
+import numpy as np
+
+
+# Polygon fences are GeoJSON Polygon or MultiPolygon geometries with
+# [longitude, latitude] positions. Campus-sized shapes are small enough that
+# point-in-polygon is done in the plane of those coordinates.
+MAX_BANDS = 1024
+
+
+def parse_boundary(geometry):
+    """
+    Validate a GeoJSON Polygon/MultiPolygon and return it as a list of
+    polygons, each a list of rings of (longitude, latitude) tuples.
+
+    Raises ValueError describing the first problem found.
+    """
+    if not isinstance(geometry, dict):
+        raise ValueError('Boundary must be a GeoJSON object')
+    kind = geometry.get('type')
+    coordinates = geometry.get('coordinates')
+    if kind == 'Polygon':
+        polygons = [coordinates]
+    elif kind == 'MultiPolygon':
+        polygons = coordinates
+    else:
+        raise ValueError('Boundary must be a GeoJSON Polygon or MultiPolygon')
+    if not isinstance(polygons, list) or not polygons:
+        raise ValueError('Boundary has no polygons')
+
+    parsed = []
+    for polygon in polygons:
+        if not isinstance(polygon, list) or not polygon:
+            raise ValueError('Each polygon needs at least an outer ring')
+        rings = []
+        for ring in polygon:
+            try:
+                points = [(float(position[0]), float(position[1])) for position in ring]
+            except (TypeError, ValueError, IndexError):
+                raise ValueError('Ring positions must be [longitude, latitude] pairs')
+            if len(points) < 4 or points[0] != points[-1]:
+                raise ValueError('Rings must be closed and have at least 4 positions')
+            for longitude, latitude in points:
+                if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
+                    raise ValueError('Ring position out of range')
+            longitudes = [longitude for longitude, _ in points]
+            if max(longitudes) - min(longitudes) > 180:
+                raise ValueError('Polygons crossing the antimeridian are not supported')
+            rings.append(points)
+        parsed.append(rings)
+    return parsed
+
+
+def segment_hits_rect(x1, y1, x2, y2, min_x, min_y, max_x, max_y):
+    """Liang-Barsky test of whether a segment touches an axis-aligned rectangle"""
+    dx, dy = x2 - x1, y2 - y1
+    t0, t1 = 0.0, 1.0
+    for p, q in ((-dx, x1 - min_x), (dx, max_x - x1), (-dy, y1 - min_y), (dy, max_y - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+            continue
+        t = q / p
+        if p < 0:
+            if t > t1:
+                return False
+            t0 = max(t0, t)
+        else:
+            if t < t0:
+                return False
+            t1 = min(t1, t)
+    return True
+
+
+class IndexedPolygon:
+    """
+    A polygon (outer ring plus holes) with an edge index for fast lookups.
+
+    Edges are bucketed into horizontal bands of latitude, so a ray-casting
+    test only visits the handful of edges in the point's band instead of
+    every edge of the outline.
+    """
+
+    def __init__(self, rings):
+        # Horizontal edges never cross a horizontal ray, but they still
+        # matter when checking whether the outline passes through an area
+        edges = []
+        for ring in rings:
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+                edges.append((x1, y1, x2, y2))
+        points = [point for ring in rings for point in ring]
+        self.min_lon = min(x for x, _ in points)
+        self.max_lon = max(x for x, _ in points)
+        self.min_lat = min(y for _, y in points)
+        self.max_lat = max(y for _, y in points)
+        self.edges = edges
+        self.edge_array = np.array(
+            [edge for edge in edges if edge[1] != edge[3]], dtype=np.float64
+        ).reshape(-1, 4)
+
+        self.band_count = max(1, min(len(edges), MAX_BANDS))
+        self.band_height = (self.max_lat - self.min_lat) / self.band_count or 1.0
+        self.bands = [[] for _ in range(self.band_count)]
+        for edge in edges:
+            first = self._band(min(edge[1], edge[3]))
+            last = self._band(max(edge[1], edge[3]))
+            for band in range(first, last + 1):
+                self.bands[band].append(edge)
+
+    def _band(self, latitude):
+        band = int((latitude - self.min_lat) / self.band_height)
+        return min(max(band, 0), self.band_count - 1)
+
+    def contains(self, latitude, longitude):
+        if not (self.min_lat <= latitude <= self.max_lat
+                and self.min_lon <= longitude <= self.max_lon):
+            return False
+        inside = False
+        for x1, y1, x2, y2 in self.bands[self._band(latitude)]:
+            if (y1 > latitude) != (y2 > latitude):
+                if longitude < x1 + (latitude - y1) * (x2 - x1) / (y2 - y1):
+                    inside = not inside
+        return inside
+
+    def crosses_rect(self, min_lat, min_lon, max_lat, max_lon):
+        """Whether the outline passes through a lat/lon rectangle"""
+        if (max_lat < self.min_lat or min_lat > self.max_lat
+                or max_lon < self.min_lon or min_lon > self.max_lon):
+            return False
+        seen = set()
+        for band in range(self._band(min_lat), self._band(max_lat) + 1):
+            for edge in self.bands[band]:
+                if edge in seen:
+                    continue
+                seen.add(edge)
+                if segment_hits_rect(*edge, min_lon, min_lat, max_lon, max_lat):
+                    return True
+        return False
+
+    def contains_many(self, latitudes, longitudes):
+        """Vectorized `contains` over NumPy arrays of points"""
+        inside = np.zeros(len(latitudes), dtype=bool)
+        candidates = np.nonzero(
+            (latitudes >= self.min_lat) & (latitudes <= self.max_lat)
+            & (longitudes >= self.min_lon) & (longitudes <= self.max_lon)
+        )[0]
+        if not len(candidates):
+            return inside
+        y = latitudes[candidates]
+        x = longitudes[candidates]
+        crossings = np.zeros(len(candidates), dtype=bool)
+        for x1, y1, x2, y2 in self.edge_array:
+            spans = (y1 > y) != (y2 > y)
+            crossings ^= spans & (x < x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+        inside[candidates] = crossings
+        return inside
@@ -0,0 +1,112 @@
+from bisect import bisect_right
+from datetime import datetime, time, timedelta
+
+DAY_SECONDS = 24 * 60 * 60
+WEEK_SECONDS = 7 * DAY_SECONDS
+
+
+def _seconds(value):
+    """Seconds since midnight of a time of day; time.max means end of day"""
+    if value == time.max:
+        return DAY_SECONDS
+    return value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1e6
+
+
+class WeeklySchedule:
+    """
+    Work hours compiled into sorted, merged intervals over one week.
+
+    Windows are (weekday, start_time, end_time) in local wall-clock time.
+    A window whose end is not after its start is an overnight shift that
+    ends on the following day (Sunday night wraps to Monday). Lookups
+    bisect the interval starts, so they cost O(log n) in the number of
+    windows; callers pass datetimes already converted to the local time
+    zone of the schedule.
+    """
+
+    def __init__(self, windows):
+        self.windows = {}
+        intervals = []
+        for day, start, end in windows:
+            self.windows.setdefault(day, []).append((start, end))
+            begin = day * DAY_SECONDS + _seconds(start)
+            finish = day * DAY_SECONDS + _seconds(end)
+            if finish <= begin:
+                finish += DAY_SECONDS
+            if finish > WEEK_SECONDS:
+                intervals.append((begin, WEEK_SECONDS))
+                intervals.append((0, finish - WEEK_SECONDS))
+            else:
+                intervals.append((begin, finish))
+        for day_windows in self.windows.values():
+            day_windows.sort()
+
+        merged = []
+        for begin, finish in sorted(intervals):
+            if merged and begin <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], finish)
+            else:
+                merged.append([begin, finish])
+        self.starts = [begin for begin, _ in merged]
+        self.ends = [finish for _, finish in merged]
+        self.always_open = merged == [[0, WEEK_SECONDS]]
+
+    def windows_for(self, weekday):
+        """The configured windows starting on a weekday, in start order"""
+        return self.windows.get(weekday, [])
+
+    @staticmethod
+    def _offset(now):
+        return now.weekday() * DAY_SECONDS + _seconds(now.time())
+
+    @staticmethod
+    def _at(now, offset):
+        """Local datetime `offset` seconds after the start of now's week"""
+        week_start = datetime.combine(now.date() - timedelta(days=now.weekday()), time.min,
+                                      tzinfo=now.tzinfo)
+        return week_start + timedelta(seconds=offset)
+
+    def _index(self, offset):
+        """Index of the interval containing offset, or -1"""
+        index = bisect_right(self.starts, offset) - 1
+        if index >= 0 and offset < self.ends[index]:
+            return index
+        return -1
+
+    def is_open(self, now):
+        return self._index(self._offset(now)) >= 0
+
+    def next_change(self, now):
+        """
+        When the answer of `is_open` next changes: the end of the current
+        window, or the start of the next one. None if it never changes.
+        """
+        if not self.starts or self.always_open:
+            return None
+        offset = self._offset(now)
+        index = self._index(offset)
+        if index >= 0:
+            change = self.ends[index]
+            if change == WEEK_SECONDS and self.starts[0] == 0:
+                # Runs on past the end of the week into Monday's window
+                change += self.ends[0]
+        else:
+            following = bisect_right(self.starts, offset)
+            if following < len(self.starts):
+                change = self.starts[following]
+            else:
+                change = WEEK_SECONDS + self.starts[0]
+        return self._at(now, change)
+
+    def window_end(self, now):
+        """End of the window containing now, or None if closed or always open"""
+        if not self.is_open(now):
+            return None
+        return self.next_change(now)
+
+    def seconds_until_change(self, now):
+        """Seconds until `next_change`, or None if the answer never changes"""
+        change = self.next_change(now)
+        if change is None:
+            return None
+        return change.timestamp() - now.timestamp()
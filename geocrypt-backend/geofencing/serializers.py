@@ -1,11 +1,32 @@
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
 from rest_framework import serializers
 from .models import AllowedLocation, AllowedWifi, WorkHours, AccessRule, UserAccessLog
+from .polygons import parse_boundary
 
 
 class AllowedLocationSerializer(serializers.ModelSerializer):
     class Meta:
         model = AllowedLocation
-        fields = ['id', 'name', 'latitude', 'longitude', 'radius_km', 'is_active']
+        fields = ['id', 'name', 'latitude', 'longitude', 'radius_km', 'boundary', 'time_zone',
+                  'is_active']
+
+    def validate_boundary(self, value):
+        if value is None:
+            return value
+        try:
+            parse_boundary(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def validate_time_zone(self, value):
+        if value:
+            try:
+                ZoneInfo(value)
+            except (ZoneInfoNotFoundError, ValueError):
+                raise serializers.ValidationError(f'Unknown time zone: {value}')
+        return value
 
 
 class AllowedWifiSerializer(serializers.ModelSerializer):
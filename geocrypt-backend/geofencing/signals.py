@@ -0,0 +1,44 @@
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import AccessRule, AllowedLocation, AllowedWifi, WorkHours
+from .policy import apply_wifi_change, bump_policy_version, reset_policy, wifi_row_key
+
+POLICY_MODELS = (AllowedLocation, WorkHours, AccessRule)
+POLICY_SETTINGS = {
+    'ALLOWED_LOCATIONS', 'WORK_HOURS_START', 'WORK_HOURS_END',
+    'GEOFENCE_GEOHASH_PRECISION',
+}
+
+
+def policy_changed(sender, **kwargs):
+    """Recompile the geofencing policy once the change is committed"""
+    transaction.on_commit(bump_policy_version)
+
+
+for model in POLICY_MODELS:
+    post_save.connect(policy_changed, sender=model, dispatch_uid=f'policy-save-{model.__name__}')
+    post_delete.connect(policy_changed, sender=model, dispatch_uid=f'policy-delete-{model.__name__}')
+
+
+@receiver(post_save, sender=AllowedWifi)
+def wifi_saved(sender, instance, **kwargs):
+    row = None
+    if instance.is_active and instance.location.is_active:
+        row = (instance.ssid, instance.bssid, instance.location.name)
+    key = wifi_row_key(instance)
+    transaction.on_commit(lambda: apply_wifi_change(key, row))
+
+
+@receiver(post_delete, sender=AllowedWifi)
+def wifi_deleted(sender, instance, **kwargs):
+    key = wifi_row_key(instance)
+    transaction.on_commit(lambda: apply_wifi_change(key))
+
+
+@receiver(setting_changed)
+def policy_setting_changed(sender, setting, **kwargs):
+    if setting in POLICY_SETTINGS:
+        reset_policy()
@@ -0,0 +1,262 @@
+import math
+
+from geopy.distance import geodesic
+
+from .polygons import IndexedPolygon, parse_boundary
+
+
+EARTH_RADIUS_KM = 6371.0088
+# Haversine on a sphere differs from the WGS-84 geodesic by at most ~0.56%;
+# only candidates within this margin of a fence edge need the exact solve
+HAVERSINE_MARGIN = 0.006
+# Shortest length of one degree of latitude (at the equator), in km
+KM_PER_DEGREE_LAT = 110.57
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+DEFAULT_GEOHASH_PRECISION = 5  # cells of roughly 4.9 km x 4.9 km
+MAX_CELLS_PER_FENCE = 256
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between two points on a spherical Earth"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def geohash_cell_size(precision):
+    """(lat degrees, lon degrees) covered by one geohash cell"""
+    bits = 5 * precision
+    return 180.0 / (1 << (bits // 2)), 360.0 / (1 << (bits - bits // 2))
+
+
+def geohash_cell(latitude, longitude, precision):
+    """Integer (row, column) of the geohash cell containing a point"""
+    lat_size, lon_size = geohash_cell_size(precision)
+    rows, columns = round(180.0 / lat_size), round(360.0 / lon_size)
+    row = min(int((latitude + 90.0) / lat_size), rows - 1)
+    column = min(int((longitude + 180.0) / lon_size), columns - 1)
+    return row, column
+
+
+def cell_to_geohash(row, column, precision):
+    """Encode a (row, column) geohash cell as its base32 string"""
+    bits = 5 * precision
+    lat_bits, lon_bits = bits // 2, bits - bits // 2
+    value = 0
+    for i in range(bits):
+        # Geohash interleaves bits starting with longitude
+        if i % 2 == 0:
+            bit = (column >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (row >> (lat_bits - 1 - i // 2)) & 1
+        value = (value << 1) | bit
+    return ''.join(
+        GEOHASH_ALPHABET[(value >> (5 * (precision - 1 - i))) & 31]
+        for i in range(precision)
+    )
+
+
+def encode_geohash(latitude, longitude, precision=DEFAULT_GEOHASH_PRECISION):
+    """Standard geohash string of a point"""
+    return cell_to_geohash(*geohash_cell(latitude, longitude, precision), precision)
+
+
+class Fence:
+    """A circular allowed area with a precomputed bounding box"""
+
+    def __init__(self, order, location):
+        self.order = order
+        self.location = location
+        self.name = location['name']
+        self.latitude = float(location['latitude'])
+        self.longitude = float(location['longitude'])
+        self.radius_km = float(location['radius_km'])
+
+        # Conservative bounding box: pad by the haversine margin so no point
+        # the geodesic would accept is rejected by the prefilter
+        reach_km = self.radius_km * (1 + HAVERSINE_MARGIN)
+        lat_delta = reach_km / KM_PER_DEGREE_LAT
+        self.min_lat = max(self.latitude - lat_delta, -90.0)
+        self.max_lat = min(self.latitude + lat_delta, 90.0)
+        widest = max(abs(self.min_lat), abs(self.max_lat))
+        if widest >= 89.9:
+            lon_delta = 180.0
+        else:
+            lon_delta = min(lat_delta / math.cos(math.radians(widest)), 180.0)
+        self.min_lon = self.longitude - lon_delta
+        self.max_lon = self.longitude + lon_delta
+        self.wraps = lon_delta >= 180.0 or self.min_lon < -180.0 or self.max_lon > 180.0
+
+    def in_bounding_box(self, latitude, longitude):
+        if not self.min_lat <= latitude <= self.max_lat:
+            return False
+        if self.wraps:
+            return True
+        return self.min_lon <= longitude <= self.max_lon
+
+    def distance_km(self, latitude, longitude):
+        """
+        Return (distance, exact) for a point, or None if it is clearly outside.
+
+        The haversine distance decides points well inside or outside the
+        fence; only points within the error margin of the edge pay for the
+        exact geodesic.
+        """
+        approximate = haversine_km(latitude, longitude, self.latitude, self.longitude)
+        if approximate > self.radius_km * (1 + HAVERSINE_MARGIN):
+            return None
+        if approximate < self.radius_km * (1 - HAVERSINE_MARGIN):
+            return approximate, False
+        exact = geodesic((latitude, longitude), (self.latitude, self.longitude)).kilometers
+        if exact > self.radius_km:
+            return None
+        return exact, True
+
+    def rect_relation(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        'inside' or 'outside' if the whole rectangle is on one side of the
+        fence edge (beyond the haversine margin), else None
+        """
+        corners = [(min_lat, min_lon), (min_lat, max_lon), (max_lat, min_lon), (max_lat, max_lon)]
+        if all(haversine_km(lat, lon, self.latitude, self.longitude)
+               < self.radius_km * (1 - HAVERSINE_MARGIN) for lat, lon in corners):
+            return 'inside'
+        nearest_lat = min(max(self.latitude, min_lat), max_lat)
+        nearest_lon = min(max(self.longitude, min_lon), max_lon)
+        # Nearest point by clamping is exact in latitude and a slight
+        # underestimate in longitude, so the margin keeps this conservative
+        nearest = haversine_km(nearest_lat, nearest_lon, self.latitude, self.longitude)
+        if nearest > self.radius_km * (1 + 2 * HAVERSINE_MARGIN):
+            return 'outside'
+        return None
+
+
+class PolygonFence:
+    """
+    A polygon or multipolygon allowed area (see polygons.parse_boundary).
+
+    The location's latitude/longitude is kept as its reference point, and
+    reported distances are measured to it.
+    """
+
+    wraps = False
+
+    def __init__(self, order, location):
+        self.order = order
+        self.location = location
+        self.name = location['name']
+        self.latitude = float(location['latitude'])
+        self.longitude = float(location['longitude'])
+        self.radius_km = None
+        self.polygons = [IndexedPolygon(rings) for rings in parse_boundary(location['boundary'])]
+        self.min_lat = min(polygon.min_lat for polygon in self.polygons)
+        self.max_lat = max(polygon.max_lat for polygon in self.polygons)
+        self.min_lon = min(polygon.min_lon for polygon in self.polygons)
+        self.max_lon = max(polygon.max_lon for polygon in self.polygons)
+
+    def in_bounding_box(self, latitude, longitude):
+        return (self.min_lat <= latitude <= self.max_lat
+                and self.min_lon <= longitude <= self.max_lon)
+
+    def contains(self, latitude, longitude):
+        return any(polygon.contains(latitude, longitude) for polygon in self.polygons)
+
+    def distance_km(self, latitude, longitude):
+        """Return (distance to the reference point, exact) if inside, else None"""
+        if not self.contains(latitude, longitude):
+            return None
+        return haversine_km(latitude, longitude, self.latitude, self.longitude), False
+
+    def rect_relation(self, min_lat, min_lon, max_lat, max_lon):
+        """'inside' or 'outside' if no outline crosses the rectangle, else None"""
+        if any(polygon.crosses_rect(min_lat, min_lon, max_lat, max_lon) for polygon in self.polygons):
+            return None
+        inside = self.contains((min_lat + max_lat) / 2, (min_lon + max_lon) / 2)
+        return 'inside' if inside else 'outside'
+
+
+def make_fence(order, location):
+    """Build the fence for a location dict: a polygon if it has a boundary"""
+    if location.get('boundary'):
+        return PolygonFence(order, location)
+    return Fence(order, location)
+
+
+class GeofenceIndex:
+    """
+    Geohash-bucketed index over allowed locations.
+
+    Every fence is registered in each geohash cell its bounding box
+    overlaps, so a lookup reads one bucket instead of scanning all fences.
+    Fences too large to bucket at the chosen precision are kept in a short
+    list that is always checked. Matches keep the configured order of the
+    locations, so the first matching location wins as before.
+    """
+
+    def __init__(self, locations, precision=DEFAULT_GEOHASH_PRECISION):
+        self.precision = precision
+        self.fences = [make_fence(order, location) for order, location in enumerate(locations)]
+        self.buckets = {}
+        self.wide_fences = []
+        for fence in self.fences:
+            cells = self._cells_for(fence)
+            if cells is None:
+                self.wide_fences.append(fence)
+                continue
+            for cell in cells:
+                self.buckets.setdefault(cell, []).append(fence)
+
+    def _cells_for(self, fence):
+        if fence.wraps:
+            return None
+        min_row, min_column = geohash_cell(fence.min_lat, fence.min_lon, self.precision)
+        max_row, max_column = geohash_cell(fence.max_lat, fence.max_lon, self.precision)
+        if (max_row - min_row + 1) * (max_column - min_column + 1) > MAX_CELLS_PER_FENCE:
+            return None
+        return [
+            (row, column)
+            for row in range(min_row, max_row + 1)
+            for column in range(min_column, max_column + 1)
+        ]
+
+    def candidates(self, latitude, longitude):
+        """Fences whose bounding box contains the point, in configured order"""
+        cell = geohash_cell(latitude, longitude, self.precision)
+        nearby = self.buckets.get(cell, [])
+        if self.wide_fences:
+            nearby = sorted(nearby + self.wide_fences, key=lambda fence: fence.order)
+        return [fence for fence in nearby if fence.in_bounding_box(latitude, longitude)]
+
+    def cell_is_uniform(self, row, column, precision):
+        """
+        Whether every point of a geohash cell gets the same answer from
+        `locate`, i.e. no fence edge runs through the cell
+        """
+        lat_size, lon_size = geohash_cell_size(precision)
+        min_lat = row * lat_size - 90.0
+        min_lon = column * lon_size - 180.0
+        max_lat, max_lon = min_lat + lat_size, min_lon + lon_size
+        fences = set(self.wide_fences)
+        min_row, min_column = geohash_cell(min_lat, min_lon, self.precision)
+        max_row, max_column = geohash_cell(max_lat, max_lon, self.precision)
+        for bucket_row in range(min_row, max_row + 1):
+            for bucket_column in range(min_column, max_column + 1):
+                fences.update(self.buckets.get((bucket_row, bucket_column), ()))
+        for fence in sorted(fences, key=lambda fence: fence.order):
+            relation = fence.rect_relation(min_lat, min_lon, max_lat, max_lon)
+            if relation is None:
+                return False
+            if relation == 'inside':
+                # Earlier fences are uniformly outside, so this one decides
+                return True
+        return True
+
+    def locate(self, latitude, longitude):
+        """Return (fence, distance_km) for the first fence containing the point"""
+        for fence in self.candidates(latitude, longitude):
+            result = fence.distance_km(latitude, longitude)
+            if result is not None:
+                return fence, result[0]
+        return None, None
@@ -1,3 +1,737 @@
-from django.test import TestCase
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase
 
 # Create your tests here.
+from django.db.models import F
+import math
+from datetime import datetime, time
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from django.conf import settings
+from geopy.distance import geodesic
+from django.test import override_settings
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import User
+
+from .distance import FenceArrays, locate_many
+from .decisions import DecisionCache, decision_key, get_decision_cache
+from .polygons import IndexedPolygon, parse_boundary
+from .grants import mint_grant, verify_grant
+from .location_utils import check_time_access, check_wifi_access, validate_access_conditions, validate_access_conditions_many
+from .models import AllowedLocation, AllowedWifi, PolicyVersion, UserAccessLog, WorkHours
+from .policy import get_policy, reset_policy
+from .schedule import WeeklySchedule
+from .spatial import GeofenceIndex, geohash_cell, geohash_cell_size
+from .wifi import WifiIndex
+
+
+class PolicyVersionTests(TestCase):
+    """Policy changes reach every process through the shared version row"""
+
+    def setUp(self):
+        reset_policy()
+        self.addCleanup(reset_policy)
+
+    def test_change_from_another_process(self):
+        with override_settings(GEOFENCE_POLICY_REFRESH_SECONDS=0):
+            before = get_policy()
+            # What another worker's commit leaves behind: new rows and a
+            # bumped counter, with nothing in this process's cache
+            AllowedLocation.objects.bulk_create([
+                AllowedLocation(name='Branch', latitude=10, longitude=76, radius_km=1),
+            ])
+            PolicyVersion.objects.filter(pk=1).update(version=F('version') + 1)
+            after = get_policy()
+        self.assertNotEqual(after.version, before.version)
+        self.assertEqual([location['name'] for location in after.locations], ['Branch'])
+
+    def test_change_in_this_process(self):
+        before = get_policy()
+        with self.captureOnCommitCallbacks(execute=True):
+            AllowedLocation.objects.create(name='Branch', latitude=10, longitude=76, radius_km=1)
+        self.assertEqual(PolicyVersion.objects.get(pk=1).version, before.version + 1)
+        self.assertEqual([location['name'] for location in get_policy().locations], ['Branch'])
+
+    def test_polling_is_bounded(self):
+        with override_settings(GEOFENCE_POLICY_REFRESH_SECONDS=60):
+            snapshot = get_policy()
+            PolicyVersion.objects.filter(pk=1).update(version=F('version') + 1)
+            with self.assertNumQueries(0):
+                self.assertIs(get_policy(), snapshot)
+            self.assertIsNot(get_policy(refresh=True), snapshot)
+
+
+class WifiIndexTests(SimpleTestCase):
+    """SSID-only clients match every row; reported BSSIDs must match pinned rows"""
+
+    def setUp(self):
+        self.index = WifiIndex()
+        self.index.add('open', 'Guest', '', 'Office')
+        self.index.add('pinned', 'Corp', 'AA-BB-CC-DD-EE-01', 'Office')
+        self.index.add('branch', 'Corp', '', 'Branch')
+
+    def test_ssid_only(self):
+        self.assertEqual(self.index.locations_for('Guest'), ['Office'])
+        self.assertEqual(sorted(self.index.locations_for('Corp')), ['Branch', 'Office'])
+        self.assertEqual(self.index.locations_for('Corp', ''), self.index.locations_for('Corp'))
+        self.assertEqual(self.index.locations_for('Unknown'), [])
+
+    def test_ssid_and_bssid(self):
+        self.assertEqual(self.index.locations_for('Corp', 'aa:bb:cc:dd:ee:01'), ['Office'])
+        # Pinned to another AP: only the unpinned Branch row still matches
+        self.assertEqual(self.index.locations_for('Corp', 'aa:bb:cc:dd:ee:99'), ['Branch'])
+        self.assertEqual(self.index.locations_for('Guest', 'aa:bb:cc:dd:ee:99'), ['Office'])
+        self.assertEqual(self.index.locations_for('Other', 'aa:bb:cc:dd:ee:01'), [])
+
+    def test_remove(self):
+        self.index.remove('pinned')
+        self.assertEqual(self.index.locations_for('Corp'), ['Branch'])
+        self.assertEqual(self.index.locations_for('Corp', 'aa:bb:cc:dd:ee:01'), ['Branch'])
+        self.index.remove('branch')
+        self.assertEqual(self.index.locations_for('Corp'), [])
+        self.assertEqual(self.index.pinned_ssid_locations, {})
+
+
+class WifiAccessTests(TestCase):
+    """check_wifi_access against WiFi rows configured in the database"""
+
+    @classmethod
+    def setUpTestData(cls):
+        office = AllowedLocation.objects.create(name='Office', latitude=9.35, longitude=76.67, radius_km=1)
+        AllowedWifi.objects.create(location=office, ssid='Corp', bssid='AA:BB:CC:DD:EE:01')
+
+    def setUp(self):
+        reset_policy()
+        self.addCleanup(reset_policy)
+
+    def test_ssid_only_client(self):
+        self.assertTrue(check_wifi_access('Corp')['allowed'])
+        self.assertEqual(check_wifi_access('Corp', location_name='Office')['location_name'], 'Office')
+        self.assertFalse(check_wifi_access('Guest')['allowed'])
+
+    def test_ssid_and_bssid_client(self):
+        self.assertTrue(check_wifi_access('Corp', wifi_bssid='aa-bb-cc-dd-ee-01')['allowed'])
+        self.assertFalse(check_wifi_access('Corp', wifi_bssid='aa:bb:cc:dd:ee:02')['allowed'])
+
+
+class BatchValidateAccessTests(TestCase):
+    """Malformed attempts are reported per item, never as a server error"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pw',
+                                             employee_id='ADMIN', is_staff=True)
+        cls.user = User.objects.create_user(email='user@example.com', password='pw', employee_id='EMP1')
+
+    def setUp(self):
+        reset_policy()
+        self.addCleanup(reset_policy)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = reverse('validate-access-batch')
+
+    def post(self, attempts):
+        return self.client.post(self.url, {'attempts': attempts}, format='json')
+
+    def test_per_item_errors(self):
+        office = {'latitude': 9.358667, 'longitude': 76.677296, 'wifi_ssid': 'Company-Secure'}
+        response = self.post([
+            {**office, 'user': self.user.id},
+            {**office, 'user': str(self.user.id)},
+            {**office, 'user': [self.user.id]},
+            {**office, 'user': 'abc'},
+            {**office, 'user': True},
+            {**office, 'user': 999999},
+            'not an object',
+            {'latitude': 'north', 'longitude': 76},
+            {'latitude': 'nan', 'longitude': 76},
+            {'wifi_ssid': ['Corp']},
+            office,
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual(results[0]['user'], self.user.id)
+        self.assertIn('overall_access', results[0])
+        self.assertEqual(results[1]['user'], self.user.id)
+        self.assertIn('overall_access', results[1])
+        for result in results[2:5]:
+            self.assertEqual(result['error'], 'Invalid user id')
+        self.assertEqual(results[5]['error'], 'User not found')
+        self.assertEqual(results[6]['error'], 'Each attempt must be an object')
+        self.assertEqual(results[7]['error'], 'Invalid coordinates')
+        self.assertEqual(results[8]['error'], 'Invalid coordinates')
+        self.assertEqual(results[9]['error'], 'Invalid WiFi network')
+        self.assertEqual(results[10]['user'], self.admin.id)
+        self.assertEqual(UserAccessLog.objects.count(), 3)
+
+    def test_other_users_need_staff(self):
+        self.client.force_authenticate(self.user)
+        response = self.post([{'user': self.admin.id}])
+        self.assertEqual(response.status_code, 403)
+        response = self.post([{'latitude': 9.358667, 'longitude': 76.677296}])
+        self.assertEqual(response.data['results'][0]['user'], self.user.id)
+
+    @override_settings(GEOFENCE_BATCH_MAX_ATTEMPTS=2)
+    def test_batch_size_cap(self):
+        self.assertEqual(self.post([{}, {}, {}]).status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'attempts': 'x'}, format='json').status_code, 400)
+
+
+class AccessGrantTests(TestCase):
+    """Grants verify without re-validating until they expire or the policy changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='remote@example.com', password='pw', employee_id='EMP2',
+                                            is_remote_access_enabled=True)
+        cls.other = User.objects.create_user(email='other@example.com', password='pw', employee_id='EMP3')
+
+    def setUp(self):
+        reset_policy()
+        self.addCleanup(reset_policy)
+        self.result = {'overall_access': True, 'checks': {'remote_access': {'allowed': True}}}
+
+    def test_round_trip(self):
+        token, expires_at = mint_grant(self.user, self.result, '10.0.0.1')
+        claims = verify_grant(token, self.user, '10.0.0.1')
+        self.assertEqual(claims['checks'], ['remote_access'])
+        self.assertTrue(claims['remote'])
+        self.assertGreater(expires_at, timezone.now())
+        self.assertEqual(mint_grant(self.user, {**self.result, 'overall_access': False}), (None, None))
+
+    def test_rejects_wrong_user_ip_or_token(self):
+        token, _ = mint_grant(self.user, self.result, '10.0.0.1')
+        self.assertIsNone(verify_grant(token, self.other, '10.0.0.1'))
+        self.assertIsNone(verify_grant(token, self.user, '10.0.0.2'))
+        self.assertIsNone(verify_grant(token[:-2], self.user, '10.0.0.1'))
+        self.assertIsNone(verify_grant('', self.user, '10.0.0.1'))
+
+    @override_settings(GEOFENCE_GRANT_TTL=60)
+    def test_expiry(self):
+        token, _ = mint_grant(self.user, self.result)
+        later = timezone.now() + timezone.timedelta(seconds=61)
+        with mock.patch('geofencing.grants.timezone.now', return_value=later):
+            self.assertIsNone(verify_grant(token, self.user))
+
+    def test_remote_access_revoked(self):
+        token, _ = mint_grant(self.user, self.result)
+        self.user.is_remote_access_enabled = False
+        self.assertIsNone(verify_grant(token, self.user))
+
+    def test_policy_change_invalidates(self):
+        token, _ = mint_grant(self.user, self.result)
+        with self.captureOnCommitCallbacks(execute=True):
+            AllowedLocation.objects.create(name='Branch', latitude=10, longitude=76, radius_km=1)
+        self.assertIsNone(verify_grant(token, self.user))
+
+    @override_settings(GEOFENCE_POLICY_REFRESH_SECONDS=60)
+    def test_grant_from_fresher_process(self):
+        stale = get_policy()
+        # Another worker has already seen a policy change and minted with it
+        PolicyVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        token, _ = mint_grant(self.user, self.result, policy=get_policy(refresh=True))
+        # This worker still holds the snapshot it polled before the change
+        with mock.patch('geofencing.policy._snapshot', stale):
+            self.assertIs(get_policy(), stale)
+            self.assertIsNotNone(verify_grant(token, self.user))
+
+
+@override_settings(WORK_HOURS_START=0, WORK_HOURS_END=24, AUDIT_LOG_ASYNC=False)
+class GrantRequestTests(TestCase):
+    """Only true-like "grant" values mint a grant, in both validate views"""
+
+    office = {'latitude': '9.358667', 'longitude': '76.677296', 'wifi_ssid': 'Company-Secure'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='pw', employee_id='EMP1')
+
+    def setUp(self):
+        reset_policy()
+        self.addCleanup(reset_policy)
+
+    def test_sync_view(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('validate-access')
+        for value, expected in ((True, True), ('true', True), ('1', True), (1, True),
+                                (False, False), ('false', False), ('0', False), ('', False),
+                                (['true'], False)):
+            response = client.post(url, {**self.office, 'grant': value}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual('grant' in response.data, expected, value)
+
+    async def test_async_view(self):
+        client = AsyncClient()
+        url = reverse('validate-access-async')
+        auth = {'headers': {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}}
+        for value, expected in (('true', True), ('false', False), ({'yes': 1}, False)):
+            response = await client.post(url, {**self.office, 'grant': value},
+                                         content_type='application/json', **auth)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual('grant' in response.json(), expected, value)
+
+
+@override_settings(WORK_HOURS_START=0, WORK_HOURS_END=24, AUDIT_LOG_ASYNC=False)
+class AsyncValidateAccessTests(TestCase):
+    """The async endpoint authenticates like DRF and rejects malformed input"""
+
+    office = {'latitude': '9.358667', 'longitude': '76.677296', 'wifi_ssid': 'Company-Secure'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='pw', employee_id='EMP1')
+
+    def setUp(self):
+        reset_policy()
+        self.addCleanup(reset_policy)
+        self.url = reverse('validate-access-async')
+        self.auth = {'headers': {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}}
+
+    async def test_jwt(self):
+        client = AsyncClient()
+        response = await client.post(self.url, {**self.office, 'grant': True},
+                                     content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        self.assertTrue(body['overall_access'])
+        self.assertIn('grant', body)
+        self.assertIn('grant_expires_at', body)
+        self.assertEqual(await UserAccessLog.objects.filter(user=self.user).acount(), 1)
+
+        response = await client.post(self.url, self.office, content_type='application/json', **self.auth)
+        self.assertNotIn('grant', response.json())
+
+    async def test_unauthenticated(self):
+        client = AsyncClient()
+        response = await client.post(self.url, self.office, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        response = await client.post(self.url, self.office, content_type='application/json',
+                                     headers={'Authorization': 'Bearer not-a-token'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_session_requires_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post(self.url, self.office, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        token = 'a' * 32
+        client.cookies[settings.CSRF_COOKIE_NAME] = token
+        response = client.post(self.url, self.office, content_type='application/json',
+                               headers={'X-CSRFToken': token})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(response.json()['overall_access'])
+
+    async def test_invalid_input(self):
+        client = AsyncClient()
+        for body in ({'latitude': 'north', 'longitude': '76.677296'},
+                     {'latitude': '91', 'longitude': '76.677296'},
+                     {'latitude': 'nan', 'longitude': '76.677296'},
+                     {'wifi_ssid': ['Company-Secure']},
+                     ['not', 'an', 'object']):
+            response = await client.post(self.url, body, content_type='application/json', **self.auth)
+            self.assertEqual(response.status_code, 400, body)
+        response = await client.post(self.url, 'not json', content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(await UserAccessLog.objects.acount(), 0)
+
+
+class DecisionCacheTests(SimpleTestCase):
+    """Cached decisions expire on time"""
+
+    def test_ttl(self):
+        cache = DecisionCache(max_entries=2)
+        with mock.patch('geofencing.decisions.monotonic_time.monotonic', return_value=100.0):
+            cache.put('a', {'overall_access': True}, ttl=10)
+        with mock.patch('geofencing.decisions.monotonic_time.monotonic', return_value=109.0):
+            self.assertEqual(cache.get('a'), {'overall_access': True})
+        with mock.patch('geofencing.decisions.monotonic_time.monotonic', return_value=110.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache.entries), 0)
+
+    def test_bounded(self):
+        cache = DecisionCache(max_entries=2)
+        for key in 'abc':
+            cache.put(key, key, ttl=60)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 'c')
+
+
+@override_settings(WORK_HOURS_START=0, WORK_HOURS_END=24, GEOFENCE_DECISION_GEOHASH_PRECISION=7)
+class CachedDecisionTests(TestCase):
+    """A cached decision answers exactly as a fresh evaluation would"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='pw', employee_id='EMP1')
+        headquarters = AllowedLocation.objects.create(name='HQ', latitude=10, longitude=76, radius_km=5)
+        AllowedWifi.objects.create(location=headquarters, ssid='Corp')
+
+    def setUp(self):
+        reset_policy()
+        self.addCleanup(reset_policy)
+        get_decision_cache().clear()
+        self.addCleanup(get_decision_cache().clear)
+
+    def points_in_one_cell(self, latitude, longitude):
+        row, column = geohash_cell(latitude, longitude, 7)
+        lat_size, lon_size = geohash_cell_size(7)
+        min_lat, min_lon = row * lat_size - 90, column * lon_size - 180
+        return ((min_lat + lat_size * 0.1, min_lon + lon_size * 0.1),
+                (min_lat + lat_size * 0.9, min_lon + lon_size * 0.9))
+
+    def test_distance_is_for_the_actual_point(self):
+        first, second = self.points_in_one_cell(10.01, 76.01)
+        policy = get_policy()
+        self.assertEqual(decision_key(policy, self.user, *first, 'Corp', None),
+                         decision_key(policy, self.user, *second, 'Corp', None))
+        validate_access_conditions(self.user, *first, 'Corp')
+        cached = validate_access_conditions(self.user, *second, 'Corp')
+        get_decision_cache().clear()
+        fresh = validate_access_conditions(self.user, *second, 'Corp')
+        self.assertEqual(cached['checks']['location'], fresh['checks']['location'])
+        self.assertEqual(cached['overall_access'], fresh['overall_access'])
+
+    def test_boundary_cells_are_not_cached(self):
+        policy = get_policy()
+        # 5 km north of HQ the fence edge crosses the cell
+        self.assertIsNone(decision_key(policy, self.user, 10 + 5 / 110.574, 76, 'Corp', None))
+        self.assertIsNotNone(decision_key(policy, self.user, 10.01, 76.01, 'Corp', None))
+        self.assertIsNotNone(decision_key(policy, self.user, 20, 76, 'Corp', None))
+
+    def test_policy_change_invalidates(self):
+        self.assertTrue(validate_access_conditions(self.user, 10.01, 76.01, 'Corp')['overall_access'])
+        with self.captureOnCommitCallbacks(execute=True):
+            AllowedWifi.objects.filter(ssid='Corp').delete()
+        self.assertFalse(validate_access_conditions(self.user, 10.01, 76.01, 'Corp')['overall_access'])
+        with self.captureOnCommitCallbacks(execute=True):
+            headquarters = AllowedLocation.objects.get(name='HQ')
+            headquarters.radius_km = 1
+            headquarters.save()
+        result = validate_access_conditions(self.user, 10.01, 76.01, None)
+        self.assertFalse(result['checks']['location']['allowed'])
+
+
+def circle(name, latitude, longitude, radius_km):
+    return {'name': name, 'latitude': latitude, 'longitude': longitude, 'radius_km': radius_km}
+
+
+# Small and cell-spanning fences, overlapping ones (first in order wins), one
+# too wide to bucket, and fences across the antimeridian and near a pole
+TEST_FENCES = [
+    circle('Campus', 9.358667, 76.677296, 0.5),
+    circle('City', 9.4, 76.7, 30),
+    circle('Region', 10.5, 77.5, 400),
+    circle('Dateline', -16.5, 179.98, 15),
+    circle('Pole', 89.95, 10, 12),
+]
+
+
+def points_near_edges(fences, bearings=16):
+    """Points just inside and outside every fence edge, and at its centre"""
+    points = []
+    for fence in fences:
+        centre = (fence['latitude'], fence['longitude'])
+        points.append(centre)
+        for step in range(bearings):
+            for factor in (0.999, 0.9999, 1.0001, 1.001, 1.01):
+                destination = geodesic(kilometers=fence['radius_km'] * factor).destination(
+                    centre, 360 * step / bearings)
+                points.append((destination.latitude, destination.longitude))
+    return points
+
+
+def brute_force_locate(fences, latitude, longitude):
+    for order, fence in enumerate(fences):
+        distance = geodesic((latitude, longitude), (fence['latitude'], fence['longitude'])).kilometers
+        if distance <= fence['radius_km']:
+            return order, distance
+    return None, None
+
+
+class GeofenceIndexTests(SimpleTestCase):
+    """The geohash index answers exactly like a geodesic scan of every fence"""
+
+    def assert_matches_brute_force(self, index, points):
+        for latitude, longitude in points:
+            fence, distance = index.locate(latitude, longitude)
+            expected, expected_distance = brute_force_locate(TEST_FENCES, latitude, longitude)
+            self.assertEqual(fence.order if fence else None, expected, (latitude, longitude))
+            if fence is not None:
+                # Well inside a fence the haversine distance is reported
+                self.assertAlmostEqual(distance, expected_distance, delta=expected_distance * 0.006 + 1e-9)
+
+    def test_points_near_edges(self):
+        for precision in (3, 5, 7):
+            index = GeofenceIndex(TEST_FENCES, precision)
+            self.assert_matches_brute_force(index, points_near_edges(TEST_FENCES))
+
+    def test_points_on_cell_boundaries(self):
+        index = GeofenceIndex(TEST_FENCES, 5)
+        lat_size, lon_size = geohash_cell_size(5)
+        points = []
+        for fence in TEST_FENCES[:2]:
+            row, column = geohash_cell(fence['latitude'], fence['longitude'], 5)
+            for d_row in range(-8, 9):
+                for d_column in range(-8, 9):
+                    latitude = (row + d_row) * lat_size - 90
+                    longitude = (column + d_column) * lon_size - 180
+                    points += [(latitude, longitude), (latitude - 1e-9, longitude - 1e-9)]
+        self.assert_matches_brute_force(index, points)
+
+    def test_bucketing(self):
+        index = GeofenceIndex(TEST_FENCES, 5)
+        wide = {fence.name for fence in index.wide_fences}
+        self.assertEqual(wide, {'Region', 'Dateline', 'Pole'})
+        campus_cells = [cell for cell, fences in index.buckets.items()
+                        if any(fence.name == 'Campus' for fence in fences)]
+        city_cells = [cell for cell, fences in index.buckets.items()
+                      if any(fence.name == 'City' for fence in fences)]
+        self.assertLessEqual(len(campus_cells), 4)
+        self.assertGreater(len(city_cells), 4)
+        self.assertEqual(index.locate(-16.5, -179.99)[0].name, 'Dateline')
+        self.assertEqual(index.locate(89.99, -170)[0].name, 'Pole')
+        self.assertEqual(index.locate(0, 0), (None, None))
+
+
+class VectorizedLocateTests(SimpleTestCase):
+    """The vectorized kernel finds the same fences and distances as the index"""
+
+    def test_matches_index(self):
+        index = GeofenceIndex(TEST_FENCES)
+        points = points_near_edges(TEST_FENCES) + [(0, 0), (-45, -120)]
+        indexes, distances = locate_many([point[0] for point in points], [point[1] for point in points],
+                                         FenceArrays(index.fences))
+        for point, found, distance in zip(points, indexes.tolist(), distances.tolist()):
+            fence, expected = index.locate(*point)
+            if fence is None:
+                self.assertEqual(found, -1, point)
+                self.assertTrue(math.isnan(distance))
+            else:
+                self.assertEqual(found, fence.order, point)
+                self.assertAlmostEqual(distance, expected, places=9)
+
+    def test_no_fences_or_points(self):
+        indexes, distances = locate_many([1.0], [2.0], FenceArrays([]))
+        self.assertEqual(indexes.tolist(), [-1])
+        indexes, distances = locate_many([], [], FenceArrays(GeofenceIndex(TEST_FENCES).fences))
+        self.assertEqual(len(indexes), 0)
+
+
+@override_settings(WORK_HOURS_START=0, WORK_HOURS_END=24)
+class BatchValidationTests(TestCase):
+    """Batches give the same answers whether or not they are vectorized"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='pw', employee_id='EMP1')
+        for fence in TEST_FENCES[:2]:
+            location = AllowedLocation.objects.create(name=fence['name'], latitude=fence['latitude'],
+                                                      longitude=fence['longitude'], radius_km=fence['radius_km'])
+            AllowedWifi.objects.create(location=location, ssid=f'{fence["name"]}-WiFi')
+
+    def setUp(self):
+        reset_policy()
+        self.addCleanup(reset_policy)
+
+    def test_same_results_above_and_below_threshold(self):
+        points = points_near_edges(TEST_FENCES[:2], bearings=8)
+        attempts = [
+            (self.user, f'{latitude:.6f}', f'{longitude:.6f}', ('Campus-WiFi', 'City-WiFi', None)[i % 3])
+            for i, (latitude, longitude) in enumerate(points)
+        ]
+        self.assertGreater(len(attempts), 32)
+        with mock.patch('geofencing.location_utils.VECTORIZE_MIN_POINTS', 10 ** 9):
+            scalar = validate_access_conditions_many(attempts)
+        with mock.patch('geofencing.location_utils.VECTORIZE_MIN_POINTS', 1):
+            vectorized = validate_access_conditions_many(attempts)
+        for expected, result in zip(scalar, vectorized):
+            expected_location = expected['checks']['location']
+            location = result['checks']['location']
+            self.assertAlmostEqual(location.pop('distance_km', 0), expected_location.pop('distance_km', 0),
+                                   places=9)
+            self.assertEqual(result, expected)
+
+
+def ring(*points):
+    return [list(point) for point in points + points[:1]]
+
+
+class PolygonTests(SimpleTestCase):
+    """Polygon fences: holes, edges and GeoJSON validation"""
+
+    # A 4 x 4 degree square with a 2 x 2 hole, and a concave L-shape
+    square = IndexedPolygon(parse_boundary({'type': 'Polygon', 'coordinates': [
+        ring((0, 0), (4, 0), (4, 4), (0, 4)),
+        ring((1, 1), (3, 1), (3, 3), (1, 3)),
+    ]})[0])
+    l_shape = IndexedPolygon(parse_boundary({'type': 'Polygon', 'coordinates': [
+        ring((10, 10), (14, 10), (14, 11), (11, 11), (11, 14), (10, 14)),
+    ]})[0])
+
+    def assert_contains(self, polygon, points, expected):
+        for longitude, latitude in points:
+            self.assertEqual(polygon.contains(latitude, longitude), expected, (longitude, latitude))
+        vectorized = polygon.contains_many(np.array([point[1] for point in points], dtype=float),
+                                           np.array([point[0] for point in points], dtype=float))
+        self.assertEqual(vectorized.tolist(), [expected] * len(points))
+
+    def test_inside_outside_and_holes(self):
+        self.assert_contains(self.square, [(0.5, 0.5), (3.5, 2), (2, 3.5), (0.1, 3.9)], True)
+        self.assert_contains(self.square, [(2, 2), (1.5, 2.5), (-1, 2), (5, 2), (2, 4.5)], False)
+        self.assert_contains(self.l_shape, [(10.5, 13), (13, 10.5), (10.5, 10.5)], True)
+        self.assert_contains(self.l_shape, [(12, 12), (13.9, 13.9), (9, 12)], False)
+
+    def test_edges_and_vertices(self):
+        # Ray casting is half-open: the lower and left edges belong to the
+        # polygon, the upper and right ones to its outside (holes mirror it)
+        self.assert_contains(self.square, [(0, 2), (2, 0), (0, 0), (3, 2), (2, 3)], True)
+        self.assert_contains(self.square, [(4, 2), (2, 4), (4, 4), (0, 4), (4, 0), (1, 2), (2, 1)], False)
+
+    def test_edge_index_crossings(self):
+        self.assertTrue(self.square.crosses_rect(-0.5, -0.5, 0.5, 0.5))
+        self.assertTrue(self.square.crosses_rect(1.5, 2.5, 2.5, 3.5))
+        self.assertFalse(self.square.crosses_rect(0.2, 0.2, 0.8, 0.8))
+        self.assertFalse(self.square.crosses_rect(1.5, 1.5, 2.5, 2.5))
+        self.assertFalse(self.square.crosses_rect(5, 5, 6, 6))
+
+    def test_multipolygon(self):
+        polygons = parse_boundary({'type': 'MultiPolygon', 'coordinates': [
+            [ring((0, 0), (1, 0), (1, 1))],
+            [ring((5, 5), (6, 5), (6, 6))],
+        ]})
+        self.assertEqual(len(polygons), 2)
+        self.assertEqual(polygons[1][0][0], (5.0, 5.0))
+
+    def test_invalid_boundaries(self):
+        invalid = [
+            None,
+            {'type': 'Point', 'coordinates': [0, 0]},
+            {'type': 'Polygon', 'coordinates': []},
+            {'type': 'Polygon', 'coordinates': [[]]},
+            {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 1]]]},  # not closed
+            {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [0, 0]]]},  # too few positions
+            {'type': 'Polygon', 'coordinates': [[[0, 0], [1], [1, 1], [0, 0]]]},
+            {'type': 'Polygon', 'coordinates': [[[0, 0], ['east', 0], [1, 1], [0, 0]]]},
+            {'type': 'Polygon', 'coordinates': [ring((0, 0), (1, 0), (1, 95))]},
+            {'type': 'Polygon', 'coordinates': [ring((170, 0), (-170, 0), (-170, 5))]},
+            {'type': 'MultiPolygon', 'coordinates': [[]]},
+        ]
+        for geometry in invalid:
+            with self.assertRaises(ValueError, msg=geometry):
+                parse_boundary(geometry)
+
+
+NEW_YORK = ZoneInfo('America/New_York')
+UTC = ZoneInfo('UTC')
+
+
+def at(day, hour, minute=0, tz=UTC):
+    # October 2026: the 19th is a Monday, so day 0-6 is Monday-Sunday
+    return datetime(2026, 10, 19 + day, hour, minute, tzinfo=tz)
+
+
+class WeeklyScheduleTests(SimpleTestCase):
+    """Merged weekly work-hours intervals"""
+
+    def test_day_window(self):
+        schedule = WeeklySchedule([(0, time(9), time(17))])
+        self.assertFalse(schedule.is_open(at(0, 8, 59)))
+        self.assertTrue(schedule.is_open(at(0, 9)))
+        self.assertFalse(schedule.is_open(at(0, 17)))
+        self.assertEqual(schedule.window_end(at(0, 12)), at(0, 17))
+        self.assertIsNone(schedule.window_end(at(0, 18)))
+        self.assertEqual(schedule.next_change(at(0, 18)), at(7, 9))
+        self.assertEqual(schedule.seconds_until_change(at(0, 16, 30)), 1800)
+
+    def test_overnight_window(self):
+        schedule = WeeklySchedule([(2, time(22), time(6))])
+        self.assertTrue(schedule.is_open(at(2, 23)))
+        self.assertTrue(schedule.is_open(at(3, 5, 59)))
+        self.assertFalse(schedule.is_open(at(3, 6)))
+        self.assertFalse(schedule.is_open(at(2, 21)))
+        self.assertEqual(schedule.window_end(at(2, 23)), at(3, 6))
+        self.assertEqual(schedule.windows_for(2), [(time(22), time(6))])
+        self.assertEqual(schedule.windows_for(3), [])
+
+    def test_sunday_night_wraps_to_monday(self):
+        schedule = WeeklySchedule([(6, time(22), time(2)), (0, time(0), time(9))])
+        self.assertTrue(schedule.is_open(at(6, 23)))
+        self.assertTrue(schedule.is_open(at(7, 1)))
+        self.assertTrue(schedule.is_open(at(0, 8)))
+        self.assertFalse(schedule.is_open(at(0, 9)))
+        # The Sunday shift runs on into Monday's window without a change
+        self.assertEqual(schedule.window_end(at(6, 23)), at(7, 9))
+        self.assertEqual(schedule.window_end(at(0, 1)), at(0, 9))
+        self.assertEqual(schedule.next_change(at(6, 12)), at(6, 22))
+
+        wrap_only = WeeklySchedule([(6, time(22), time(2))])
+        self.assertTrue(wrap_only.is_open(at(0, 1)))
+        self.assertEqual(wrap_only.window_end(at(6, 23)), at(7, 2))
+        self.assertEqual(wrap_only.next_change(at(0, 3)), at(6, 22))
+
+    def test_always_open_and_closed_days(self):
+        always = WeeklySchedule([(day, time(0), time.max) for day in range(7)])
+        self.assertTrue(always.always_open)
+        self.assertTrue(always.is_open(at(3, 12)))
+        self.assertIsNone(always.next_change(at(3, 12)))
+        self.assertIsNone(always.window_end(at(3, 12)))
+        self.assertIsNone(always.seconds_until_change(at(3, 12)))
+
+        weekdays = WeeklySchedule([(day, time(9), time(17)) for day in range(5)])
+        self.assertFalse(weekdays.always_open)
+        self.assertFalse(weekdays.is_open(at(5, 12)))
+        self.assertEqual(weekdays.windows_for(5), [])
+        self.assertEqual(weekdays.next_change(at(4, 18)), at(7, 9))
+
+        closed = WeeklySchedule([])
+        self.assertFalse(closed.is_open(at(0, 12)))
+        self.assertIsNone(closed.next_change(at(0, 12)))
+
+    def test_across_dst_changes(self):
+        # 2026-03-08 and 2026-11-01 are Sundays; clocks jump at 02:00
+        spring = WeeklySchedule([(6, time(1), time(5))])
+        now = datetime(2026, 3, 8, 1, 30, tzinfo=NEW_YORK)
+        self.assertEqual(spring.window_end(now), datetime(2026, 3, 8, 5, tzinfo=NEW_YORK))
+        self.assertEqual(spring.seconds_until_change(now), 2.5 * 3600)
+
+        fall = WeeklySchedule([(6, time(0), time(4))])
+        now = datetime(2026, 11, 1, 0, 30, tzinfo=NEW_YORK)
+        self.assertEqual(fall.window_end(now), datetime(2026, 11, 1, 4, tzinfo=NEW_YORK))
+        self.assertEqual(fall.seconds_until_change(now), 4.5 * 3600)
+
+
+@override_settings(TIME_ZONE='UTC')
+class CheckTimeAccessTests(TestCase):
+    def setUp(self):
+        reset_policy()
+        self.addCleanup(reset_policy)
+        WorkHours.objects.create(day=0, start_time=time(9), end_time=time(17))
+        AllowedLocation.objects.create(name='Tokyo', latitude=35.68, longitude=139.69, radius_km=1,
+                                       time_zone='Asia/Tokyo')
+        AllowedLocation.objects.create(name='Default', latitude=10, longitude=76, radius_km=1)
+
+    def test_work_hours_follow_the_location_time_zone(self):
+        now = at(0, 1)  # 10:00 in Tokyo
+        tokyo = check_time_access(now, location_name='Tokyo')
+        self.assertTrue(tokyo['allowed'])
+        self.assertEqual(tokyo['current_time'], '10:00:00')
+        self.assertEqual(tokyo['window_end'], '2026-10-19T17:00:00+09:00')
+
+        default = check_time_access(now, location_name='Default')
+        self.assertFalse(default['allowed'])
+        self.assertEqual(default['reason'], 'Access allowed only between 09:00 and 17:00')
+        self.assertEqual(check_time_access(now)['current_time'], '01:00:00')
+
+    def test_closed_day_reason(self):
+        result = check_time_access(at(1, 12), location_name='Default')
+        self.assertFalse(result['allowed'])
+        self.assertEqual(result['reason'], 'No work hours on Tuesday')
@@ -20,4 +20,6 @@ urlpatterns = [
     
     # Access validation
     path('validate-access/', views.ValidateAccessView.as_view(), name='validate-access'),
+    path('validate-access/async/', views.AsyncValidateAccessView.as_view(), name='validate-access-async'),
+    path('validate-access/batch/', views.BatchValidateAccessView.as_view(), name='validate-access-batch'),
 ]
\ No newline at end of file
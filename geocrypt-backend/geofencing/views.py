@@ -1,16 +1,33 @@
 from django.shortcuts import render
 
 # Create your views here.
-from rest_framework import generics, views, status
+import json
+
+from asgiref.sync import sync_to_async
+from rest_framework import generics, views, status, exceptions, serializers
+from rest_framework.authentication import SessionAuthentication
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from django.conf import settings
+from django.contrib.auth import get_user, get_user_model
+from django.http import JsonResponse
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 
 from .models import AllowedLocation, AllowedWifi, WorkHours, AccessRule, UserAccessLog
 from .serializers import (AllowedLocationSerializer, AllowedWifiSerializer,
                          WorkHoursSerializer, AccessRuleSerializer,
                          UserAccessLogSerializer)
-from .location_utils import validate_access_conditions
+from .grants import mint_grant
+from .location_utils import (avalidate_access_conditions, validate_access_conditions,
+                             validate_access_conditions_many)
+from .policy import aget_policy
+from monitoring.audit import aaudit_log, audit_log
 
 
 class AllowedLocationListCreateView(generics.ListCreateAPIView):
@@ -70,7 +87,13 @@ class AccessRuleDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 
 class ValidateAccessView(views.APIView):
-    """Validate access conditions for a user"""
+    """
+    Validate access conditions for a user.
+
+    Send "grant": true to also receive a short-lived signed access grant
+    when access is allowed; file downloads accept it in the X-Access-Grant
+    header instead of re-validating every time.
+    """
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
@@ -78,20 +101,239 @@ class ValidateAccessView(views.APIView):
         latitude = request.data.get('latitude')
         longitude = request.data.get('longitude')
         wifi_ssid = request.data.get('wifi_ssid')
+        wifi_bssid = request.data.get('wifi_bssid')
         
         # Validate access conditions
-        result = validate_access_conditions(user, latitude, longitude, wifi_ssid)
+        result = validate_access_conditions(user, latitude, longitude, wifi_ssid, wifi_bssid)
         
         # Log access attempt
-        UserAccessLog.objects.create(
+        audit_log(
+            UserAccessLog,
             user=user,
             latitude=latitude,
             longitude=longitude,
             ip_address=request.META.get('REMOTE_ADDR', ''),
             wifi_ssid=wifi_ssid or '',
+            wifi_bssid=wifi_bssid or '',
+            access_granted=result['overall_access'],
+            reason='; '.join(result['reasons']) if result['reasons'] else 'Access granted',
+            is_suspicious=False  # AI monitoring will update this
+        )
+        
+        if wants_grant(request.data):
+            grant, expires_at = mint_grant(user, result, request.META.get('REMOTE_ADDR', ''))
+            if grant:
+                result = {**result, 'grant': grant, 'grant_expires_at': expires_at.isoformat()}
+        
+        return Response(result)
+
+
+def parse_access_attempt(data):
+    """
+    Return (latitude, longitude, wifi_ssid, wifi_bssid) from an access
+    attempt, or raise ValueError saying what is wrong with it
+    """
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+    if latitude and longitude:
+        try:
+            valid = abs(float(latitude)) <= 90 and abs(float(longitude)) <= 180
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            raise ValueError('Invalid coordinates')
+    wifi_ssid = data.get('wifi_ssid')
+    wifi_bssid = data.get('wifi_bssid')
+    if not all(value is None or isinstance(value, str) for value in (wifi_ssid, wifi_bssid)):
+        raise ValueError('Invalid WiFi network')
+    return latitude, longitude, wifi_ssid, wifi_bssid
+
+
+def wants_grant(data):
+    """Whether an access attempt asks for a grant ("grant": true, "true", "1", ...)"""
+    value = data.get('grant')
+    return isinstance(value, (bool, int, str)) and value in serializers.BooleanField.TRUE_VALUES
+
+
+async def aauthenticate(request):
+    """
+    Resolve the user of an async request: a JWT bearer token first (one
+    async ORM lookup), then the session with DRF's CSRF check.
+
+    Returns None if the request is not authenticated; raises DRF
+    AuthenticationFailed/PermissionDenied for bad tokens or CSRF failures.
+    """
+    jwt = JWTAuthentication()
+    header = jwt.get_header(request)
+    raw_token = jwt.get_raw_token(header) if header is not None else None
+    if raw_token is not None:
+        token = jwt.get_validated_token(raw_token)
+        try:
+            user_id = token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+        try:
+            user = await get_user_model().objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+        except get_user_model().DoesNotExist:
+            raise exceptions.AuthenticationFailed('User not found')
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User is inactive')
+        return user
+
+    user = await sync_to_async(get_user)(request)
+    if not user.is_authenticated:
+        return None
+    SessionAuthentication().enforce_csrf(request)
+    return user
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncValidateAccessView(View):
+    """
+    Async (ASGI) equivalent of ValidateAccessView for high-frequency polling.
+
+    Authentication is one async user lookup, the checks run from the
+    in-memory policy snapshot and the UserAccessLog row goes to the audit
+    sink, so no worker thread is held per poll.
+    """
+    http_method_names = ['post', 'options']
+
+    async def post(self, request):
+        try:
+            user = await aauthenticate(request)
+        except exceptions.APIException as e:
+            detail = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+            return JsonResponse(detail, status=e.status_code)
+        if user is None:
+            return JsonResponse(
+                {'detail': 'Authentication credentials were not provided.'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            latitude, longitude, wifi_ssid, wifi_bssid = parse_access_attempt(data)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        ip_address = request.META.get('REMOTE_ADDR', '')
+        
+        # Validate access conditions
+        result = await avalidate_access_conditions(user, latitude, longitude, wifi_ssid, wifi_bssid)
+        
+        # Log access attempt
+        await aaudit_log(
+            UserAccessLog,
+            user=user,
+            latitude=latitude,
+            longitude=longitude,
+            ip_address=ip_address,
+            wifi_ssid=wifi_ssid or '',
+            wifi_bssid=wifi_bssid or '',
             access_granted=result['overall_access'],
             reason='; '.join(result['reasons']) if result['reasons'] else 'Access granted',
             is_suspicious=False  # AI monitoring will update this
         )
         
-        return Response(result)
\ No newline at end of file
+        if wants_grant(data):
+            grant, expires_at = mint_grant(user, result, ip_address, policy=await aget_policy())
+            if grant:
+                result = {**result, 'grant': grant, 'grant_expires_at': expires_at.isoformat()}
+        
+        return JsonResponse(result)
+
+
+class BatchValidateAccessView(views.APIView):
+    """
+    Validate many access attempts in one request.
+
+    Expects {"attempts": [{"latitude", "longitude", "wifi_ssid", "wifi_bssid"}]}.
+    Admins may validate on behalf of other users by adding "user" (an id) to
+    an attempt; everyone else can only validate their own attempts.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        attempts = request.data.get('attempts')
+        if not isinstance(attempts, list) or not attempts:
+            return Response(
+                {'error': 'Provide a non-empty "attempts" list'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        max_attempts = getattr(settings, 'GEOFENCE_BATCH_MAX_ATTEMPTS', 1000)
+        if len(attempts) > max_attempts:
+            return Response(
+                {'error': f'At most {max_attempts} attempts per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        results = [None] * len(attempts)
+        parsed = []
+        for index, attempt in enumerate(attempts):
+            try:
+                parsed.append((index, self.parse_attempt(attempt)))
+            except ValueError as e:
+                results[index] = {'error': str(e)}
+        
+        user_ids = {attempt[0] for _, attempt in parsed if attempt[0] is not None}
+        if user_ids and not request.user.is_staff:
+            return Response(
+                {'error': 'Only administrators can validate access for other users'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        users = get_user_model().objects.in_bulk(user_ids)
+        
+        valid = []
+        for index, (user_id, latitude, longitude, wifi_ssid, wifi_bssid) in parsed:
+            user = request.user
+            if user_id is not None:
+                user = users.get(user_id)
+                if user is None:
+                    results[index] = {'user': user_id, 'error': 'User not found'}
+                    continue
+            valid.append((index, user, latitude, longitude, wifi_ssid, wifi_bssid))
+        
+        # Validate access conditions
+        checks = validate_access_conditions_many([attempt[1:] for attempt in valid])
+        
+        # Log all attempts at once
+        ip_address = request.META.get('REMOTE_ADDR', '')
+        logs = []
+        for (index, user, latitude, longitude, wifi_ssid, wifi_bssid), result in zip(valid, checks):
+            results[index] = {'user': user.id, **result}
+            logs.append(UserAccessLog(
+                user=user,
+                latitude=latitude or None,
+                longitude=longitude or None,
+                ip_address=ip_address,
+                wifi_ssid=wifi_ssid or '',
+                wifi_bssid=wifi_bssid or '',
+                access_granted=result['overall_access'],
+                reason='; '.join(result['reasons']) if result['reasons'] else 'Access granted',
+                is_suspicious=False  # AI monitoring will update this
+            ))
+        UserAccessLog.objects.bulk_create(logs)
+        
+        return Response({'results': results})
+
+    @staticmethod
+    def parse_attempt(attempt):
+        """
+        Return (user id or None, latitude, longitude, wifi_ssid, wifi_bssid)
+        for one attempt, or raise ValueError saying what is wrong with it
+        """
+        if not isinstance(attempt, dict):
+            raise ValueError('Each attempt must be an object')
+        user_id = attempt.get('user')
+        if user_id is not None:
+            if isinstance(user_id, bool) or not isinstance(user_id, (int, str)):
+                raise ValueError('Invalid user id')
+            try:
+                user_id = int(user_id)
+            except ValueError:
+                raise ValueError('Invalid user id')
+        return (user_id, *parse_access_attempt(attempt))
@@ -0,0 +1,92 @@
+import threading
+
+
+def normalize_bssid(bssid):
+    """Canonical lower-case, colon-separated form of an access point MAC"""
+    if not bssid:
+        return ''
+    return bssid.strip().lower().replace('-', ':')
+
+
+class WifiIndex:
+    """
+    Hash index over allowed WiFi networks.
+
+    Rows without a BSSID allow their SSID from any access point and go in
+    `ssid -> locations`. Rows with a BSSID pin the SSID to that access point
+    and go in `bssid -> (ssid, location)`, so a client reporting another AP
+    for a pinned SSID is not accepted. Clients that cannot read the BSSID
+    (browsers never can) are matched on the SSID alone, pinned or not, via
+    `pinned_ssid_locations`. Rows are tracked by key, so a single row can be
+    added, changed or removed without rebuilding the rest of the index.
+    """
+
+    def __init__(self, version=0):
+        self.version = version
+        self.rows = {}
+        self.ssid_locations = {}
+        self.pinned_ssid_locations = {}
+        self.bssid_locations = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_locations(cls, locations, version=0):
+        """Index the `allowed_wifi_ssids`/`allowed_wifi_bssids` of location dicts"""
+        index = cls(version)
+        for location in locations:
+            for ssid in location.get('allowed_wifi_ssids', []):
+                index.add(('settings', location['name'], ssid), ssid, '', location['name'])
+            for bssid, ssid in location.get('allowed_wifi_bssids', {}).items():
+                index.add(('settings', location['name'], bssid), ssid, bssid, location['name'])
+        return index
+
+    def add(self, key, ssid, bssid, location_name):
+        """Add or replace the row stored under `key`"""
+        bssid = normalize_bssid(bssid)
+        with self.lock:
+            self._remove(key)
+            self.rows[key] = (ssid, bssid, location_name)
+            if bssid:
+                self.bssid_locations[bssid] = (ssid, location_name)
+                _count(self.pinned_ssid_locations, ssid, location_name, 1)
+            else:
+                _count(self.ssid_locations, ssid, location_name, 1)
+
+    def remove(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        ssid, bssid, location_name = row
+        if bssid:
+            if self.bssid_locations.get(bssid) == (ssid, location_name):
+                del self.bssid_locations[bssid]
+            _count(self.pinned_ssid_locations, ssid, location_name, -1)
+        else:
+            _count(self.ssid_locations, ssid, location_name, -1)
+
+    def locations_for(self, ssid, bssid=None):
+        """Names of the locations a network is allowed at, in O(1)"""
+        bssid = normalize_bssid(bssid)
+        if bssid:
+            pinned = self.bssid_locations.get(bssid)
+            if pinned is not None and (not ssid or pinned[0] == ssid):
+                return [pinned[1]]
+            # Any other reported AP only matches SSIDs that are not pinned
+            return list(self.ssid_locations.get(ssid, ()))
+        locations = dict.fromkeys(self.ssid_locations.get(ssid, ()))
+        locations.update(dict.fromkeys(self.pinned_ssid_locations.get(ssid, ())))
+        return list(locations)
+
+
+def _count(index, ssid, location_name, delta):
+    """Adjust the number of rows allowing `ssid` at a location"""
+    locations = index.setdefault(ssid, {})
+    locations[location_name] = locations.get(location_name, 0) + delta
+    if not locations[location_name]:
+        del locations[location_name]
+    if not locations:
+        del index[ssid]
@@ -0,0 +1,307 @@
+import atexit
+import contextlib
+import json
+import logging
+import os
+import queue
+import threading
+import time as monotonic_time
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; the spill file is then only safe within one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def _prepare(model, fields):
+    """
+    Turn create() keyword arguments into column values: related objects
+    become their primary keys, and timestamps defaulting to now are taken
+    when the event happens rather than when it is written
+    """
+    prepared = {}
+    for name, value in fields.items():
+        field = model._meta.get_field(name)
+        if field.is_relation and value is not None:
+            value = getattr(value, 'pk', value)
+        prepared[field.attname] = value
+    for field in model._meta.concrete_fields:
+        if field.default is timezone.now and field.attname not in prepared:
+            prepared[field.attname] = timezone.now()
+    return prepared
+
+
+@contextlib.contextmanager
+def _file_lock(path, blocking=True):
+    """
+    Hold an exclusive flock on `path` across processes. Yields False when
+    `blocking` is off and another process holds it.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as lock_file:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class AuditSink:
+    """
+    In-process queue of audit rows written by a background thread.
+
+    Rows are inserted with one bulk_create per model once AUDIT_BATCH_SIZE
+    rows are waiting or AUDIT_FLUSH_SECONDS have passed. When the queue is
+    full, callers wait up to AUDIT_ENQUEUE_TIMEOUT for room (backpressure)
+    and then append the row to a local spill file instead; async callers do
+    not wait and spill from a worker thread. Rows that cannot be written
+    because the database is unavailable go there too. The spill file is
+    replayed by the writer, so rows are written at least once.
+
+    The spill file may be shared by every worker process: appends and the
+    hand-over to a replay hold flocks on sibling .lock files. Rows still
+    queued in memory are only written by the thread or at exit, so they are
+    lost if the process is killed (SIGKILL, OOM killer) before a flush.
+    """
+
+    def __init__(self, batch_size, flush_seconds, queue_size, enqueue_timeout, spill_path):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue_size = queue_size
+        self.enqueue_timeout = enqueue_timeout
+        self.spill_path = str(spill_path)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.spill_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.closed = False
+
+    def record(self, model, fields):
+        """Queue a row, waiting for room up to enqueue_timeout, else spill it"""
+        event = (model._meta.label_lower, _prepare(model, fields))
+        self._ensure_started()
+        try:
+            self.queue.put(event, timeout=self.enqueue_timeout)
+        except queue.Full:
+            # The writer is falling behind; keep the row on disk instead
+            self.spill([event])
+
+    def offer(self, model, fields):
+        """
+        Queue a row without waiting. Returns it as a spill event if the
+        queue is full, for the caller to spill off its own thread.
+        """
+        event = (model._meta.label_lower, _prepare(model, fields))
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            return event
+        return None
+
+    def _ensure_started(self):
+        if self.pid == os.getpid() and self.thread is not None and self.thread.is_alive():
+            return
+        with self.start_lock:
+            if self.pid == os.getpid() and self.thread is not None and self.thread.is_alive():
+                return
+            if self.pid != os.getpid():
+                # A forked worker must not share its parent's queue
+                self.queue = queue.Queue(maxsize=self.queue_size)
+                atexit.register(self.close)
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        replayed_at = 0
+        while not self.closed:
+            try:
+                batch = self._collect()
+                close_old_connections()
+                if batch:
+                    self.write(batch)
+                elif monotonic_time.monotonic() - replayed_at > self.flush_seconds * 30:
+                    replayed_at = monotonic_time.monotonic()
+                    self.replay_spill()
+            except Exception:
+                logger.exception('Audit writer error')
+
+    def _collect(self):
+        batch = []
+        deadline = monotonic_time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - monotonic_time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def write(self, events):
+        """Insert rows grouped by model; spill whatever the database refuses"""
+        grouped = {}
+        for label, fields in events:
+            grouped.setdefault(label, []).append(fields)
+        pending = list(grouped.items())
+        while pending:
+            label, rows = pending[0]
+            model = apps.get_model(label)
+            try:
+                try:
+                    with transaction.atomic():
+                        model.objects.bulk_create([model(**row) for row in rows])
+                except IntegrityError:
+                    self._write_each(model, rows)
+            except DatabaseError:
+                logger.exception('Audit log write failed; spilling %d rows', len(events))
+                self.spill([(label, row) for label, rows in pending for row in rows])
+                return
+            pending.pop(0)
+
+    def _write_each(self, model, rows):
+        # One bad row (e.g. its file was deleted meanwhile) must not cost
+        # the rest of the batch
+        for row in rows:
+            try:
+                with transaction.atomic():
+                    model.objects.create(**row)
+            except IntegrityError:
+                logger.warning('Dropping audit row for %s: %r', model._meta.label, row)
+
+    def spill(self, events):
+        lines = ''.join(
+            json.dumps({'model': label, 'fields': fields}, cls=DjangoJSONEncoder) + '\n'
+            for label, fields in events
+        )
+        with self.spill_lock, _file_lock(self.spill_path + '.lock'):
+            with open(self.spill_path, 'a', encoding='utf-8') as spill_file:
+                spill_file.write(lines)
+                spill_file.flush()
+                os.fsync(spill_file.fileno())
+
+    def replay_spill(self):
+        """Write rows left in the spill file, e.g. by an outage or a crash"""
+        # One replaying process at a time; the others leave it to that one
+        with _file_lock(self.spill_path + '.replay.lock', blocking=False) as acquired:
+            if acquired:
+                self._replay_spill()
+
+    def _replay_spill(self):
+        replay_path = self.spill_path + '.replay'
+        if not os.path.exists(replay_path):
+            # Renamed under the append lock, so no writer still holds the
+            # file open; new rows start a fresh spill file
+            with self.spill_lock, _file_lock(self.spill_path + '.lock'):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replay_path)
+        events = []
+        with open(replay_path, encoding='utf-8') as replay_file:
+            for line in replay_file:
+                try:
+                    entry = json.loads(line)
+                    model = apps.get_model(entry['model'])
+                    fields = {
+                        name: model._meta.get_field(name).to_python(value)
+                        for name, value in entry['fields'].items()
+                    }
+                except (ValueError, KeyError, LookupError, ValidationError):
+                    logger.warning('Skipping unreadable audit spill line: %r', line)
+                    continue
+                events.append((entry['model'], fields))
+        for start in range(0, len(events), self.batch_size):
+            self.write(events[start:start + self.batch_size])
+        os.remove(replay_path)
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        events = self._drain()
+        if events:
+            self.write(events)
+
+    def close(self):
+        self.closed = True
+        events = self._drain()
+        if not events:
+            return
+        try:
+            self.write(events)
+        except Exception:
+            self.spill(events)
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_audit_sink():
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                _sink = AuditSink(
+                    batch_size=getattr(settings, 'AUDIT_BATCH_SIZE', 500),
+                    flush_seconds=getattr(settings, 'AUDIT_FLUSH_SECONDS', 1.0),
+                    queue_size=getattr(settings, 'AUDIT_QUEUE_SIZE', 10000),
+                    enqueue_timeout=getattr(settings, 'AUDIT_ENQUEUE_TIMEOUT', 0.05),
+                    spill_path=getattr(settings, 'AUDIT_SPILL_PATH',
+                                       os.path.join(settings.BASE_DIR, 'audit-spill.jsonl')),
+                )
+    return _sink
+
+
+def audit_log(model, **fields):
+    """
+    Record an audit row (UserActivity, FileAccessLog, UserAccessLog, ...)
+    without a database round trip in the request.
+
+    Takes the same keyword arguments as model.objects.create(). With
+    AUDIT_LOG_ASYNC off, the row is created immediately.
+    """
+    if not getattr(settings, 'AUDIT_LOG_ASYNC', True):
+        model.objects.create(**fields)
+        return
+    get_audit_sink().record(model, fields)
+
+
+async def aaudit_log(model, **fields):
+    """
+    audit_log for async views. Never blocks the event loop: a row that finds
+    the queue full is spilled (flock, fsync) from a worker thread.
+    """
+    if not getattr(settings, 'AUDIT_LOG_ASYNC', True):
+        await model.objects.acreate(**fields)
+        return
+    sink = get_audit_sink()
+    event = sink.offer(model, fields)
+    if event is not None:
+        await sync_to_async(sink.spill, thread_sensitive=False)([event])
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from monitoring.partitioning import (convert_table, create_partitions, detach_partitions,
+                                     partitioned_models, require_postgres)
+
+
+class Command(BaseCommand):
+    help = ('Maintain monthly range partitions of the FileAccessLog and UserAccessLog '
+            'tables on PostgreSQL: create upcoming partitions and detach old ones. '
+            'Run with --convert once to partition the existing tables.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='Convert unpartitioned log tables (locks each table briefly)')
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Create partitions up to this many months ahead')
+        parser.add_argument('--keep-months', type=int, default=None,
+                            help='Detach partitions older than this many months')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print the SQL without running it')
+
+    def handle(self, *args, **options):
+        try:
+            require_postgres()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        dry_run = options['dry_run']
+        for model, column in partitioned_models():
+            table = model._meta.db_table
+            statements = []
+            try:
+                if options['convert']:
+                    statements += convert_table(model, column, dry_run=dry_run)
+                statements += create_partitions(model, column, options['months_ahead'], dry_run=dry_run)
+                if options['keep_months'] is not None:
+                    statements += detach_partitions(model, options['keep_months'], dry_run=dry_run)
+            except DatabaseError as e:
+                raise CommandError(f'{table}: partition maintenance failed: {e}')
+            for statement in statements:
+                self.stdout.write(f'{statement};')
+            prefix = 'Would run' if dry_run else 'Ran'
+            self.stdout.write(self.style.SUCCESS(
+                f'{table}: {prefix} {len(statements)} statements'
+            ))
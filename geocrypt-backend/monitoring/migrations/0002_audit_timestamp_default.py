@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='useractivity',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
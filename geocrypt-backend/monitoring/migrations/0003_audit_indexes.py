@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0002_audit_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='suspiciousactivity',
+            index=models.Index(fields=['-detected_at', '-id'], name='suspicious_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='suspiciousactivity',
+            index=models.Index(fields=['severity', 'is_resolved', '-detected_at'], name='suspicious_severity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='suspiciousactivity',
+            index=models.Index(fields=['is_resolved', '-detected_at'], name='suspicious_resolved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['-timestamp', '-id'], name='useractivity_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['user', '-timestamp'], name='useractivity_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['activity_type', '-timestamp'], name='useractivity_type_time_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0003_audit_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userbehaviorprofile',
+            index=models.Index(fields=['-created_at', '-id'], name='behaviorprofile_created_idx'),
+        ),
+    ]
@@ -3,6 +3,7 @@
 # Create your models here.
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 
 class UserActivity(models.Model):
@@ -23,11 +24,16 @@ class UserActivity(models.Model):
     description = models.TextField()
     ip_address = models.GenericIPAddressField()
     user_agent = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     metadata = models.JSONField(default=dict, blank=True)
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['-timestamp', '-id'], name='useractivity_time_idx'),
+            models.Index(fields=['user', '-timestamp'], name='useractivity_user_time_idx'),
+            models.Index(fields=['activity_type', '-timestamp'], name='useractivity_type_time_idx'),
+        ]
 
 
 class SuspiciousActivity(models.Model):
@@ -53,6 +59,12 @@ class SuspiciousActivity(models.Model):
 
     class Meta:
         ordering = ['-detected_at']
+        indexes = [
+            models.Index(fields=['-detected_at', '-id'], name='suspicious_time_idx'),
+            models.Index(fields=['severity', 'is_resolved', '-detected_at'],
+                         name='suspicious_severity_idx'),
+            models.Index(fields=['is_resolved', '-detected_at'], name='suspicious_resolved_idx'),
+        ]
 
 
 class UserBehaviorProfile(models.Model):
@@ -65,6 +77,11 @@ class UserBehaviorProfile(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='behaviorprofile_created_idx'),
+        ]
+
     def __str__(self):
         return f"Behavior Profile for {self.user.email}"
 
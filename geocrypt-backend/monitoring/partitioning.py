@@ -0,0 +1,209 @@
+import re
+from datetime import date
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.utils import timezone
+
+# (model label, timestamp column) of the log tables that can be partitioned.
+# UserActivity is left out: SuspiciousActivity has a foreign key to it, and
+# Postgres cannot reference a partitioned table by id alone.
+PARTITIONED_LOGS = [
+    ('files.FileAccessLog', 'access_time'),
+    ('geofencing.UserAccessLog', 'access_time'),
+]
+
+INDEX_DEFINITION = re.compile(r'^CREATE INDEX \S+ ON (?:ONLY )?\S+ (USING .*)$')
+UPPER_BOUND = re.compile(r"TO \('(\d{4})-(\d{2})-(\d{2})")
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def current_month():
+    today = timezone.now().date()
+    return date(today.year, today.month, 1)
+
+
+def _bound(month):
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+def require_postgres():
+    if connection.vendor != 'postgresql':
+        raise RuntimeError('Log partitioning is only supported on PostgreSQL')
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def convert_table(model, column, dry_run=False):
+    """
+    Turn an existing log table into a table partitioned by month on
+    `column`. The old table is kept, unchanged, as the partition for
+    everything up to the end of the current month.
+
+    Returns the SQL statements run (or that would be run).
+    """
+    table = model._meta.db_table
+    quote = connection.ops.quote_name
+    bound = add_months(current_month(), 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        if is_partitioned(cursor, table):
+            return []
+        if not dry_run:
+            # Nothing may insert between reading the next id and the swap
+            cursor.execute(f'LOCK TABLE {quote(table)} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes "
+            "WHERE schemaname = current_schema() AND tablename = %s", [table]
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'", [table]
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {quote(table)}')
+        next_id = cursor.fetchone()[0]
+        statements = _conversion_statements(table, column, bound, indexes, foreign_keys, next_id)
+        if not dry_run:
+            for statement in statements:
+                cursor.execute(statement)
+    return statements
+
+
+def _conversion_statements(table, column, bound, indexes, foreign_keys, next_id):
+    legacy = f'{table}_legacy'
+    quote = connection.ops.quote_name
+    sequence = f'{table}_partitioned_id_seq'
+    statements = [f'ALTER TABLE {quote(table)} RENAME TO {quote(legacy)}']
+    # Index names are unique per schema, and the parent takes over the
+    # current names (including the primary key's)
+    for name, _ in indexes:
+        statements.append(f'ALTER INDEX {quote(name)} RENAME TO {quote(name[:52] + "_legacy")}')
+    statements += [
+        f'CREATE TABLE {quote(table)} (LIKE {quote(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        f' PARTITION BY RANGE ({quote(column)})',
+        # A primary key on a partitioned table must include the partition key
+        f'ALTER TABLE {quote(table)} ADD PRIMARY KEY (id, {quote(column)})',
+        f'ALTER TABLE {quote(legacy)} ALTER COLUMN id DROP IDENTITY IF EXISTS',
+        f'CREATE SEQUENCE {quote(sequence)} START WITH {int(next_id)}',
+        f"ALTER TABLE {quote(table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')",
+        f'ALTER SEQUENCE {quote(sequence)} OWNED BY {quote(table)}.id',
+    ]
+    for name, definition in indexes:
+        match = INDEX_DEFINITION.match(definition)
+        if match is None:
+            # Unique indexes (the old primary key) cannot span partitions
+            continue
+        # Same index on the parent, so later migrations still find it by name
+        statements.append(f'CREATE INDEX {quote(name)} ON {quote(table)} {match.group(1)}')
+    for name, definition in foreign_keys:
+        statements.append(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}')
+    statements += [
+        f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(legacy)} '
+        f'FOR VALUES FROM (MINVALUE) TO ({_bound(bound)})',
+        # Catch-all, so inserts never fail if partitions are not created in time
+        f'CREATE TABLE {quote(table + "_default")} PARTITION OF {quote(table)} DEFAULT',
+    ]
+    return statements
+
+
+def create_partitions(model, column, months_ahead, dry_run=False):
+    """
+    Create monthly partitions from next month up to `months_ahead` ahead.
+
+    Rows the DEFAULT partition already holds for a new month (inserted
+    while its partition was missing) are moved into it before it is
+    attached, since Postgres refuses to attach a partition whose range
+    still has rows in DEFAULT.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if not is_partitioned(cursor, table):
+            return []
+        bounds = partition_bounds(cursor, table)
+    # The first month not already covered by an existing partition
+    start = max([upper for upper in bounds.values() if upper] + [add_months(current_month(), 1)])
+    default = next((name for name, upper in sorted(bounds.items()) if upper is None), None)
+    statements = []
+    month = start
+    while month <= add_months(current_month(), months_ahead):
+        statements += _partition_statements(table, column, month, default)
+        month = add_months(month, 1)
+    if statements and default is not None:
+        # No new rows may reach DEFAULT between the moves and the attaches
+        quote = connection.ops.quote_name
+        statements.insert(0, f'LOCK TABLE {quote(default)} IN SHARE ROW EXCLUSIVE MODE')
+    if not dry_run:
+        with transaction.atomic(), connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    return statements
+
+
+def _partition_statements(table, column, month, default):
+    quote = connection.ops.quote_name
+    name = f'{table}_p{month.year:04d}_{month.month:02d}'
+    lower, upper = _bound(month), _bound(add_months(month, 1))
+    statements = [
+        f'CREATE TABLE {quote(name)} (LIKE {quote(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+    ]
+    if default is not None:
+        statements.append(
+            f'WITH moved AS (DELETE FROM {quote(default)} '
+            f'WHERE {quote(column)} >= {lower} AND {quote(column)} < {upper} RETURNING *) '
+            f'INSERT INTO {quote(name)} SELECT * FROM moved'
+        )
+    statements.append(
+        f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(name)} FOR VALUES FROM ({lower}) TO ({upper})'
+    )
+    return statements
+
+
+def partition_bounds(cursor, table):
+    """{partition name: upper bound month (None for the default partition)}"""
+    cursor.execute(
+        "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) "
+        "FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(%s)", [table]
+    )
+    bounds = {}
+    for name, expression in cursor.fetchall():
+        match = UPPER_BOUND.search(expression or '')
+        bounds[name] = date(*map(int, match.groups())) if match else None
+    return bounds
+
+
+def detach_partitions(model, keep_months, dry_run=False):
+    """
+    Detach partitions holding only rows older than `keep_months` months.
+    Detached tables are left in place for archiving or dropping.
+    """
+    table = model._meta.db_table
+    quote = connection.ops.quote_name
+    cutoff = add_months(current_month(), -keep_months)
+    with connection.cursor() as cursor:
+        if not is_partitioned(cursor, table):
+            return []
+        bounds = partition_bounds(cursor, table)
+    statements = [
+        f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}'
+        for name, upper in sorted(bounds.items())
+        if upper is not None and upper <= cutoff
+    ]
+    if not dry_run:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    return statements
+
+
+def partitioned_models():
+    return [(apps.get_model(label), column) for label, column in PARTITIONED_LOGS]
@@ -1,3 +1,319 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import tempfile
+import threading
+from datetime import date
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.utils import timezone
 
 # Create your tests here.
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from geofencing.models import UserAccessLog
+from .audit import AuditSink, _file_lock, _prepare, aaudit_log
+from .models import SuspiciousActivity, UserActivity, UserBehaviorProfile
+from .partitioning import _conversion_statements, create_partitions
+
+
+class ListQueryCountTests(TestCase):
+    """List endpoints must cost the same number of queries however many rows they return"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pw',
+                                             employee_id='ADMIN', is_staff=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.created = 0
+
+    def make_rows(self, count):
+        for i in range(self.created, self.created + count):
+            user = User.objects.create_user(email=f'user{i}@example.com', password='pw',
+                                            employee_id=f'EMP{i}', first_name=f'User{i}')
+            activity = UserActivity.objects.create(user=user, activity_type='LOGIN', description='Login',
+                                                   ip_address='127.0.0.1', user_agent='test')
+            SuspiciousActivity.objects.create(user=user, activity=activity, description='Odd hour',
+                                              severity='LOW', resolved_by=self.admin)
+            UserBehaviorProfile.objects.create(user=user)
+        self.created += count
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, url):
+        self.make_rows(2)
+        few = self.count_queries(url)
+        self.make_rows(10)
+        self.assertEqual(self.count_queries(url), few)
+
+    def test_activities(self):
+        self.assert_constant_queries(reverse('activity-list'))
+
+    def test_suspicious_activities(self):
+        self.assert_constant_queries(reverse('suspicious-list'))
+
+    def test_behavior_profiles(self):
+        self.assert_constant_queries(reverse('behavior-profiles'))
+
+    def test_activities_page_is_bounded(self):
+        self.make_rows(3)
+        response = self.client.get(reverse('activity-list'), {'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+
+class KeysetPaginationTests(TestCase):
+    """Walking the cursor visits every row exactly once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pw',
+                                             employee_id='ADMIN', is_staff=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def walk(self, url, page_size, between_pages=None):
+        ids = []
+        params = {'page_size': page_size}
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(row['id'] for row in response.data['results'])
+            if not response.data['next']:
+                return ids
+            params['cursor'] = response.data['next'].split('cursor=')[1].split('&')[0]
+            if between_pages:
+                between_pages()
+
+    def test_ties_are_broken_by_id(self):
+        now = timezone.now()
+        activities = UserActivity.objects.bulk_create([
+            UserActivity(user=self.admin, activity_type='LOGIN', description=f'Login {i}',
+                         ip_address='127.0.0.1', user_agent='test', timestamp=now)
+            for i in range(7)
+        ])
+        ids = self.walk(reverse('activity-list'), 2)
+        self.assertEqual(ids, sorted((activity.id for activity in activities), reverse=True))
+
+    def test_profiles_updated_mid_walk(self):
+        profiles = []
+        for i in range(6):
+            user = User.objects.create_user(email=f'user{i}@example.com', password='pw', employee_id=f'EMP{i}')
+            profiles.append(UserBehaviorProfile.objects.create(user=user))
+
+        def touch_all():
+            for profile in UserBehaviorProfile.objects.all():
+                profile.save()
+
+        ids = self.walk(reverse('behavior-profiles'), 2, between_pages=touch_all)
+        self.assertEqual(sorted(ids), sorted(profile.id for profile in profiles))
+
+    def test_invalid_cursor(self):
+        url = reverse('activity-list')
+        for position in ([None, 1], ['2026-01-01T00:00:00Z', None], ['2026-01-01T00:00:00Z', True],
+                         ['not a date', 1], [1], 'x'):
+            cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+            self.assertEqual(self.client.get(url, {'cursor': cursor}).status_code, 400, position)
+        self.assertEqual(self.client.get(url, {'cursor': '!!!'}).status_code, 400)
+
+
+class AuditSinkTests(TestCase):
+    """Queued audit rows reach the database in batches, or the spill file"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='audit@example.com', password='pw', employee_id='AUD1')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spill_path = os.path.join(directory.name, 'audit-spill.jsonl')
+        self.sink = AuditSink(batch_size=100, flush_seconds=0.1, queue_size=10,
+                              enqueue_timeout=0, spill_path=self.spill_path)
+
+    def event(self, description):
+        fields = _prepare(UserActivity, {'user': self.user, 'activity_type': 'LOGIN',
+                                         'description': description, 'ip_address': '127.0.0.1'})
+        return ('monitoring.useractivity', fields)
+
+    def test_batched_write(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.sink.write([self.event(f'row {i}') for i in range(50)])
+        self.assertEqual(UserActivity.objects.count(), 50)
+        self.assertEqual(sum('INSERT' in query['sql'] for query in queries), 1)
+
+    def test_bad_row_does_not_cost_the_batch(self):
+        events = [self.event('first'), self.event('orphan'), self.event('last')]
+        events[1][1]['user_id'] = None
+        self.sink.write(events)
+        self.assertEqual(sorted(UserActivity.objects.values_list('description', flat=True)), ['first', 'last'])
+
+    def test_spill_and_replay(self):
+        with mock.patch.object(UserActivity.objects, 'bulk_create', side_effect=OperationalError):
+            self.sink.write([self.event('during outage'), self.event('also')])
+        self.assertFalse(UserActivity.objects.exists())
+        with open(self.spill_path) as spill_file:
+            self.assertEqual(len(spill_file.readlines()), 2)
+
+        self.sink.replay_spill()
+        self.assertEqual(UserActivity.objects.count(), 2)
+        self.assertFalse(os.path.exists(self.spill_path))
+        self.assertFalse(os.path.exists(self.spill_path + '.replay'))
+        self.sink.replay_spill()
+        self.assertEqual(UserActivity.objects.count(), 2)
+
+    def test_full_queue_spills(self):
+        sink = AuditSink(batch_size=100, flush_seconds=0.1, queue_size=1,
+                         enqueue_timeout=0, spill_path=self.spill_path)
+        with mock.patch.object(sink, '_ensure_started'):
+            for description in ('queued', 'spilled'):
+                sink.record(UserActivity, {'user': self.user, 'activity_type': 'LOGIN',
+                                           'description': description, 'ip_address': '127.0.0.1'})
+        self.assertTrue(os.path.exists(self.spill_path))
+        sink.flush()
+        sink.replay_spill()
+        self.assertEqual(sorted(UserActivity.objects.values_list('description', flat=True)), ['queued', 'spilled'])
+
+    @override_settings(AUDIT_LOG_ASYNC=True)
+    async def test_async_overflow_spills_off_the_event_loop(self):
+        sink = AuditSink(batch_size=100, flush_seconds=0.1, queue_size=1,
+                         enqueue_timeout=1, spill_path=self.spill_path)
+        spilled_on = []
+
+        def spill(events):
+            spilled_on.append(threading.get_ident())
+            AuditSink.spill(sink, events)
+
+        fields = {'user': self.user, 'activity_type': 'LOGIN', 'ip_address': '127.0.0.1'}
+        with mock.patch.object(sink, '_ensure_started'), mock.patch.object(sink, 'spill', side_effect=spill), \
+                mock.patch('monitoring.audit.get_audit_sink', return_value=sink):
+            await aaudit_log(UserActivity, description='queued', **fields)
+            await aaudit_log(UserActivity, description='spilled', **fields)
+        self.assertEqual(sink.queue.qsize(), 1)
+        self.assertEqual(len(spilled_on), 1)
+        self.assertNotEqual(spilled_on[0], threading.get_ident())
+        with open(self.spill_path) as spill_file:
+            self.assertIn('"spilled"', spill_file.read())
+
+    def test_replay_left_to_the_process_replaying(self):
+        self.sink.spill([self.event('spilled')])
+        # Another worker holds the replay lock (flock conflicts across open files)
+        with _file_lock(self.spill_path + '.replay.lock') as acquired:
+            self.assertTrue(acquired)
+            self.sink.replay_spill()
+            self.assertFalse(UserActivity.objects.exists())
+            self.assertTrue(os.path.exists(self.spill_path))
+        self.sink.replay_spill()
+        self.assertEqual(UserActivity.objects.count(), 1)
+
+
+@mock.patch('monitoring.partitioning.current_month', return_value=date(2026, 10, 1))
+class PartitioningTests(TestCase):
+    """The SQL generated for converting and extending the partitioned log tables"""
+
+    table = 'geofencing_useraccesslog'
+
+    def test_conversion(self, current_month):
+        indexes = [
+            ('geofencing_useraccesslog_pkey',
+             'CREATE UNIQUE INDEX geofencing_useraccesslog_pkey ON public.geofencing_useraccesslog USING btree (id)'),
+            ('geofencing_useraccesslog_user_id_idx',
+             'CREATE INDEX geofencing_useraccesslog_user_id_idx ON public.geofencing_useraccesslog '
+             'USING btree (user_id)'),
+        ]
+        foreign_keys = [('geofencing_useraccesslog_user_fk', 'FOREIGN KEY (user_id) REFERENCES accounts_user(id)')]
+        statements = _conversion_statements(self.table, 'access_time', date(2026, 11, 1), indexes,
+                                            foreign_keys, 42)
+        self.assertEqual(statements, [
+            'ALTER TABLE "geofencing_useraccesslog" RENAME TO "geofencing_useraccesslog_legacy"',
+            'ALTER INDEX "geofencing_useraccesslog_pkey" RENAME TO "geofencing_useraccesslog_pkey_legacy"',
+            'ALTER INDEX "geofencing_useraccesslog_user_id_idx" '
+            'RENAME TO "geofencing_useraccesslog_user_id_idx_legacy"',
+            'CREATE TABLE "geofencing_useraccesslog" (LIKE "geofencing_useraccesslog_legacy" '
+            'INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE ("access_time")',
+            'ALTER TABLE "geofencing_useraccesslog" ADD PRIMARY KEY (id, "access_time")',
+            'ALTER TABLE "geofencing_useraccesslog_legacy" ALTER COLUMN id DROP IDENTITY IF EXISTS',
+            'CREATE SEQUENCE "geofencing_useraccesslog_partitioned_id_seq" START WITH 42',
+            'ALTER TABLE "geofencing_useraccesslog" ALTER COLUMN id '
+            "SET DEFAULT nextval('geofencing_useraccesslog_partitioned_id_seq')",
+            'ALTER SEQUENCE "geofencing_useraccesslog_partitioned_id_seq" OWNED BY "geofencing_useraccesslog".id',
+            # The unique primary key index is not recreated on the parent
+            'CREATE INDEX "geofencing_useraccesslog_user_id_idx" ON "geofencing_useraccesslog" '
+            'USING btree (user_id)',
+            'ALTER TABLE "geofencing_useraccesslog" ADD CONSTRAINT "geofencing_useraccesslog_user_fk" '
+            'FOREIGN KEY (user_id) REFERENCES accounts_user(id)',
+            'ALTER TABLE "geofencing_useraccesslog" ATTACH PARTITION "geofencing_useraccesslog_legacy" '
+            "FOR VALUES FROM (MINVALUE) TO ('2026-11-01 00:00:00+00')",
+            'CREATE TABLE "geofencing_useraccesslog_default" PARTITION OF "geofencing_useraccesslog" DEFAULT',
+        ])
+
+    def create(self, bounds, months_ahead=2):
+        with mock.patch('monitoring.partitioning.is_partitioned', return_value=True), \
+                mock.patch('monitoring.partitioning.partition_bounds', return_value=bounds):
+            return create_partitions(UserAccessLog, 'access_time', months_ahead, dry_run=True)
+
+    def test_new_partitions_take_their_rows_from_default(self, current_month):
+        statements = self.create({
+            'geofencing_useraccesslog_legacy': date(2026, 11, 1),
+            'geofencing_useraccesslog_default': None,
+        })
+        self.assertEqual(statements, [
+            'LOCK TABLE "geofencing_useraccesslog_default" IN SHARE ROW EXCLUSIVE MODE',
+            'CREATE TABLE "geofencing_useraccesslog_p2026_11" (LIKE "geofencing_useraccesslog" '
+            'INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+            'WITH moved AS (DELETE FROM "geofencing_useraccesslog_default" '
+            'WHERE "access_time" >= \'2026-11-01 00:00:00+00\' AND "access_time" < \'2026-12-01 00:00:00+00\' '
+            'RETURNING *) INSERT INTO "geofencing_useraccesslog_p2026_11" SELECT * FROM moved',
+            'ALTER TABLE "geofencing_useraccesslog" ATTACH PARTITION "geofencing_useraccesslog_p2026_11" '
+            'FOR VALUES FROM (\'2026-11-01 00:00:00+00\') TO (\'2026-12-01 00:00:00+00\')',
+            'CREATE TABLE "geofencing_useraccesslog_p2026_12" (LIKE "geofencing_useraccesslog" '
+            'INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+            'WITH moved AS (DELETE FROM "geofencing_useraccesslog_default" '
+            'WHERE "access_time" >= \'2026-12-01 00:00:00+00\' AND "access_time" < \'2027-01-01 00:00:00+00\' '
+            'RETURNING *) INSERT INTO "geofencing_useraccesslog_p2026_12" SELECT * FROM moved',
+            'ALTER TABLE "geofencing_useraccesslog" ATTACH PARTITION "geofencing_useraccesslog_p2026_12" '
+            'FOR VALUES FROM (\'2026-12-01 00:00:00+00\') TO (\'2027-01-01 00:00:00+00\')',
+        ])
+
+    def test_existing_partitions_are_skipped(self, current_month):
+        bounds = {
+            'geofencing_useraccesslog_legacy': date(2026, 11, 1),
+            'geofencing_useraccesslog_p2026_11': date(2026, 12, 1),
+            'geofencing_useraccesslog_p2026_12': date(2027, 1, 1),
+        }
+        self.assertEqual(self.create(bounds), [])
+        # Without a DEFAULT partition there is nothing to move or lock
+        self.assertEqual(self.create(bounds, months_ahead=3), [
+            'CREATE TABLE "geofencing_useraccesslog_p2027_01" (LIKE "geofencing_useraccesslog" '
+            'INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+            'ALTER TABLE "geofencing_useraccesslog" ATTACH PARTITION "geofencing_useraccesslog_p2027_01" '
+            'FOR VALUES FROM (\'2027-01-01 00:00:00+00\') TO (\'2027-02-01 00:00:00+00\')',
+        ])
+
+    def test_unpartitioned_table(self, current_month):
+        with mock.patch('monitoring.partitioning.is_partitioned', return_value=False):
+            self.assertEqual(create_partitions(UserAccessLog, 'access_time', 3), [])
+
+    def test_command_reports_database_errors(self, current_month):
+        with mock.patch('monitoring.management.commands.partition_audit_logs.require_postgres'), \
+                mock.patch('monitoring.management.commands.partition_audit_logs.create_partitions',
+                           side_effect=OperationalError('updated partition constraint for default partition '
+                                                        'would be violated by some row')):
+            with self.assertRaisesMessage(CommandError, 'files_fileaccesslog: partition maintenance failed'):
+                call_command('partition_audit_logs')
@@ -5,7 +5,11 @@ from rest_framework import generics, views, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.db.models import Count, Q
-from datetime import datetime, timedelta
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import datetime, time, timedelta
+
+from api.pagination import KeysetPagination
 
 from .models import UserActivity, SuspiciousActivity, UserBehaviorProfile
 from .serializers import (UserActivitySerializer, SuspiciousActivitySerializer,
@@ -17,9 +21,11 @@ class UserActivityListView(generics.ListAPIView):
     """List all user activities"""
     serializer_class = UserActivitySerializer
     permission_classes = [IsAdminUser]
+    pagination_class = KeysetPagination
+    keyset_field = 'timestamp'
     
     def get_queryset(self):
-        queryset = UserActivity.objects.all().order_by('-timestamp')
+        queryset = UserActivity.objects.select_related('user').order_by('-timestamp')
         
         # Filter by user if provided
         user_id = self.request.query_params.get('user_id')
@@ -31,12 +37,18 @@ class UserActivityListView(generics.ListAPIView):
         if activity_type:
             queryset = queryset.filter(activity_type=activity_type)
         
-        # Filter by date range
-        start_date = self.request.query_params.get('start_date')
-        end_date = self.request.query_params.get('end_date')
+        # Filter by date range (as a plain timestamp range, so it can use
+        # the timestamp indexes)
+        try:
+            start_date = parse_date(self.request.query_params.get('start_date') or '')
+            end_date = parse_date(self.request.query_params.get('end_date') or '')
+        except ValueError:
+            start_date = end_date = None
         if start_date and end_date:
+            tz = timezone.get_current_timezone()
             queryset = queryset.filter(
-                timestamp__date__range=[start_date, end_date]
+                timestamp__gte=datetime.combine(start_date, time.min, tzinfo=tz),
+                timestamp__lt=datetime.combine(end_date + timedelta(days=1), time.min, tzinfo=tz)
             )
         
         return queryset
@@ -91,9 +103,12 @@ class SuspiciousActivityListView(generics.ListAPIView):
     """List suspicious activities"""
     serializer_class = SuspiciousActivitySerializer
     permission_classes = [IsAdminUser]
+    pagination_class = KeysetPagination
+    keyset_field = 'detected_at'
     
     def get_queryset(self):
-        queryset = SuspiciousActivity.objects.all().order_by('-detected_at')
+        queryset = (SuspiciousActivity.objects.select_related('user', 'resolved_by')
+                    .order_by('-detected_at'))
         
         # Filter by severity
         severity = self.request.query_params.get('severity')
@@ -136,7 +151,11 @@ class UserBehaviorProfileListView(generics.ListAPIView):
     """List all user behavior profiles"""
     serializer_class = UserBehaviorProfileSerializer
     permission_classes = [IsAdminUser]
-    queryset = UserBehaviorProfile.objects.all().order_by('-updated_at')
+    pagination_class = KeysetPagination
+    # created_at never changes, so a profile updated mid-walk is neither
+    # skipped nor listed twice
+    keyset_field = 'created_at'
+    queryset = UserBehaviorProfile.objects.select_related('user').order_by('-created_at')
 
 
 class UserBehaviorProfileDetailView(views.APIView):
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Geofence distance benchmark for GeoCrypt
+Run: python scripts/benchmark_geofence.py --points 1000 100000 1000000 --fences 10
+
+Compares the original per-point geopy loop (one geodesic() per fence)
+against the vectorized haversine kernel, with and without the exact
+geodesic correction near fence edges, and reports points per second.
+The geopy loop is slow, so it is timed on at most --loop-limit points and
+extrapolated beyond that.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from geopy.distance import geodesic
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from geofencing.distance import FenceArrays, locate_many  # noqa: E402
+from geofencing.spatial import Fence  # noqa: E402
+
+
+def make_fences(count, rng):
+    """Office-sized fences scattered around the default office location"""
+    return [
+        {
+            'name': f'Office {i}',
+            'latitude': 9.3587 + rng.uniform(-2, 2),
+            'longitude': 76.6773 + rng.uniform(-2, 2),
+            'radius_km': rng.uniform(0.2, 5.0),
+        }
+        for i in range(count)
+    ]
+
+
+def make_points(count, rng):
+    return (9.3587 + rng.uniform(-2.5, 2.5, count),
+            76.6773 + rng.uniform(-2.5, 2.5, count))
+
+
+def geopy_loop(latitudes, longitudes, locations):
+    """The original check_location_access loop, per point"""
+    matches = []
+    for latitude, longitude in zip(latitudes, longitudes):
+        match = -1
+        for index, location in enumerate(locations):
+            distance = geodesic((latitude, longitude),
+                                (location['latitude'], location['longitude'])).kilometers
+            if distance <= location['radius_km']:
+                match = index
+                break
+        matches.append(match)
+    return np.array(matches)
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return time.perf_counter() - started, result
+
+
+def run_benchmark(point_counts, fence_count, loop_limit, seed):
+    rng = np.random.default_rng(seed)
+    locations = make_fences(fence_count, rng)
+    fence_arrays = FenceArrays(Fence(order, location) for order, location in enumerate(locations))
+
+    print(f"Fences: {fence_count}, CPUs: {os.cpu_count()}")
+    print(f"{'points':>9} {'geopy pts/s':>14} {'numpy pts/s':>14} {'+exact pts/s':>14} "
+          f"{'speed-up':>9} {'mismatches':>11}")
+
+    for count in point_counts:
+        latitudes, longitudes = make_points(count, rng)
+
+        sample = min(count, loop_limit)
+        loop_seconds, expected = timed(
+            lambda: geopy_loop(latitudes[:sample], longitudes[:sample], locations))
+        loop_rate = sample / loop_seconds
+
+        fast_seconds, _ = timed(
+            lambda: locate_many(latitudes, longitudes, fence_arrays, exact=False))
+        exact_seconds, (indexes, _) = timed(
+            lambda: locate_many(latitudes, longitudes, fence_arrays, exact=True))
+        exact_rate = count / exact_seconds
+
+        mismatches = int((indexes[:sample] != expected).sum())
+        note = '' if sample == count else '*'
+        print(f"{count:>9} {loop_rate:>13.0f}{note or ' '} {count / fast_seconds:>14.0f} "
+              f"{exact_rate:>14.0f} {exact_rate / loop_rate:>8.0f}x {mismatches:>11}")
+
+    if any(count > loop_limit for count in point_counts):
+        print(f"* geopy rate measured on the first {loop_limit} points")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark geofence distance checks')
+    parser.add_argument('--points', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--fences', type=int, default=10)
+    parser.add_argument('--loop-limit', type=int, default=5000,
+                        help='Most points to run through the slow geopy loop')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run_benchmark(args.points, args.fences, args.loop_limit, args.seed)